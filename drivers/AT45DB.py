@@ -5,6 +5,13 @@ AT45DB_CS_PIN = None
 
 ULTRA_DEEP_CMD = '\x79'
 READ_LOW_POWER = '\x01'  # Continuous Array Read (Low Power Mode)
+BUF1_WRITE_CMD = '\x84'  # Buffer 1 Write
+BUF1_PROGRAM_CMD = '\x83'  # Buffer 1 to Main Memory Page Program with Built-in Erase
+STATUS_READ_CMD = '\xD7'
+STATUS_RDY = 0x80
+
+AT45DB_POLL_MS = 10  # page program is 17ms typ, 40ms max
+AT45DB_POLL_TRIES = 6
 
 AT45DB_PAGE_SIZE = 264
 AT45DB_MAX_BYTES = 122
@@ -34,24 +41,69 @@ def _AT45DB_xfer(data):
 
     return AT45DB_cache
 
+def _AT45DB_cmd(data):
+    """
+    SPI transfer for anything other than a cached read; the response replaces the read cache
+    """
+    global AT45DB_last_addr
+
+    AT45DB_last_addr = -AT45DB_MAX_BYTES
+    return _AT45DB_xfer(data)
+
 def AT45DB_udeep(enable):
-    global AT45DB_sleeping
     """
     Ultra-Deep Power-Down Mode
     Buffer is not maintained
     """
+    global AT45DB_sleeping
+
     if enable and not AT45DB_sleeping:
         #if it's already alseep sending this command will wake it up
         #causing an extra 20uA draw.
         #lets make sure that if it's already asleep we don't send it any more commands
         #before we sleep again.
-        _AT45DB_xfer(ULTRA_DEEP_CMD)  # 3uS max time till in ultra deep sleep
-        already_udeep = True
+        _AT45DB_cmd(ULTRA_DEEP_CMD)  # 3uS max time till in ultra deep sleep
+        AT45DB_sleeping = True
     elif not enable:
-        _AT45DB_xfer('\x00')  # Docs say send arbitrary command to wake
-        already_udeep = False
+        _AT45DB_cmd('\x00')  # Docs say send arbitrary command to wake
+        AT45DB_sleeping = False
         # 240 uS max time to wake
 
+def AT45DB_page_addr(page, offset):
+    """
+    Builds a 3-byte address from a page number and byte offset (264-byte pages)
+    """
+    return chr(page >> 7) + chr(((page << 1) | (offset >> 8)) & 0xFF) + chr(offset & 0xFF)
+
+def AT45DB_buffer_write(offset, data):
+    """
+    Write data into SRAM buffer 1 starting at offset. Lost in ultra-deep power-down.
+    """
+    _AT45DB_cmd(BUF1_WRITE_CMD + AT45DB_page_addr(0, offset) + data)
+
+def AT45DB_buffer_program(page):
+    """
+    Erase a main memory page and program it from buffer 1.
+    Returns immediately; use AT45DB_wait_ready() before sleeping the device.
+    """
+    _AT45DB_cmd(BUF1_PROGRAM_CMD + AT45DB_page_addr(page, 0))
+
+def AT45DB_busy():
+    s = _AT45DB_cmd(STATUS_READ_CMD + '\x00')
+    return not (ord(s[1]) & STATUS_RDY)
+
+def AT45DB_wait_ready():
+    """
+    Sleep the MCU while a page program completes. Returns False if the device never came ready.
+    """
+    tries = AT45DB_POLL_TRIES
+    while AT45DB_busy():
+        if tries == 0:
+            return False
+        tries -= 1
+        sleep(2, -AT45DB_POLL_MS)
+    return True
+
 def AT45DB_lowpwr_read(address, num_bytes):
     """
     Expects a 3-byte address
@@ -1,5 +1,9 @@
 # Copyright (C) 2014 Synapse Wireless, Inc.
 """Definition of Custom passive Sensor LCD interface with XMEGA"""
+
+from hw_defs import XMEGA_WAKE
+from atmega128rfa1_symctr import *
+
 ###############################################################################################
 ###############################################################################################
 ########                     CONSTANTS                                           ##############
@@ -46,6 +50,10 @@ T_ext2 = 0
 
 updateDisplayCallback = None
 
+# Set by the CTLCD_set_* methods when a field changes; CTLCD_updateDisplay() only
+# sends a frame when something actually changed since the last one went out.
+CTLCD_dirty = True
+
 DISABLE_VALUE = 10000
 ERR_VALUE = 10001  # "Err "
 DASH_VALUE = 10002  # "----"
@@ -73,6 +81,29 @@ TXCIE = 0b01000000
 TXC   = 0b01000000
 UDRE  = 0b00100000
 
+# Queued transmit path. Frames are handed to SNAP's interrupt-driven UART0 driver
+# via STDOUT (which must be routed to UART0), one chunk per HOOK_STDOUT callback.
+CMD_TX_CHUNK = 64       # max bytes handed to the native driver per print
+CMD_TX_QUEUE_MAX = 120  # beyond this the queue only holds stale display frames
+
+CMD_TX_TIMEOUT_TICKS = 25  # 4.096ms symbol counter ticks (100ms) to wait for HOOK_STDOUT
+
+cmd_tx_queue = ''
+cmd_tx_busy = False
+cmd_tx_tick = 0  # sym_ticks_4ms() when the last chunk was handed over
+
+# XMEGA wake handshake. XMEGA_WAKE is raised before a frame is queued and held until the
+# queue drains. The long zero preamble is only needed for XMEGA firmware without wake pin
+# support; with the pin, a single guard byte covers clock start-up, and nothing is needed
+# while the display is known to still be awake from the previous frame.
+CTLCD_USE_WAKE_PIN = True
+CMD_PREAMBLE_LEGACY = "\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00"
+CMD_PREAMBLE_WAKE = "\x00"
+CTLCD_AWAKE_TICKS = 12  # 4.096ms symbol counter ticks the XMEGA stays up after XMEGA_WAKE drops
+
+cmd_awake = False  # True once a frame has gone out; see cmd_idle_tick
+cmd_idle_tick = 0  # sym_ticks_4ms() when the queue last drained
+
 ###############################################################################################
 ###############################################################################################
 ########                     Transmit Methods                                    ##############
@@ -81,7 +112,9 @@ UDRE  = 0b00100000
 
 
 def tx_uart0(string):
-    """Takes a SNAPpy string and transmits it out UART0"""
+    """Takes a SNAPpy string and transmits it out UART0.
+       Blocks until the last byte is in the UART; command_port_send() uses the queue instead.
+    """
     status = peek(UCSR0B)
     # disable TX complete interrupt
     status &= ~TXCIE
@@ -103,12 +136,81 @@ def tx_uart0(string):
 
 def command_port_send(type, length, value):
     global testCmd
-    
-    #the XMEGA needs time to wake up...we should send a bunch of zeros
-    # until it wakes up.  The zeros will be discarded on the xmega side
-    #cmd = chr(type) + chr(length) + value
-    testCmd = "\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00" + chr(type) + chr(length) + value
-    tx_uart0(testCmd)
+
+    testCmd = chr(type) + chr(length) + value
+
+    if not CTLCD_USE_WAKE_PIN:
+        #the XMEGA needs time to wake up...we should send a bunch of zeros
+        # until it wakes up.  The zeros will be discarded on the xmega side
+        testCmd = CMD_PREAMBLE_LEGACY + testCmd
+    elif not _cmd_display_awake():
+        writePin(XMEGA_WAKE, True)
+        testCmd = CMD_PREAMBLE_WAKE + testCmd
+
+    cmd_tx_enqueue(testCmd)
+
+
+def _cmd_display_awake():
+    """True if the XMEGA is known to be awake: we are mid-transmit, or only just finished"""
+    if cmd_tx_busy:
+        return True
+    return cmd_awake and sym_elapsed(cmd_idle_tick, sym_ticks_4ms()) < CTLCD_AWAKE_TICKS
+
+
+def cmd_tx_enqueue(frame):
+    """Queue a frame for UART0 and return immediately; it drains in the background"""
+    global cmd_tx_queue
+
+    if len(cmd_tx_queue) + len(frame) > CMD_TX_QUEUE_MAX:
+        # Drop the new frame. The queue may end partway through a frame, so clearing it
+        # would truncate that frame on the wire. CTLCD_updateDisplay() has already cleared
+        # CTLCD_dirty, so mark the display dirty again for the next update to resend it.
+        CTLCD_invalidate()
+        return
+    cmd_tx_queue += frame
+
+    if not cmd_tx_busy:
+        _cmd_tx_pump()
+
+
+def _cmd_tx_pump():
+    """Hand the next chunk of the queue to the native UART0 driver"""
+    global cmd_tx_queue, cmd_tx_busy, cmd_tx_tick
+
+    if cmd_tx_queue == '':
+        if cmd_tx_busy:
+            _cmd_tx_idle()
+        cmd_tx_busy = False
+        return
+
+    cmd_tx_busy = True
+    cmd_tx_tick = sym_ticks_4ms()
+    print cmd_tx_queue[:CMD_TX_CHUNK],
+    cmd_tx_queue = cmd_tx_queue[CMD_TX_CHUNK:]
+
+
+def _cmd_tx_idle():
+    """Queue has drained: release the wake line and note when the XMEGA was last talked to"""
+    global cmd_awake, cmd_idle_tick
+
+    if CTLCD_USE_WAKE_PIN:
+        writePin(XMEGA_WAKE, False)
+    cmd_awake = True
+    cmd_idle_tick = sym_ticks_4ms()
+
+
+def CTLCD_tx_done():
+    """Call from HOOK_STDOUT: the previous chunk is out, send the next one"""
+    _cmd_tx_pump()
+
+
+def CTLCD_tx_busy():
+    """True while queued command port bytes are still going out (don't sleep yet).
+       A chunk with no HOOK_STDOUT after CMD_TX_TIMEOUT_TICKS is taken as sent.
+    """
+    if cmd_tx_busy and sym_elapsed(cmd_tx_tick, sym_ticks_4ms()) > CMD_TX_TIMEOUT_TICKS:
+        _cmd_tx_pump()
+    return cmd_tx_busy
 
 
 ###############################################################################################
@@ -117,52 +219,81 @@ def command_port_send(type, length, value):
 ###############################################################################################
 ###############################################################################################
 def CTLCD_set_Alert(value):
-    global Alert
-    Alert = value
+    global Alert, CTLCD_dirty
+    if value != Alert:
+        Alert = value
+        CTLCD_dirty = True
 
 def CTLCD_set_Battery(value):
-    global Battery
-    Battery = value
-    
+    global Battery, CTLCD_dirty
+    if value != Battery:
+        Battery = value
+        CTLCD_dirty = True
+
 def CTLCD_set_Signal(value):
-    global Signal
-    Signal = value
+    global Signal, CTLCD_dirty
+    if value != Signal:
+        Signal = value
+        CTLCD_dirty = True
 
 def CTLCD_set_Units(value):
-    global Units 
-    Units = value
+    global Units, CTLCD_dirty
+    if value != Units:
+        Units = value
+        CTLCD_dirty = True
 
 def CTLCD_set_T_amb(value):
-    global T_amb
-    T_amb = value
+    global T_amb, CTLCD_dirty
+    if value != T_amb:
+        T_amb = value
+        CTLCD_dirty = True
 
 def CTLCD_set_T_amb_limits(value):
-    global T_amb_limits    
-    T_amb_limits = value
-    
+    global T_amb_limits, CTLCD_dirty
+    if value != T_amb_limits:
+        T_amb_limits = value
+        CTLCD_dirty = True
+
 def CTLCD_set_T_ext1(value):
-    global T_ext1
-    T_ext1 = value
+    global T_ext1, CTLCD_dirty
+    if value != T_ext1:
+        T_ext1 = value
+        CTLCD_dirty = True
 
 def CTLCD_set_T_ext1_limits(value):
-    global T_ext1_limits
-    T_ext1_limits = value
-    
+    global T_ext1_limits, CTLCD_dirty
+    if value != T_ext1_limits:
+        T_ext1_limits = value
+        CTLCD_dirty = True
+
 def CTLCD_set_T_ext2(value):
-    global T_ext2
-    T_ext2 = value
-    
+    global T_ext2, CTLCD_dirty
+    if value != T_ext2:
+        T_ext2 = value
+        CTLCD_dirty = True
+
 def CTLCD_set_T_ext2_limits(value):
-    global T_ext2_limits
-    T_ext2_limits = value
+    global T_ext2_limits, CTLCD_dirty
+    if value != T_ext2_limits:
+        T_ext2_limits = value
+        CTLCD_dirty = True
 
 def CTLCD_set_RH(value):
-    global RH
-    RH = value
+    global RH, CTLCD_dirty
+    if value != RH:
+        RH = value
+        CTLCD_dirty = True
 
 def CTLCD_set_RH_limits(value):
-    global RH_limits
-    RH_limits = value
+    global RH_limits, CTLCD_dirty
+    if value != RH_limits:
+        RH_limits = value
+        CTLCD_dirty = True
+
+def CTLCD_invalidate():
+    """Force the next CTLCD_updateDisplay() to send a frame, e.g. after an XMEGA reset"""
+    global CTLCD_dirty
+    CTLCD_dirty = True
 
 ###############################################################################################
 ###############################################################################################
@@ -229,10 +360,18 @@ def convSignalToLcd(value):
    
 #builds a temperature command tlv string
 def CTLCD_updateDisplay():
-    """ build a tlv string from the variables in this file and update the display """
+    """ build a tlv string from the variables in this file and update the display.
+        Does nothing if no field changed since the last frame was sent, so callers
+        can set fields freely and flush once per cycle.
+    """
     global Alert, Signal, Battery, Units, T_amb, T_amb_limits
     global RH, RH_limits, T_ext1, T_ext1_limits, T_ext2, T_ext2_limits
-    
+    global CTLCD_dirty
+
+    if not CTLCD_dirty:
+        return
+    CTLCD_dirty = False
+
     b0 = Alert << 6
     b0 |= (Signal & 0x7) << 3
     b0 |= (Battery & 0x3) << 1
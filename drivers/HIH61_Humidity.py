@@ -41,13 +41,14 @@ def _HIH61_read_data():
     
 #    print 'i2c=', dumpHex(HIH61_response)    
 
+    # No prints here: stdout is the LCD command port
     if getI2cResult() != 1: # Check i2c result
-        print 'i2c error'
+#        print 'i2c error'
         return False
 
     # Top 2 bits should be 0 for proper operation
     if ord(HIH61_response[0]) >> 6 != 0:
-        print 'invalid status bits'
+#        print 'invalid status bits'
         return False
         
     return True
@@ -75,6 +76,18 @@ def HIH61_get_temp():
 
 
 
+def HIH61_get_raw():
+    """
+    Returns the 4 bytes of the last requested reading as read, or '' if the read failed
+    """
+
+    if HIH61_new_data_avail == True:
+        if _HIH61_read_data() == False:
+            return ''
+
+    return HIH61_response
+
+
 def HIH61_get_humid(offset):
     """
     Returns the result from the last requested reading
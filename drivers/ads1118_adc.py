@@ -4,7 +4,9 @@
     spiInit(False, False, True, True)  # clk idle low, DIN on falling-edge, MSB first, 4-wire
 """
 
-from hw_defs import ADS1118_CS
+from hw_defs import ADS1118_CS, SPI_MISO
+
+ADS_DRDY_WAKE = True  # sleep until DOUT/DRDY falls, else sleep the full conversion time
 
 # Defs for ads_config (channel, range, rate, mode)
 ADS_CH1 = 0x0000       # AINP is AIN0 and AINN is AIN1
@@ -23,6 +25,7 @@ ADS_RATE_128 = 0x0080
 ADS_RATE_250 = 0x00a0
 ADS_RATE_475 = 0x00c0
 ADS_RATE_860 = 0x00e0
+ADS_RATE_MASK = 0x00e0
 ADS_MODE_ADC = 0x0000
 ADS_MODE_TMP = 0x0010  # Temperature data
 ADS_IS_DATA  = 0x0002  # Valid config data, not NOP
@@ -31,6 +34,12 @@ ADS_SNG_SHOT = 0x0100  # Single shot - one conversion then sleep
 ADS_SLEEP    = 0x0100  # Aka "single shot" (SS) mode
 ADS_SS_START = 0x8000  # Start conversion on read() when powered down (data available next read after conversion)
 
+# Worst case ms per conversion, indexed by rate (nominal period plus the 10% oscillator tolerance)
+ads_conv_ms_table = '\x8a\x45\x23\x12\x09\x05\x03\x02'
+
+ads_rate = ADS_RATE_16  # data rate used by the config helpers below and by temp_meas
+ads_timeouts = 0  # DRDY waits that ran out, rolls over
+
 ads_config_i16 = ADS_SS_START | ADS_CH1 | ADS_RNG_256 | ADS_RATE_16 | ADS_MODE_ADC | ADS_IS_DATA
 ads_config_str = "%c%c" % (ads_config_i16 >> 8, ads_config_i16 & 0xff)
 
@@ -69,26 +78,51 @@ def ads_sleep(do_sleep):
 
 def ads_config_internal_temp():
     """Configure for internal temperature sensor"""
-    ads_config_mask(ADS_CH1 | ADS_RNG_256 | ADS_RATE_16 | ADS_MODE_TMP | ADS_SNG_SHOT | ADS_SS_START)
+    ads_config_mask(ADS_CH1 | ADS_RNG_256 | ads_rate | ADS_MODE_TMP | ADS_SNG_SHOT | ADS_SS_START)
 
 def ads_config_ch1_hirez():
     """Configure to measure hi resolution mV source, e.g. K-type thermocouple"""
-    ads_config_mask(ADS_CH1 | ADS_RNG_256 | ADS_RATE_16 | ADS_MODE_ADC | ADS_SNG_SHOT | ADS_SS_START)
+    ads_config_mask(ADS_CH1 | ADS_RNG_256 | ads_rate | ADS_MODE_ADC | ADS_SNG_SHOT | ADS_SS_START)
     
 def ads_conv_internal_temp_C(a2d_value):
     """Return tenths of deg C"""
     t = ((a2d_value >> 2) * 10) / 32
     return t
 
-def ads_wait_conversion():
-    """Block waiting for conversion complete; DOUT/DRDY will go low"""
-    timeout = 2000
+def ads_conv_ms():
+    """Return ms to allow for a conversion at the configured data rate"""
+    return ord(ads_conv_ms_table[(ads_config_i16 & ADS_RATE_MASK) >> 5])
+
+def ads_wait_drdy(max_ms):
+    """Sleep until the selected ADS1118 pulls DOUT/DRDY low, or for at most max_ms.
+       DOUT/DRDY is only driven while CS is low, so CS is held low for the wait.
+       Returns True if data is ready, else counts a timeout in ads_timeouts.
+    """
+    global ads_timeouts
+
     writePin(ADS1118_CS, False)
-    while(readPin(SPI_MISO) == 1) and (timeout > 0):
-        timeout -= 1
-    if timeout == 0:
-        print "ADC READ Timeout=", timeout
+    if readPin(SPI_MISO):
+        wakeupOn(SPI_MISO, True, False)
+        sleep(2, -max_ms)
+        wakeupOn(SPI_MISO, False, False)
+    ready = not readPin(SPI_MISO)
     writePin(ADS1118_CS, True)
+    if not ready:
+        ads_timeouts += 1
+    return ready
+
+def ads_wait_ready():
+    """Wait out the conversion in progress on the selected chip. Returns False on timeout"""
+    if ADS_DRDY_WAKE:
+        return ads_wait_drdy(ads_conv_ms())
+    sleep(2, -ads_conv_ms())
+    return True
+
+def ads_wait_conversion():
+    """Block waiting for conversion complete; DOUT/DRDY will go low.
+       A timeout is only counted in ads_timeouts, as stdout is the LCD command port.
+    """
+    ads_wait_drdy(ads_conv_ms())
 
 def ads_blocking_internal_temp():
     ads_config_internal_temp()
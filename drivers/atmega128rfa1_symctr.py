@@ -42,3 +42,9 @@ def sym_ticks_4ms():
     """Return 16-bit tick count in 4.096ms increments. Rolls every 268 seconds."""
     peek(0xe1)  # Reading LSB latches in counter value
     return peek(0xe2) | (peek(0xe3) << 8)
+
+def sym_elapsed(start, now):
+    """Return ticks from start to now, for any of the tick functions above.
+       Handles counter rollover; valid for spans up to 0x7FFF ticks.
+    """
+    return (now - start) & 0x7FFF
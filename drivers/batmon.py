@@ -14,24 +14,50 @@ BATMON_SNAP_DEFAULT = 0x06
 low_range = (1700, 1750, 1800, 1850, 1900, 1950, 2000, 2050, 2100, 2150, 2200, 2250, 2300, 2350, 2400, 2450)
 high_range = (2550, 2625, 2700, 2775, 2850, 2925, 3000, 3075, 3150, 3225, 3300, 3375, 3450, 3525, 3600, 3675)
 
+batmon_refresh = 120  # batmon_mv() calls between measurements, see batmon_set_refresh()
+batmon_age = 0        # calls since the last measurement, 0 if there is none to reuse
+batmon_cached = 0
+
+
 def batmon_mv():
-    global low_range, high_range
-    
-    i = 16
-    while i > 0:
-        i = i - 1
-        poke(BATMON_REG, BATMON_HR | i)
-        if peek(BATMON_REG) & BATMON_OK:
-            poke(BATMON_REG, BATMON_SNAP_DEFAULT)
-            return high_range[i]
+    """Battery mV. Measured every batmon_refresh calls, or on the first call after batmon_invalidate()"""
+    global batmon_age, batmon_cached
+
+    if batmon_age == 0:
+        batmon_cached = batmon_measure()
+    batmon_age += 1
+    if batmon_age >= batmon_refresh:
+        batmon_age = 0
+    return batmon_cached
+
+def batmon_set_refresh(calls):
+    global batmon_refresh, batmon_age
+    batmon_refresh = calls
+    batmon_age = 0
+
+def batmon_invalidate():
+    """Call after a long heavy load (radio retries, buzzer) so the next reading shows its effect"""
+    global batmon_age
+    batmon_age = 0
 
-    i = 16
-    while i > 0:
-        i = i - 1
-        poke(BATMON_REG, i)
+def batmon_measure():
+    """Binary search of the 32 thresholds (low range, then high range) in 5 probes.
+       Returns the highest threshold the battery is above; the lowest if it is above none.
+    """
+    lo = 0
+    hi = 31
+    while lo < hi:
+        mid = (lo + hi + 1) >> 1
+        if mid >= 16:
+            poke(BATMON_REG, BATMON_HR | (mid - 16))
+        else:
+            poke(BATMON_REG, mid)
         if peek(BATMON_REG) & BATMON_OK:
-            poke(BATMON_REG, BATMON_SNAP_DEFAULT)
-            return low_range[i]
+            lo = mid
+        else:
+            hi = mid - 1
+    poke(BATMON_REG, BATMON_SNAP_DEFAULT)
 
-    return 0
- 
\ No newline at end of file
+    if lo >= 16:
+        return high_range[lo - 16]
+    return low_range[lo]
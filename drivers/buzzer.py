@@ -1,9 +1,29 @@
 # Copyright (C) 2014 Synapse Wireless, Inc.
-"""Buzzer related functions for the remote monitor"""
+"""Buzzer related functions for the remote monitor.
+   Tones come from TMR3 driving OC3B. Patterns are played a note at a time: buzz_play()
+   starts one and returns how long until buzz_step() is due, and so on until it returns 0.
+   The caller times the notes (e.g. with the scheduler), so nothing runs between boundaries.
+   TMR3 stops while the node sleeps, so it must stay awake while buzz_sounding(); rests can
+   be slept through.
+
+   A pattern is a string of (tone, duration) byte pairs: tone in BUZZ_TONE_HZ steps (0 for
+   a rest), duration in BUZZ_TICK_MS steps.
+"""
 
 from hw_defs import *
 from atmega128rfa1_timers import *
 
+BUZZ_TONE_HZ = 10
+BUZZ_TICK_MS = 10
+
+BUZZ_PATTERN_CHIRP = '\x32\x0a'  # 500Hz for 100ms
+BUZZ_PATTERN_WARN = '\x32\x19\x19\x19'  # 500Hz, 250Hz, 250ms each
+BUZZ_PATTERN_CRITICAL = '\x32\x0f\x19\x0f\x00\x0f\x32\x0f\x19\x0f\x00\x0f\x32\x0f\x19\x0f'  # 500Hz, 250Hz, rest, 150ms each, 3 times
+
+buzz_pattern = ''  # pattern playing, '' when idle
+buzz_pos = 0       # offset of the note playing
+buzz_on = False    # a tone (not a rest) is sounding
+
 def init_buzzer():
     setPinDir(BUZZER, True)  # set to output
     writePin(BUZZER, False)
@@ -30,3 +50,45 @@ def _set_buzzer_state(enabled):
         set_tmr_output(TMR3, OCRxB, TMR_OUTP_CLR)  # Enable PWM on pin
     else:
         set_tmr_output(TMR3, OCRxB, TMR_OUTP_OFF)  # Restore pin to regular I/O
+
+def buzz_play(pattern):
+    """Start pattern from its first note, replacing any pattern playing.
+       Returns ms until buzz_step() is due, 0 if there is nothing to play.
+    """
+    global buzz_pattern, buzz_pos
+    buzz_pattern = pattern
+    buzz_pos = -2
+    return buzz_step()
+
+def buzz_step():
+    """Move on to the next note. Returns ms until the next call is due, 0 once the pattern is over"""
+    global buzz_pos, buzz_on
+
+    buzz_pos += 2
+    if buzz_pos + 1 >= len(buzz_pattern):
+        buzz_stop()
+        return 0
+
+    tone = ord(buzz_pattern[buzz_pos])
+    if tone == 0:
+        _set_buzzer_state(False)
+        buzz_on = False
+    else:
+        _set_buzzer_freq(tone * BUZZ_TONE_HZ, True)
+        buzz_on = True
+    return ord(buzz_pattern[buzz_pos + 1]) * BUZZ_TICK_MS
+
+def buzz_stop():
+    """Silence the buzzer and drop the pattern"""
+    global buzz_pattern, buzz_on
+    _set_buzzer_state(False)
+    buzz_pattern = ''
+    buzz_on = False
+
+def buzz_playing():
+    """True from buzz_play() until the pattern is over or stopped"""
+    return buzz_pattern != ''
+
+def buzz_sounding():
+    """True while a tone is sounding (TMR3 running, so no sleep)"""
+    return buzz_on
@@ -0,0 +1,112 @@
+# Copyright (C) 2014 Synapse Wireless, Inc.
+"""Duty cycle accounting on the MAC symbol counter (enable_sym_ctr() must have been called).
+   The caller marks when each subsystem starts and stops being busy; each slot adds up its
+   busy time and how many times it started, so a live node can show where its battery goes:
+
+     duty_start(DUTY_RADIO_TX)
+     ...
+     duty_stop(DUTY_RADIO_TX)
+
+   Spans are timed in 16us ticks, or 4.096ms ticks once longer than DUTY_LONG_TICKS.
+   Slots are independent, so spans can overlap: ADC conversions fall inside awake time.
+   duty_pack() (also the "rm150_duty" reply and the RPT_F_DUTY report field) is:
+     slots(1) then per slot: hi(2) lo(2) count(2)
+   Busy time is hi * 262.144ms + lo * 16us. hi and count are unsigned and wrap (hi after
+   4.7 hours), so the gateway works with differences between readings, or calls
+   duty_reset() (also an RPC) to start over.
+"""
+
+from atmega128rfa1_symctr import *
+
+# Slots
+DUTY_AWAKE = 0     # not in the scheduler's sleep
+DUTY_ASLEEP = 1    # in the scheduler's sleep
+DUTY_ADC = 2       # ADS1118s converting for a reading
+DUTY_UART = 3      # display frames going out on UART0
+DUTY_RADIO_TX = 4  # report queued until it has been sent
+DUTY_RADIO_RX = 5  # receiver on after a report
+DUTY_BUZZER = 6
+DUTY_SLOTS = 7
+
+DUTY_LONG_TICKS = 64  # sym_ticks_4ms() ticks (262ms); sym_ticks_16us() spans must stay short of 0x7FFF
+
+duty_enabled = True
+duty_running = 0  # bit per slot with a span in progress
+duty_starts = '\x00\x00\x00' * DUTY_SLOTS  # symbol counter bytes 0-2 at the start of each span
+duty_totals = '\x00\x00\x00\x00\x00\x00' * DUTY_SLOTS  # as duty_pack() sends them
+
+
+def duty_enable(enable):
+    """Turn accounting on or off (off, duty_start() and duty_stop() return straight away)"""
+    global duty_enabled, duty_running
+    duty_enabled = enable
+    duty_running = 0
+
+
+def duty_start(slot):
+    """slot is busy from now. Does nothing if it already is."""
+    global duty_running, duty_starts
+
+    if not duty_enabled or duty_running & (1 << slot):
+        return
+    i = slot * 3
+    duty_starts = duty_starts[:i] + chr(peek(0xe1)) + chr(peek(0xe2)) + chr(peek(0xe3)) + duty_starts[i + 3:]
+    duty_running |= 1 << slot
+
+
+def duty_stop(slot):
+    """slot is idle from now: add the span to its time and count. Does nothing if it was idle."""
+    global duty_running
+
+    if duty_running & (1 << slot):
+        duty_running &= ~(1 << slot)
+        _duty_add(slot, 1)
+
+
+def duty_reset():
+    """Zero every slot. Spans in progress carry on, timed from now."""
+    global duty_totals, duty_starts
+
+    duty_totals = '\x00\x00\x00\x00\x00\x00' * DUTY_SLOTS
+    duty_starts = (chr(peek(0xe1)) + chr(peek(0xe2)) + chr(peek(0xe3))) * DUTY_SLOTS
+
+
+def duty_pack():
+    """Return every slot's totals, spans in progress included up to now (format above)"""
+    slot = 0
+    while slot < DUTY_SLOTS:
+        if duty_running & (1 << slot):
+            _duty_add(slot, 0)
+        slot += 1
+    return chr(DUTY_SLOTS) + duty_totals
+
+
+def _duty_add(slot, spans):
+    """Add the time since slot's span started to its total, and spans to its count.
+       The span carries on from now.
+    """
+    global duty_totals, duty_starts
+
+    ll = peek(0xe1)  # Reading LSB latches in counter value
+    lh = peek(0xe2)
+    hl = peek(0xe3)
+    i = slot * 3
+    s = duty_starts
+    duty_starts = s[:i] + chr(ll) + chr(lh) + chr(hl) + s[i + 3:]
+
+    j = slot * 6
+    t = duty_totals
+    hi = ord(t[j]) << 8 | ord(t[j + 1])
+    lo = ord(t[j + 2]) << 8 | ord(t[j + 3])
+    ticks = sym_elapsed(ord(s[i + 1]) | (ord(s[i + 2]) << 8), lh | (hl << 8))
+    if ticks < DUTY_LONG_TICKS:
+        lo += sym_elapsed(ord(s[i]) | (ord(s[i + 1]) << 8), ll | (lh << 8))
+    else:
+        hi += ticks >> 6  # 64 ticks of 4.096ms per unit
+        lo += (ticks & 0x3F) << 8
+    hi += lo >> 14
+    lo &= 0x3FFF
+    count = (ord(t[j + 4]) << 8 | ord(t[j + 5])) + spans
+
+    duty_totals = t[:j] + chr((hi >> 8) & 0xFF) + chr(hi & 0xFF) + chr(lo >> 8) + chr(lo & 0xFF) + \
+                  chr((count >> 8) & 0xFF) + chr(count & 0xFF) + t[j + 6:]
@@ -36,6 +36,11 @@ XMEGA_WAKE = 9
 # onboard flash chip
 FLASH_CS = 13   # active low
 
+# Door contact inputs, one per probe connector (door sensing boards). The contact closes
+# to ground; the internal pull-up holds the pin high while it is open.
+DOOR_IN1 = 2
+DOOR_IN2 = 3
+
 # momentary push button on front of device
 PB_SWITCH = 23  # active high
 PB_SWITCH_NEW = 1  # new PB Switch
@@ -89,7 +94,9 @@ def init_snap_hw():
 
    writePin(XMEGA_RESET, True) # deselect
 
-   setPinDir(XMEGA_WAKE, False)  # TODO: set as output and start waking up the XMEGA
+   # Raised by the command port to wake the XMEGA ahead of a frame (see CustomTemperatureLCD)
+   writePin(XMEGA_WAKE, False)
+   setPinDir(XMEGA_WAKE, True)  # output
 
 def init_pins_low_power():
    i = 0
@@ -0,0 +1,72 @@
+# Copyright (C) 2014 Synapse Wireless, Inc.
+"""Latency histograms for the stages of a reading, timed on the MAC symbol counter
+   (enable_sym_ctr() must have been called). Stages are chained off one timestamp:
+
+     t = sym_ticks_16us()
+     HIH61_start_conversion()
+     t = hist_add(HIST_HIH61_START, t)  # counts the stage, returns the start of the next one
+
+   Each stage has HIST_BUCKETS one-byte counts that stop at 255. Bucket 0 holds stages
+   shorter than HIST_BASE_TICKS (1.024ms), each further bucket twice the span of the one
+   before, and the last everything from 65.5ms up. Stages must be shorter than 0x7FFF ticks
+   (524ms), the longest sym_elapsed() can measure.
+   hist_pack() (also the "rm150_hist" reply) is:
+     stages(1) buckets(1) then the counts, stage by stage
+"""
+
+from atmega128rfa1_symctr import *
+
+# Stages
+HIST_HIH61_START = 0  # HIH61 measurement request
+HIST_ADC_START = 1    # configuring both ADS1118s and starting their first conversion
+HIST_CJ_WAIT = 2      # waiting on the cold junction conversions
+HIST_CJ_READ = 3      # reading them (and averaging, in the fast profile), starting the thermocouples
+HIST_TC_WAIT = 4      # waiting on the thermocouple conversions
+HIST_TC_READ = 5      # reading and converting one thermocouple
+HIST_HUMID_READ = 6   # HIH61 read and conversion
+HIST_READING = 7      # all of read_temps()
+HIST_STAGES = 8
+
+HIST_BUCKETS = 8
+HIST_BASE_TICKS = 64  # 16us ticks
+
+hist_enabled = True
+hist_counts = '\x00' * (HIST_STAGES * HIST_BUCKETS)
+
+
+def hist_enable(enable):
+    """Turn the histograms on or off (off, hist_add() returns straight away)"""
+    global hist_enabled
+    hist_enabled = enable
+
+
+def hist_add(stage, start):
+    """Count a stage that started at sym_ticks_16us() tick start and ends now. Returns now."""
+    global hist_counts
+
+    if not hist_enabled:
+        return 0
+    now = peek(0xe1) | (peek(0xe2) << 8)  # as sym_ticks_16us()
+    ticks = (now - start) & 0x7FFF  # as sym_elapsed()
+    bucket = 0
+    limit = HIST_BASE_TICKS
+    while bucket < HIST_BUCKETS - 1 and ticks >= limit:
+        limit <<= 1
+        bucket += 1
+
+    i = stage * HIST_BUCKETS + bucket
+    n = ord(hist_counts[i])
+    if n < 255:
+        hist_counts = hist_counts[:i] + chr(n + 1) + hist_counts[i + 1:]
+    return now
+
+
+def hist_reset():
+    """Zero every count"""
+    global hist_counts
+    hist_counts = '\x00' * (HIST_STAGES * HIST_BUCKETS)
+
+
+def hist_pack():
+    """Return the histograms (format above)"""
+    return chr(HIST_STAGES) + chr(HIST_BUCKETS) + hist_counts
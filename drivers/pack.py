@@ -0,0 +1,7 @@
+# Copyright (C) 2014 Synapse Wireless, Inc.
+"""Packing helpers for binary strings sent over the air or stored in flash (big-endian)"""
+
+
+def pack_i16(value):
+    """Return a 16-bit int as a 2-byte string, MSB first"""
+    return chr((value >> 8) & 0xFF) + chr(value & 0xFF)
@@ -0,0 +1,86 @@
+# Copyright (C) 2014 Synapse Wireless, Inc.
+"""Packed binary encoding for "rm150_rpt" reports (a single string argument).
+   Decoded on the gateway by rm150host/codec.py - keep the two in step.
+
+   Header:
+     version(1) flags(2) interval_secs(2) [seq(1) if RPT_F_SEQ] [count(1) if RPT_F_BATCH]
+   seq counts reports (mod 256) from 0 at boot; a retransmission repeats it. RPT_F_RESTART is
+   set until the gateway acks a report, so it can tell a restarted node from lost reports.
+   Then one sample, or 'count' samples if RPT_F_BATCH. Each sample holds only the
+   fields flagged present, in this order:
+     [dt(1) if RPT_F_BATCH] amb_temp(2) humid(1) ext1(2) ext2(2) doors(1)
+   Temperatures are tenths C. humid is %RH, RPT_HUMID_ERR if the read failed or is out of range.
+   doors is present if either door flag is set: bit0 = door 1 open, bit1 = door 2 open.
+   With RPT_F_DUTY the samples are followed by duty cycle totals (drivers/duty_acct.py, duty_pack()).
+
+   With RPT_F_RAW the node sends what it read rather than what it converted:
+     [dt(1) if RPT_F_BATCH] cj1(2) hih61(4) therm1(2) cj2(2) therm2(2) doors(1)
+   cj1/cj2 are the ADS1118 internal temp readings behind the cold junctions (cj1 is also the
+   ambient), therm1/therm2 the thermocouple counts, hih61 the bytes read from the HIH61
+   (RPT_HIH61_ERR if the read failed). Offsets are not applied.
+"""
+
+from pack import *
+
+RPT_VERSION = 1
+
+# Presence bitmap
+RPT_F_AMB   = 0x0001
+RPT_F_HUMID = 0x0002
+RPT_F_EXT1  = 0x0004
+RPT_F_EXT2  = 0x0008
+RPT_F_DOOR1 = 0x0010
+RPT_F_DOOR2 = 0x0020
+RPT_F_BATCH = 0x0100
+RPT_F_RAW   = 0x0200
+RPT_F_SEQ   = 0x0400
+RPT_F_DUTY  = 0x0800
+RPT_F_RESTART = 0x1000
+
+RPT_HUMID_ERR = 255
+RPT_HIH61_ERR = '\xff\xff\xff\xff'  # status bits 3, never read from a working HIH61
+
+
+def rpt_header(flags, interval, count, seq):
+    hdr = chr(RPT_VERSION) + pack_i16(flags) + pack_i16(interval)
+    if flags & RPT_F_SEQ:
+        hdr += chr(seq)
+    if flags & RPT_F_BATCH:
+        hdr += chr(count)
+    return hdr
+
+
+def rpt_sample(flags, amb_temp, humid, ext1, ext2, doors):
+    """Pack the fields of one sample that are flagged present"""
+    s = ''
+    if flags & RPT_F_AMB:
+        s += pack_i16(amb_temp)
+    if flags & RPT_F_HUMID:
+        if humid < 0 or humid >= RPT_HUMID_ERR:
+            humid = RPT_HUMID_ERR
+        s += chr(humid)
+    if flags & RPT_F_EXT1:
+        s += pack_i16(ext1)
+    if flags & RPT_F_EXT2:
+        s += pack_i16(ext2)
+    if flags & (RPT_F_DOOR1 | RPT_F_DOOR2):
+        s += chr(doors)
+    return s
+
+
+def rpt_raw_sample(flags, cj1, hih61, therm1, cj2, therm2, doors):
+    """Pack the raw fields of one sample that are flagged present (RPT_F_RAW)"""
+    s = ''
+    if flags & RPT_F_AMB:
+        s += pack_i16(cj1)
+    if flags & RPT_F_HUMID:
+        if len(hih61) != 4:
+            hih61 = RPT_HIH61_ERR
+        s += hih61
+    if flags & RPT_F_EXT1:
+        s += pack_i16(therm1)
+    if flags & RPT_F_EXT2:
+        s += pack_i16(cj2) + pack_i16(therm2)
+    if flags & (RPT_F_DOOR1 | RPT_F_DOOR2):
+        s += chr(doors)
+    return s
@@ -0,0 +1,147 @@
+# Copyright (C) 2014 Synapse Wireless, Inc.
+"""Store-and-forward sample log on the AT45DB flash.
+   Samples are staged in RAM and written out one page at a time (buffer write + page
+   program) into a ring of flash pages, so the flash only wakes from ultra-deep
+   power-down once per LOG_RECS_PER_PAGE samples.
+   A gateway pulls the backlog with sample_log_drain(); each page goes out as an
+   "rm150_log" RPC, chained off HOOK_RPC_SENT. A page stays in the log until
+   HOOK_RPC_SENT reports its RPC sent; a drain with no page sent for LOG_DRAIN_TIMEOUT_TICKS
+   is dropped, so a lost HOOK_RPC_SENT can't keep the node awake.
+
+   Record format (LOG_REC_SIZE bytes, big-endian):
+     seq(2) amb_temp(2) amb_humid(2) ext1(2) ext2(2)
+   The ring position is held in RAM only; a reboot starts a new ring.
+"""
+
+from AT45DB import *
+from atmega128rfa1_symctr import *
+from pack import *
+
+LOG_FIRST_PAGE = 512   # keep clear of anything stored at the bottom of the flash
+LOG_NUM_PAGES = 768    # 6144 samples
+LOG_REC_SIZE = 10
+# A page goes out as one "rm150_log" RPC, so its 80 bytes plus the MAC and SNAP headers, the
+# name and the address argument must fit one 127-byte 802.15.4 frame (88 bytes left for data)
+LOG_RECS_PER_PAGE = 8
+LOG_PAGE_BYTES = LOG_REC_SIZE * LOG_RECS_PER_PAGE
+LOG_DRAIN_TIMEOUT_TICKS = 489  # 4.096ms symbol counter ticks (2s) waiting for a page to go out
+
+log_stage = ''    # records not yet programmed to flash
+log_seq = 0       # sample sequence number, rolls over
+log_head = 0      # next ring page to program
+log_count = 0     # pages programmed and not yet drained
+
+log_drain_addr = None
+log_drain_ref = None     # RPC ref of the page in flight
+log_drain_page = False   # the page in flight is the oldest flash page
+log_drain_len = 0        # else, how many bytes at the front of log_stage it carries
+log_drain_tick = 0       # sym_ticks_4ms() when it was queued
+
+
+def sample_log_append(amb_temp, amb_humid, ext1, ext2):
+    """Add one sample. Programs a flash page when a full page of samples is staged."""
+    global log_stage, log_seq
+
+    log_stage += pack_i16(log_seq) + pack_i16(amb_temp) + pack_i16(amb_humid) + pack_i16(ext1) + pack_i16(ext2)
+    log_seq += 1
+
+    if len(log_stage) >= LOG_PAGE_BYTES:
+        _log_program_page()
+
+
+def _log_program_page():
+    """Write the staged page into the ring, dropping the oldest page if the ring is full"""
+    global log_stage, log_head, log_count, log_drain_page, log_drain_len
+
+    AT45DB_udeep(False)
+    AT45DB_buffer_write(0, log_stage)
+    AT45DB_buffer_program(LOG_FIRST_PAGE + log_head)
+    AT45DB_wait_ready()
+    AT45DB_udeep(True)
+
+    log_stage = ''
+    log_head += 1
+    if log_head >= LOG_NUM_PAGES:
+        log_head = 0
+    if log_count < LOG_NUM_PAGES:
+        log_count += 1
+    elif log_drain_page:
+        # The page in flight was the oldest and has just been overwritten
+        log_drain_page = False
+    # Staged records in flight are now in this page and will go out again with it
+    log_drain_len = 0
+
+
+def _log_read_oldest():
+    """Read the oldest undrained page"""
+    page = log_head - log_count
+    if page < 0:
+        page += LOG_NUM_PAGES
+
+    AT45DB_udeep(False)
+    data = AT45DB_lowpwr_read(AT45DB_page_addr(LOG_FIRST_PAGE + page, 0), LOG_PAGE_BYTES)
+    AT45DB_udeep(True)
+    return data
+
+
+def sample_log_drain(addr):
+    """Start sending the backlog (oldest first) to addr, one 'rm150_log' RPC per page"""
+    global log_drain_addr
+
+    log_drain_addr = addr
+    if log_drain_ref == None:
+        _log_drain_next()
+
+
+def _log_drain_next():
+    global log_drain_addr, log_drain_ref, log_drain_page, log_drain_len, log_drain_tick
+
+    if log_drain_addr == None:
+        return
+
+    # Nothing leaves the log here: the RPC may still be lost from the queue or by a reset
+    if log_count > 0:
+        data = _log_read_oldest()
+        log_drain_page = True
+    elif log_stage != '':
+        data = log_stage
+        log_drain_page = False
+        log_drain_len = len(data)
+    else:
+        # Empty page marks the end of the backlog
+        rpc(log_drain_addr, "rm150_log", localAddr(), '')
+        log_drain_addr = None
+        log_drain_ref = None
+        return
+
+    rpc(log_drain_addr, "rm150_log", localAddr(), data)
+    log_drain_ref = getInfo(9)
+    log_drain_tick = sym_ticks_4ms()
+
+
+def sample_log_rpc_sent(ref):
+    """Call from HOOK_RPC_SENT. Returns True if ref was a drain page, and sends the next one."""
+    global log_drain_ref, log_stage, log_count
+
+    if ref != log_drain_ref:
+        return False
+
+    log_drain_ref = None
+    if log_drain_page:
+        log_count -= 1
+    else:
+        log_stage = log_stage[log_drain_len:]
+    _log_drain_next()
+    return True
+
+
+def sample_log_draining():
+    """True while a drain is under way. Drops one whose page in flight was never reported sent;
+       that page stays in the log for the next drain.
+    """
+    global log_drain_addr, log_drain_ref
+
+    if log_drain_ref != None and sym_elapsed(log_drain_tick, sym_ticks_4ms()) > LOG_DRAIN_TIMEOUT_TICKS:
+        log_drain_addr = None
+        log_drain_ref = None
+    return log_drain_addr != None
@@ -0,0 +1,97 @@
+# Copyright (C) 2014 Synapse Wireless, Inc.
+"""Deadline scheduler on the MAC symbol counter (enable_sym_ctr() must have been called).
+   Tasks are small ints (0 to SCHED_MAX_TASKS-1, lower runs first when several are due).
+   The caller owns dispatch:
+
+     task = sched_pop_due()
+     while task >= 0:
+         run_my_task(task)
+         task = sched_pop_due()
+     sched_sleep()  # until the next deadline
+
+   Deadlines are 16-bit sym_ticks_4ms() values, so delays are limited to SCHED_MAX_MS;
+   longer periods are built by counting shorter ones.
+"""
+
+from atmega128rfa1_symctr import *
+from pack import *
+
+SCHED_MAX_TASKS = 8
+SCHED_MAX_MS = 30000  # longest delay, also the longest single sleep
+SCHED_SLACK = 2  # ticks; a task due this soon runs now rather than being slept for
+SCHED_HORIZON = 0x3FFF  # ticks; a deadline further off than this has already passed
+
+sched_active = 0  # bit per scheduled task
+sched_deadlines = '\x00\x00' * SCHED_MAX_TASKS
+
+
+def sched_at(task, delay_ms):
+    """Run task delay_ms (0 to SCHED_MAX_MS) from now, replacing any deadline it already has"""
+    global sched_active, sched_deadlines
+
+    if delay_ms > SCHED_MAX_MS:
+        delay_ms = SCHED_MAX_MS
+    deadline = sym_ticks_4ms() + _ms_to_ticks(delay_ms)
+
+    i = task * 2
+    sched_deadlines = sched_deadlines[:i] + pack_i16(deadline) + sched_deadlines[i + 2:]
+    sched_active |= 1 << task
+
+
+def sched_cancel(task):
+    global sched_active
+    sched_active &= ~(1 << task)
+
+
+def sched_pending(task):
+    return (sched_active & (1 << task)) != 0
+
+
+def sched_pop_due():
+    """Return the first task that is due and unschedule it, or -1 if none is"""
+    global sched_active
+
+    now = sym_ticks_4ms()
+    task = 0
+    while task < SCHED_MAX_TASKS:
+        if (sched_active & (1 << task)) and _sched_remaining(task, now) <= SCHED_SLACK:
+            sched_active &= ~(1 << task)
+            return task
+        task += 1
+    return -1
+
+
+def sched_sleep():
+    """Sleep until the next deadline, or for SCHED_MAX_MS if nothing is scheduled"""
+    ticks = _ms_to_ticks(SCHED_MAX_MS)
+    now = sym_ticks_4ms()
+    task = 0
+    while task < SCHED_MAX_TASKS:
+        if sched_active & (1 << task):
+            remaining = _sched_remaining(task, now)
+            if remaining < ticks:
+                ticks = remaining
+        task += 1
+
+    if ticks > SCHED_SLACK:
+        sleep(2, -_ticks_to_ms(ticks))
+
+
+def _sched_remaining(task, now):
+    """Ticks until task is due, 0 if overdue"""
+    i = task * 2
+    deadline = ord(sched_deadlines[i]) << 8 | ord(sched_deadlines[i + 1])
+    remaining = (deadline - now) & 0x7FFF
+    if remaining > SCHED_HORIZON:
+        return 0
+    return remaining
+
+
+def _ms_to_ticks(ms):
+    # ticks = ms / 4.096, without overflowing 16 bits
+    return (ms >> 2) - (ms >> 9) * 3
+
+
+def _ticks_to_ms(ticks):
+    # ms = ticks * 4.096; only valid up to _ms_to_ticks(SCHED_MAX_MS)
+    return ticks * 4 + (ticks * 3) / 32
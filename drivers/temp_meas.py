@@ -1,49 +1,153 @@
 # Copyright (C) 2014 Synapse Wireless, Inc.
 """Temperature measurement using the ADS1118.
-   Async interface uses 1/16s sample rate, which gives good accuracy with 62.5ms sample time,
-   which fits nicely with 100ms timing between steps.
+   Async interface uses one of two acquisition profiles (temp_set_profile()):
+     TEMP_PROFILE_PRECISE - a single conversion at 1/16s sample rate, which gives good accuracy
+                            with 62.5ms sample time
+     TEMP_PROFILE_FAST    - a burst of TEMP_FAST_SAMPLES conversions at 860 SPS (about 1.2ms each),
+                            averaged on the node; noisier, but the ADC is powered far less.
+                            Each extra conversion costs more script time awake than the ADC
+                            saves, so keep the burst short.
+   Call temp_wait() between steps; it returns as soon as the selected chip has data ready.
+   Board temperature moves slowly, so the cold junction need not be measured every reading:
+   when temp_cj_due() says it is fresh, temp_start_therm() replaces steps 1 and 2 and step 3
+   reuses the cached cold junction count.
+   The two ADS1118s convert independently, so both can be stepped through the same
+   conversion windows; temp_select() switches chips and keeps a cold junction count per chip.
    Provide blocking interface for test purposes.
 """
 
 from ads1118_adc import *
 from thermocouple import *
 
-TEMP_ADC_SAMP_MS = 70   # ms to allow ADC to convert
+TEMP_PROFILE_PRECISE = 0
+TEMP_PROFILE_FAST = 1
+TEMP_FAST_SAMPLES = 2  # conversions averaged per reading in the fast profile (max 16)
+
+temp_samples = 1   # conversions averaged per reading, set by temp_set_profile()
+
+cold_refresh = 1  # readings between cold junction measurements, see temp_cj_set_refresh()
+cold_age = 0      # readings since the last one; cold_refresh forces the next to measure
+cold_age_ref = 0  # independent ambient at the last measurement, tenths C
+TEMP_CJ_DELTA = 20  # tenths C; independent ambient moving this far forces a measurement
+
+cold_count = 0     # cold junction of the selected chip, as an ADC count
+cold_count_1 = 0   # saved for ADS1118_CS1 while the other chip is selected
+cold_count_2 = 0   # saved for ADS1118_CS2
+cold_raw = 0       # and as read from the internal temp sensor, for raw reports
+cold_raw_1 = 0
+cold_raw_2 = 0
+therm_raw = 0      # thermocouple count behind the last temp_read_step3()
 
 # C to F conversion function
 conv_func = '\x38\x2e\xf9\x01\x39\x97\x50\x85\x80\xe0\x47\x81\x55\x23\x0a\xf4\x81\xe0\x65\x2f\x66\x0f\x66\x0b\x76\x2f\x80\xfb\x3e\xf4\x50\x95\x60\x95\x70\x95\x41\x95\x5f\x4f\x6f\x4f\x7f\x4f\x09\xe0\x22\x24\x07\x9f\x30\x2d\x06\x9f\x20\x2d\x31\x0d\x05\x9f\x10\x2d\x21\x0d\x32\x1d\x04\x9f\x11\x0d\x22\x1d\x32\x1d\x40\x2d\x51\x2f\xb9\x01\x36\x95\x27\x95\x17\x95\x07\x94\x04\x0e\x51\x1f\x62\x1f\x73\x1f\x76\x95\x67\x95\x57\x95\x07\x94\x40\x2d\x15\x2f\x9b\x01\x36\x95\x27\x95\x17\x95\x07\x94\x36\x95\x27\x95\x17\x95\x07\x94\x36\x95\x27\x95\x17\x95\x07\x94\x36\x95\x27\x95\x17\x95\x07\x94\x40\x0d\x51\x1f\x62\x1f\x73\x1f\x05\x2f\x16\x2f\x27\x2f\x04\x0f\x15\x1f\x26\x1f\x27\x1e\x26\x94\x27\x95\x17\x95\x07\x95\x26\x94\x27\x95\x17\x95\x07\x95\xa8\x01\x1e\xf4\x51\x95\x41\x95\x50\x40\x52\x83\x41\x83\x01\xe0\x00\x83\x83\x2d\x08\x95'
 
 
+def temp_set_profile(profile):
+    """Select TEMP_PROFILE_PRECISE or TEMP_PROFILE_FAST for the step functions"""
+    global ads_rate, temp_samples
+    if profile == TEMP_PROFILE_FAST:
+        ads_rate = ADS_RATE_860
+        temp_samples = TEMP_FAST_SAMPLES
+    else:
+        ads_rate = ADS_RATE_16
+        temp_samples = 1
+
+def temp_select(cs_pin):
+    """Direct the step functions at the ADS1118 on cs_pin, swapping in its cold junction count"""
+    global ADS1118_CS, cold_count, cold_count_1, cold_count_2, cold_raw, cold_raw_1, cold_raw_2
+
+    if ADS1118_CS == ADS1118_CS1:
+        cold_count_1 = cold_count
+        cold_raw_1 = cold_raw
+    else:
+        cold_count_2 = cold_count
+        cold_raw_2 = cold_raw
+
+    ADS1118_CS = cs_pin
+    if cs_pin == ADS1118_CS1:
+        cold_count = cold_count_1
+        cold_raw = cold_raw_1
+    else:
+        cold_count = cold_count_2
+        cold_raw = cold_raw_2
+
+def temp_cj_raw(cs_pin):
+    """Return the internal temp sensor reading behind the cold junction of the ADS1118 on cs_pin"""
+    if cs_pin == ADS1118_CS:
+        return cold_raw
+    elif cs_pin == ADS1118_CS1:
+        return cold_raw_1
+    return cold_raw_2
+
+def temp_cj_set_refresh(readings):
+    """Measure the cold junctions every 'readings' readings (0 or 1 = every time)"""
+    global cold_refresh, cold_age
+    cold_refresh = readings
+    cold_age = readings
+
+def temp_cj_due():
+    """Call once per reading. Returns True if the cold junctions must be measured this time,
+       i.e. steps 1 and 2 are needed rather than temp_start_therm().
+    """
+    global cold_age
+    if cold_age >= cold_refresh:
+        cold_age = 1
+        return True
+    cold_age += 1
+    return False
+
+def temp_cj_ambient(amb):
+    """Give an independent ambient reading (tenths C), e.g. from a humidity sensor.
+       A move of more than TEMP_CJ_DELTA since the last cold junction measurement forces one.
+    """
+    global cold_age, cold_age_ref
+    if cold_age == 1:
+        cold_age_ref = amb
+    elif amb - cold_age_ref > TEMP_CJ_DELTA or cold_age_ref - amb > TEMP_CJ_DELTA:
+        cold_age = cold_refresh
+
+def temp_wait():
+    """Wait for the conversion started by the last step on the selected chip. Returns False on timeout"""
+    return ads_wait_ready()
+
 def temp_read_step1():
     """Setup step: Initiate internal "cold junction" measurement"""
     # Transfer config for internal temp meas, start conversion
-    ads_config_mask(ADS_CH1 | ADS_RNG_256 | ADS_RATE_16 | ADS_MODE_TMP | ADS_SNG_SHOT | ADS_SS_START)
+    ads_config_mask(ADS_CH1 | ADS_RNG_256 | ads_rate | ADS_MODE_TMP | ADS_SNG_SHOT | ADS_SS_START)
     ads_read()
 
 def temp_read_step2(offset):
     """Intermediate step: Store cold junction temperature as a corresponding ADC count based on k-table
        Returns cold junction temperature (ambient at probe connector) in tenths C.
     """
-    global cold_count
-    
-    # Set config for external ADC
-    ads_config_mask(ADS_CH1 | ADS_RNG_256 | ADS_RATE_16 | ADS_MODE_ADC | ADS_SNG_SHOT | ADS_SS_START)
+    global cold_count, cold_raw
     
     # Get internal temp conversion result, and start conversion of external ADC
-    cold_tmp = ads_conv_internal_temp_C(ads_read())
+    cold_raw = _temp_average(ADS_CH1 | ADS_RNG_256 | ads_rate | ADS_MODE_TMP | ADS_SNG_SHOT | ADS_SS_START,
+                             ADS_CH1 | ADS_RNG_256 | ads_rate | ADS_MODE_ADC | ADS_SNG_SHOT | ADS_SS_START)
+    cold_tmp = ads_conv_internal_temp_C(cold_raw)
     cold_tmp = cold_tmp + offset
     cold_count = C_to_adc(cold_tmp)
     #print "cold temp=", cold_tmp, ", cnt=", cold_count
     return cold_tmp
     
+def temp_start_therm():
+    """Replaces steps 1 and 2 while the cold junction is cached: start the thermocouple conversion"""
+    ads_config_mask(ADS_CH1 | ADS_RNG_256 | ads_rate | ADS_MODE_ADC | ADS_SNG_SHOT | ADS_SS_START)
+    ads_read()
+
 def temp_read_step3(offset):
     """Final step, returns temperature in tenths C
-       Read thermocouple ADC count, compensate for cold junction offset, and convert to tenths C.
+       Read thermocouple ADC count, compensate for cold junction offset (from step 2, or cached),
+       and convert to tenths C.
     """
-    therm_count = ads_read()
+    global therm_raw
+
+    # No further conversion is started, the ADC stays powered down
+    therm_count = therm_raw = _temp_average(ADS_CH1 | ADS_RNG_256 | ads_rate | ADS_MODE_ADC | ADS_SNG_SHOT | ADS_SS_START,
+                                            ADS_CH1 | ADS_RNG_256 | ads_rate | ADS_MODE_ADC | ADS_SNG_SHOT)
     #print "therm count=", therm_count
-    therm_compens = therm_count + cold_count
-    tmp = adc_to_C(therm_compens)
+    tmp = adc_cj_to_C(therm_count, cold_count)
     
     # if tmp at max/min rail don't add offset - the rail values are used to indicate an error
     if tmp < MAX_TEMP * 10 and tmp > MIN_TEMP * 10:
@@ -51,6 +155,32 @@ def temp_read_step3(offset):
         
     return tmp
 
+def _temp_average(mask, next_mask):
+    """Return the average of temp_samples conversions of mask, the first of which is already
+       under way. The last read transfers next_mask.
+    """
+    first = 0
+    dev = 0  # sum of deviations from the first sample, so the sum can't overflow
+    if temp_samples > 1:
+        # The config is shared by both chips, so it may hold the other chip's last step
+        ads_config_mask(mask)
+    i = 1
+    while i < temp_samples:
+        val = ads_read()  # also starts the next conversion
+        if i == 1:
+            first = val
+        else:
+            dev += val - first
+        sleep(2, -ads_conv_ms())  # cheaper than arming the DRDY wake for one short conversion
+        i += 1
+
+    ads_config_mask(next_mask)
+    val = ads_read()
+    if temp_samples == 1:
+        return val
+    dev += val - first
+    return first + dev / temp_samples
+
 def c_to_f(tempr):
     """
     Converts Celsius to Fahrenheit
@@ -5,10 +5,17 @@
 
 DO_UNIT_TESTS = False
 
-# K-type thermocouple table (see k_type.py)
+# K-type thermocouple table, 10C steps from MIN_TEMP to MAX_TEMP. Regenerate (with k_index, and
+# tables for other types) with: python -m rm150host.tc_tables K --uniform 10 --min -100 --max 1160
 k_table = '\xfe9\xfea\xfe\x8a\xfe\xb5\xfe\xe1\xff\x0e\xff=\xffl\xff\x9c\xff\xce\x00\x00\x003\x00f\x00\x9a\x00\xce\x01\x03\x018\x01m\x01\xa2\x01\xd7\x02\x0c\x02A\x02v\x02\xaa\x02\xde\x03\x12\x03E\x03x\x03\xac\x03\xdf\x04\x12\x04E\x04x\x04\xac\x04\xe0\x05\x14\x05H\x05|\x05\xb1\x05\xe6\x06\x1b\x06P\x06\x85\x06\xba\x06\xf0\x07&\x07[\x07\x91\x07\xc7\x07\xfd\x083\x08i\x08\x9f\x08\xd5\t\x0c\tB\tx\t\xaf\t\xe5\n\x1c\nR\n\x89\n\xc0\n\xf6\x0b-\x0bc\x0b\x9a\x0b\xd1\x0c\x07\x0c=\x0ct\x0c\xaa\x0c\xe1\r\x17\rM\r\x83\r\xb9\r\xef\x0e%\x0e[\x0e\x91\x0e\xc6\x0e\xfc\x0f1\x0ff\x0f\x9b\x0f\xd0\x10\x05\x10:\x10o\x10\xa3\x10\xd8\x11\x0c\x11@\x11t\x11\xa8\x11\xdc\x12\x0f\x12C\x12v\x12\xaa\x12\xdd\x13\x10\x13C\x13v\x13\xa8\x13\xdb\x14\r\x14?\x14q\x14\xa3\x14\xd5\x15\x07\x158\x15j\x15\x9b\x15\xcc\x15\xfd\x16.\x16_\x16\x8f\x16\xc0\x16\xf0\x17 \x17P\x17\x7f\x17\xaf'
 TABLE_SIZE = 127   # 16 bit ints
 
+# Reverse index: byte n is the k_table segment holding count MIN_ADC + (n << K_INDEX_SHIFT).
+# Buckets are narrower than the narrowest segment (40 counts), so any count is in the indexed
+# segment or the next one.
+K_INDEX_SHIFT = 5
+k_index = '\x00\x00\x01\x02\x03\x03\x04\x05\x05\x06\x07\x07\x08\t\t\n\x0b\x0b\x0c\x0c\r\x0e\x0e\x0f\x10\x10\x11\x11\x12\x13\x13\x14\x14\x15\x16\x16\x17\x17\x18\x19\x19\x1a\x1b\x1b\x1c\x1c\x1d\x1e\x1e\x1f  !!"##$$%&&\'\'())**+,,--.//00122334556678899::;<<==>??@@AABCCDDEFFGGHIIJJKLLMMNNOPPQQRSSTTUVVWWXYYZ[[\\\\]^^__`aabccddeffghhiijkklmmnoopqqrrsttuvvwxxyzz{||}'
+
 # Temp limits in tenths C; range selected to fit in 255 byte string with 10degC intervals
 MIN_TEMP = -100
 MAX_TEMP = +1160
@@ -47,24 +54,27 @@ def adc_to_C(adc_count):
     elif adc_count <= MIN_ADC:
         return MIN_TEMP*10
     
-    start = ((adc_count - MIN_ADC) * 5) / 262
-    i = start
-    val = ktable(i)
-    
-    if val == adc_count:
-        temp = ((i * 10) + MIN_TEMP)*10
-        return temp
-
-    while (i < start + 4 and val <= adc_count):
+    i = ord(k_index[(adc_count - MIN_ADC) >> K_INDEX_SHIFT])
+    j = i * 2
+    low = ord(k_table[j]) << 8 | ord(k_table[j+1])
+    high = ord(k_table[j+2]) << 8 | ord(k_table[j+3])
+    if adc_count >= high:
         i += 1
-        prev = val
-        val = ktable(i)
+        low = high
+        high = ord(k_table[j+4]) << 8 | ord(k_table[j+5])
     
-    # Temp is between a low of just over the prev index, and a high of the next one
-    low = (((i-1) * 10) + MIN_TEMP) * 10
-    inc = ((adc_count - prev) * 100) / (val - prev)
-    temp = low + inc
-    return temp
+    # Temp is between the low index and the next one
+    return i*100 + MIN_TEMP*10 + ((adc_count - low) * 100) / (high - low)
+
+def adc_cj_to_C(therm_count, cold_count):
+    """Convert a thermocouple count plus its cold junction count (from C_to_adc) to tenths C.
+       Counts far enough out of range to overflow the sum go straight to the rails.
+    """
+    if therm_count >= MAX_ADC - MIN_ADC:
+        return MAX_TEMP*10
+    elif therm_count <= MIN_ADC - MAX_ADC:
+        return MIN_TEMP*10
+    return adc_to_C(therm_count + cold_count)
 
 
 if DO_UNIT_TESTS:
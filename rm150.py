@@ -1,7 +1,5 @@
 # Copyright (C) 2014 Synapse Wireless, Inc.
 """Main file for RM150"""
-# TODO:
-# 1. Add audio alert option
 
 from synapse.switchboard import *
 from synapse.platforms import *
@@ -18,13 +16,17 @@ from drivers.buzzer import *
 from drivers.ads1118_adc import *
 from drivers.AT45DB import *
 from drivers.batmon import *
-from drivers.atmega128rfa1_symctr import sym_ticks_4ms
+from drivers.atmega128rfa1_symctr import *
 from drivers.thermocouple import *
 from drivers.temp_meas import *
-from drivers.buzzer import _set_buzzer_freq
-from drivers.buzzer import _set_buzzer_state
 
 from drivers.HIH61_Humidity import *
+from drivers.sample_log import *
+from drivers.pack import *
+from drivers.report_fmt import *
+from drivers.scheduler import *
+from drivers.duty_acct import *
+from drivers.latency_hist import *
 
 # Script Version
 VERSION = 8
@@ -32,11 +34,90 @@ VERSION = 8
 # CONFIGURATION
 EXT_1_ENABLED = True
 EXT_2_ENABLED = True
-EXT_1_MONITORED_ITEM = 0  # 0 for Temp, 1 for Door Relay
-EXT_2_MONITORED_ITEM = 0  # 0 for Temp, 1 for Door Relay
+EXT_1_MONITORED_ITEM = 0  # 0 for Temp, 1 for Door Relay, 2 for Door Relay on DOOR_IN1
+EXT_2_MONITORED_ITEM = 0  # 0 for Temp, 1 for Door Relay, 2 for Door Relay on DOOR_IN2
+# A door on its DOOR_IN pin (hw_defs) is not measured with the ADC: a change wakes the node,
+# and once the pin has been still for DOOR_DEBOUNCE_MS the new state is shown and reported.
+DOOR_DEBOUNCE_MS = 50
+DOOR_OPEN_LEVEL = True  # DOOR_IN level with the door open
 
 GW_COMM_MCAST_GROUP = 3
 GW_COMM_MCAST_TTL = 5
+# Receiver stays on this long after a report so the gateway can call back (gw_resp, log_drain).
+# 0 keeps it off, for gateways that never call back; 100 is enough for one that does.
+GW_LISTEN_MS = 0
+
+# A gateway that calls back answers each report with gw_resp(hops, seq) while we listen. Reports then go out
+# with just enough TTL to reach it; an unanswered report goes back to GW_COMM_MCAST_TTL.
+GW_TTL_ADAPT = True
+GW_TTL_MARGIN = 1  # hops of slack over what the gateway reports
+GW_TTL_PROBE = 10  # answered reports before trying one hop less, when the gateway sends hops=0
+# Once a gateway has answered, reports go straight to it instead of flooding the group.
+# After GW_FAIL_MAX unanswered reports, or every GW_REDISCOVER_INTV, a report is multicast
+# again and whoever answers it becomes the gateway.
+GW_UNICAST = True
+GW_FAIL_MAX = 3
+GW_REDISCOVER_INTV = 3600  # seconds
+# True numbers reports (a seventh "rm150_rpt" argument, or RPT_F_SEQ when packed) and expects
+# gw_resp() to ack the number. An unacked report is sent again after RPT_RETRY_BASE_MS,
+# doubling each time, at most RPT_RETRY_MAX times. Only for gateways that ack: any other
+# gateway gets the extra argument, and every report RPT_RETRY_MAX + 1 times. Numbers start at
+# 0 at boot and carry a restart mark (RPT_F_RESTART, or 0x100 in the seventh argument) until a
+# report is acked, so the gateway resets its count for the node instead of seeing lost reports.
+# Needs GW_LISTEN_MS > 0.
+REPORT_ACKED = False
+RPT_RETRY_MAX = 3
+RPT_RETRY_BASE_MS = 2000
+RPT_RETRY_JITTER = 0x1FF  # up to 511ms more, so nodes that lost the same packet spread out
+LQ_EWMA_DIV = 4  # link quality moves 1/LQ_EWMA_DIV of the way to each new getLq() reading
+LQ_NO_LINK = 127  # reading used for an unanswered report, once the gateway has been heard (-dBm)
+
+SAMPLE_LOG_ENABLED = True  # keep every sample in flash for the gateway to drain (GW_LISTEN_MS > 0)
+
+# Busy time per subsystem (drivers/duty_acct.py), read back with duty_query().
+# DUTY_TELEMETRY_INTV > 0 also adds the totals to a packed report that often (RPT_F_DUTY).
+DUTY_ACCOUNTING = True
+DUTY_TELEMETRY_INTV = 0  # seconds
+# How long each stage of read_temps() takes (drivers/latency_hist.py), read back with hist_query()
+LATENCY_HIST = True
+
+# True sends "rm150_rpt" as one packed string (drivers/report_fmt.py) instead of six arguments
+REPORT_PACKED = False
+
+# True sends raw ADC counts and HIH61 bytes in packed reports, for the gateway to convert in
+# bulk (rm150host/raw.py). The node only converts what it displays; humidity is not converted.
+REPORT_RAW = False
+
+# Batched reporting: 0 sends one "rm150_rpt" per REPORT_INTV with the latest values.
+# N > 0 sends up to N samples per packed "rm150_rpt", still one report per REPORT_INTV
+# (alerts and door changes flush early). When fewer than REPORT_INTV / INTERVAL_DELAY samples
+# fit, only every batch_stride-th sample is kept: with the 5s sample interval and a 60s
+# REPORT_INTV that is every 2nd/3rd/4th/6th sample under the caps below.
+REPORT_BATCH_SIZE = 0
+REPORT_BATCH_MAX = 8  # keeps the batch within one radio packet
+REPORT_BATCH_MAX_RAW = 5  # raw samples are bigger
+REPORT_BATCH_MAX_DUTY = 3  # leaves room for duty cycle telemetry
+REPORT_BATCH_MAX_RAW_DUTY = 2
+BATCH_DT_SHIFT = 6  # sample dt is in units of 64 symbol counter ticks (262ms), at most 66s
+
+# Report by exception: instead of every REPORT_INTV, report when a channel moves more
+# than its deadband or crosses an alarm limit, and at least every HEARTBEAT_INTV.
+# With batching on, this only adds early flushes.
+REPORT_BY_EXCEPTION = False
+HEARTBEAT_INTV = 900  # seconds
+DEADBAND_AMB = 5  # decidegrees Celcius
+DEADBAND_HUMID = 3  # %RH
+DEADBAND_EXT = 5  # decidegrees Celcius
+
+# TEMP_PROFILE_PRECISE: one slow conversion per reading. TEMP_PROFILE_FAST: two fast conversions
+# averaged, a little noisier. The ADCs convert for a few ms instead of 62.5ms, which saves more
+# than the slightly longer time awake costs: about 5% less charge overall (drivers/temp_meas.py)
+ADC_PROFILE = TEMP_PROFILE_PRECISE
+# Seconds between cold junction measurements, 0 for every reading. The cold junction of probe 1
+# is also the ambient temp, so ambient and its alarm can lag by up to this long. With
+# HAS_HUMIDITY_SENSOR, ambient moving more than TEMP_CJ_DELTA forces a measurement, and 60
+# skips most of them without that lag.
+CJ_REFRESH_INTV = 0
 
 OFFSET_EXTERNAL_1 = 0
 OFFSET_EXTERNAL_2 = 0
@@ -50,8 +131,16 @@ IN_FAHRENHEIT = True
 
 REPORT_INTV = 60  # seconds
 ALERT_INTV = 30  # seconds (time between buzzers)
+# Alerts sound the buzzer (drivers/buzzer.py patterns) until the button silences them or the
+# alert clears. One that lasts AUDIO_ESCALATE_INTV plays AUDIO_PATTERN_CRITICAL instead.
+AUDIO_ALERT = True
+AUDIO_ESCALATE_INTV = 300  # seconds
+AUDIO_PATTERN_WARN = BUZZ_PATTERN_WARN
+AUDIO_PATTERN_CRITICAL = BUZZ_PATTERN_CRITICAL
 INTERVAL_DELAY = 5   # seconds
 LCD_UPDATE_INT = INTERVAL_DELAY * 1000  # milliseconds
+BATT_CHECK_INT = 30000  # milliseconds
+BATT_REFRESH_INTV = 3600  # seconds between battery measurements, unless an alert sounds or a report is retried
 STARTUP_WAIT = 5  # seconds
 
 AMB_TEMP_HIGH = 9999  # decidegrees Celcius
@@ -65,6 +154,7 @@ EXT_2_LOW = -999  # decidegrees Celcius
 
 
 # CONSTANTS
+STATE_LISTEN = 5  # Report sent, receiver on for GW_LISTEN_MS
 STATE_ALERT = 4
 STATE_REPORT_RPC_QUEUED = 3  # Waiting for callback that 'report' rpc was sent
 STATE_NORMAL = 2
@@ -72,11 +162,26 @@ STATE_STARTUP = 1
 
 DOOR_OPEN_THRESHOLD = -900
 
+# Scheduler tasks, in priority order
+TASK_SAMPLE = 0
+TASK_REPORT = 1
+TASK_AUDIO = 2
+TASK_LISTEN_END = 3
+TASK_BATT = 4
+TASK_LCD = 5
+TASK_RESEND = 6
+TASK_DOOR = 7
+
+REPORT_RETRY_MS = 100  # previous report still in flight
+
 # Initialize global variables
 last_amb_temp = DISABLE_VALUE
 last_amb_humid = HUMID_DISABLE_VALUE
 last_ext1 = DISABLE_VALUE
 last_ext2 = DISABLE_VALUE
+last_ext1_raw = 0
+last_ext2_raw = 0
+last_hih61_raw = ''
 
 current_interval = REPORT_INTV/INTERVAL_DELAY
 alert_interval = ALERT_INTV/INTERVAL_DELAY
@@ -85,17 +190,47 @@ startup_cntr = 0
 report_cntr = current_interval + 1  # Send status at startup
 found_alert = False
 alert_cntr = 0
-audio_cntr = 0
-in_audio = False
+alert_age = 0  # samples the current alert has lasted
 
 report_rpc_ref = None
+rpt_payload = None  # packed report being sent, None for the argument form
+rpt_interval = 0
+rpt_seq = 0
+rpt_restart = True  # no report acked since boot, see RPT_F_RESTART
+rpt_tries = 0  # retransmissions of the current report
+rpt_flags = 0  # fields present in packed reports, see _load_config()
+
+# Values as of the last report, for report by exception
+sent_amb_temp = DISABLE_VALUE
+sent_amb_humid = HUMID_DISABLE_VALUE
+sent_ext1 = DISABLE_VALUE
+sent_ext2 = DISABLE_VALUE
+sent_limits = 0
+
+batch_buf = ''
+batch_count = 0
+batch_last_tick = 0
+batch_stride = 1  # samples per batched sample, see _load_config()
+batch_skip = 0    # samples since the last batched one
 
 door_1_open = False
 door_2_open = False
+door_pins = False  # a door is on its DOOR_IN pin
+ext1_adc = EXT_1_ENABLED  # probe 1 is read with the ADC, see _load_config()
+ext2_adc = EXT_2_ENABLED
 
 current_state = STATE_STARTUP
 silenced = False
-link_quality = 0
+link_quality = 0  # -dBm, smoothed, from packets the gateway sends us; full bars until one arrives
+lq_avg16 = 0  # link_quality scaled by 16, keeps the fraction the average needs
+lq_seen = False  # a packet from the gateway has been heard since boot
+report_ttl = GW_COMM_MCAST_TTL
+ttl_ok_count = 0
+gw_waiting = False  # listening after a report and the gateway has not answered yet
+gw_addr = None  # where reports go by unicast, None to multicast them
+gw_fails = 0  # unanswered unicast reports in a row
+gw_age = 0  # samples since gw_addr was learned
+duty_tlm_age = 0  # samples since duty cycle totals last went out in a report
 
 
 @setHook(HOOK_STARTUP)
@@ -107,12 +242,14 @@ def start():
     init_pins_low_power()
     init_snap_hw()
     init_buzzer()
+    enable_sym_ctr()  # free-running time base, keeps counting while asleep
 
     # Initialize the flash device
     init_AT45DB(FLASH_CS)
 
     # Initialize command port processor
     uniConnect(DS_STDIO, DS_UART0)   # stdin <- uart0
+    uniConnect(DS_UART0, DS_STDIO)   # uart0 <- stdout, LCD command port transmit queue
     initUart(0, 1)  # 115.2k
     uniConnect(DS_STDIO, DS_UART1)   # stdin <- uart1
     initUart(1, 1)  # 115.2k
@@ -130,58 +267,277 @@ def start():
     CTLCD_show_ver(VERSION)
 
 
-def run_fsm():
-    global report_cntr, current_state, found_alert, alert_cntr, alert_interval, in_audio, audio_cntr
-    
-    while current_state == STATE_NORMAL and not in_audio:
-        sleep(2, -LCD_UPDATE_INT)
+def _run_scheduler():
+    """Run due tasks and sleep until the next deadline. Returns only when the node has to
+       stay awake (radio, UART or buzzer busy); the 10ms hook then calls back in.
+    """
+    while True:
+        task = sched_pop_due()
+        while task >= 0:
+            _run_task(task)
+            task = sched_pop_due()
 
-        # check button
-        if readPin(PB_SWITCH_NEW):
-            button_event(True)
-        else:
-            button_event(False)
+        if _must_stay_awake():
+            return
 
-        report_cntr += 1
-        read_temps()
+        duty_stop(DUTY_AWAKE)
+        duty_start(DUTY_ASLEEP)
+        if door_pins:
+            _door_sleep()
+        else:
+            sched_sleep()
+        duty_stop(DUTY_ASLEEP)
+        duty_start(DUTY_AWAKE)
+
+
+def _must_stay_awake():
+    return current_state != STATE_NORMAL or buzz_sounding() or CTLCD_tx_busy() or sample_log_draining()
+
+
+def _run_task(task):
+    if task == TASK_SAMPLE:
+        sched_at(TASK_SAMPLE, LCD_UPDATE_INT)
+        _sample_task()
+    elif task == TASK_REPORT:
+        _report_task()
+    elif task == TASK_AUDIO:
+        _audio_task()
+    elif task == TASK_LISTEN_END:
+        _listen_end_task()
+    elif task == TASK_BATT:
+        sched_at(TASK_BATT, BATT_CHECK_INT)
         _update_lcd_batt()
-        _update_lcd_signal(link_quality)
+        sched_at(TASK_LCD, 0)
+    elif task == TASK_LCD:
+        # One display frame per cycle, and only if something changed
         CTLCD_updateDisplay()
+        if CTLCD_tx_busy():
+            duty_start(DUTY_UART)
+    elif task == TASK_RESEND:
+        _resend_task()
+    elif task == TASK_DOOR:
+        _door_task()
+
+
+def _sched_start():
+    """Leave startup: first sample one interval from now, battery straight away"""
+    sched_at(TASK_BATT, 0)
+    sched_at(TASK_SAMPLE, LCD_UPDATE_INT)
+    if door_pins:
+        sched_at(TASK_DOOR, 0)  # show where the doors are now
+    duty_start(DUTY_AWAKE)
+
+
+def _sample_task():
+    global report_cntr, found_alert, alert_cntr, alert_age, alert_interval, silenced, gw_age
+    global duty_tlm_age, batch_skip
+
+    # check button
+    if readPin(PB_SWITCH_NEW):
+        button_event(True)
+    else:
+        button_event(False)
+
+    report_cntr += 1
+    if gw_addr != None:
+        gw_age += 1
+    duty_tlm_age += 1
+    read_temps()
+    if SAMPLE_LOG_ENABLED:
+        sample_log_append(last_amb_temp, last_amb_humid, last_ext1, last_ext2)
+    if REPORT_BATCH_SIZE > 0:
+        batch_skip += 1
+        if batch_skip >= batch_stride:
+            _batch_sample()
+    _update_lcd_signal(link_quality)
+    sched_at(TASK_LCD, 0)
+
+    if report_cntr >= current_interval or (REPORT_BATCH_SIZE > 0 and batch_count >= REPORT_BATCH_SIZE):
+        sched_at(TASK_REPORT, 0)
+        return
+
+    if found_alert:
+        alert_cntr += 1
+        alert_age += 1
+        found_alert = False
+        CTLCD_set_Alert(ICON_STATE_BLINK)
+        if alert_cntr >= alert_interval and not buzz_playing():
+            alert_cntr = 0
+            if AUDIO_ALERT and not silenced:
+                _audio_next(buzz_play(_alert_pattern()))
+            sched_at(TASK_REPORT, 0)
+    elif not found_alert:
+        alert_age = 0
+        silenced = False
+        CTLCD_set_Alert(ICON_STATE_OFF)
 
-        if report_cntr >= current_interval:
-            send_report()
-            return
 
-        if found_alert:
-            alert_cntr += 1
-            found_alert = False
-            CTLCD_set_Alert(ICON_STATE_BLINK)
-            CTLCD_updateDisplay()
-            if alert_cntr >= alert_interval:
-                in_audio = True
-                send_report()
-        elif not found_alert:
-            CTLCD_set_Alert(ICON_STATE_OFF)
-            CTLCD_updateDisplay()
-            in_audio = False
-        
-    if in_audio:
-        if audio_cntr == 0:
-            _set_buzzer_freq(500, True)
-        elif audio_cntr == 250:
-            _set_buzzer_freq(250, True)
-        elif audio_cntr >= 500:
-            _set_buzzer_state(False)
-            in_audio = False
-            alert_cntr = 0
-        audio_cntr += 1
+def _report_task():
+    if current_state != STATE_NORMAL:
+        # Previous report still going out, or still listening after it
+        sched_at(TASK_REPORT, REPORT_RETRY_MS)
+        return
+    send_report()
+
+
+def _alert_pattern():
+    if alert_age >= AUDIO_ESCALATE_INTV / INTERVAL_DELAY:
+        return AUDIO_PATTERN_CRITICAL
+    return AUDIO_PATTERN_WARN
+
+
+def _audio_task():
+    _audio_next(buzz_step())
+
+
+def _audio_next(ms):
+    """The alert pattern is on a note boundary: wake again for the next one in ms, 0 if it is over"""
+    if buzz_sounding():
+        duty_start(DUTY_BUZZER)
+    else:
+        duty_stop(DUTY_BUZZER)
+    if ms > 0:
+        sched_at(TASK_AUDIO, ms)
+    else:
+        batmon_invalidate()
 
 
 def send_report():
-    global current_state, report_rpc_ref, report_cntr
-    mcastRpc(GW_COMM_MCAST_GROUP, GW_COMM_MCAST_TTL, "rm150_rpt", localAddr(), REPORT_INTV, last_amb_temp, last_amb_humid, last_ext1, last_ext2)
+    global batch_buf, batch_count, gw_addr, rpt_payload, rpt_interval, rpt_seq, rpt_tries, duty_tlm_age
+    global sent_amb_temp, sent_amb_humid, sent_ext1, sent_ext2, sent_limits
+
+    # Longest the gateway should expect to wait for the next report
+    rpt_interval = current_interval * INTERVAL_DELAY
+
+    if gw_age >= GW_REDISCOVER_INTV / INTERVAL_DELAY:
+        gw_addr = None  # multicast this one, to find out whether a nearer gateway has appeared
+
+    # Newer data replaces a report still waiting to be retransmitted
+    sched_cancel(TASK_RESEND)
+    rpt_seq = (rpt_seq + 1) & 0xFF
+    rpt_tries = 0
+
+    flags = rpt_flags
+    if REPORT_ACKED and rpt_restart:
+        flags |= RPT_F_RESTART
+    if DUTY_TELEMETRY_INTV > 0 and duty_tlm_age >= DUTY_TELEMETRY_INTV / INTERVAL_DELAY:
+        flags |= RPT_F_DUTY  # packed reports only
+        duty_tlm_age = 0
+
+    if REPORT_BATCH_SIZE > 0:
+        rpt_payload = rpt_header(flags | RPT_F_BATCH, rpt_interval, batch_count, rpt_seq) + batch_buf
+        batch_buf = ''
+        batch_count = 0
+    elif REPORT_PACKED or REPORT_RAW:
+        rpt_payload = rpt_header(flags, rpt_interval, 0, rpt_seq) + _packed_sample()
+    else:
+        rpt_payload = None  # six (or seven) arguments, from the sent_ values
+    if rpt_payload != None and flags & RPT_F_DUTY:
+        rpt_payload += duty_pack()
+
+    sent_amb_temp = last_amb_temp
+    sent_amb_humid = last_amb_humid
+    sent_ext1 = last_ext1
+    sent_ext2 = last_ext2
+    sent_limits = _limit_state()
+
+    _report_rpc()
+
+
+def _report_rpc():
+    """Send (or resend) the current report to the gateway, or the group if there is none"""
+    global current_state, report_rpc_ref
+
+    if rpt_payload != None:
+        if gw_addr == None:
+            mcastRpc(GW_COMM_MCAST_GROUP, report_ttl, "rm150_rpt", rpt_payload)
+        else:
+            rpc(gw_addr, "rm150_rpt", rpt_payload)
+    elif not REPORT_ACKED:
+        if gw_addr == None:
+            mcastRpc(GW_COMM_MCAST_GROUP, report_ttl, "rm150_rpt", localAddr(), rpt_interval, sent_amb_temp, sent_amb_humid, sent_ext1, sent_ext2)
+        else:
+            rpc(gw_addr, "rm150_rpt", localAddr(), rpt_interval, sent_amb_temp, sent_amb_humid, sent_ext1, sent_ext2)
+    else:
+        seq = rpt_seq
+        if rpt_restart:
+            seq |= 0x100  # RPT_F_RESTART, for the argument form
+        if gw_addr == None:
+            mcastRpc(GW_COMM_MCAST_GROUP, report_ttl, "rm150_rpt", localAddr(), rpt_interval, sent_amb_temp, sent_amb_humid, sent_ext1, sent_ext2, seq)
+        else:
+            rpc(gw_addr, "rm150_rpt", localAddr(), rpt_interval, sent_amb_temp, sent_amb_humid, sent_ext1, sent_ext2, seq)
     report_rpc_ref = getInfo(9)
     current_state = STATE_REPORT_RPC_QUEUED
+    duty_start(DUTY_RADIO_TX)
+
+
+def _resend_task():
+    if current_state != STATE_NORMAL:
+        sched_at(TASK_RESEND, REPORT_RETRY_MS)
+        return
+    _report_rpc()
+
+
+def _check_exception():
+    """Report by exception: bring the next report forward if anything moved enough to matter"""
+    global report_cntr
+
+    if _moved(last_amb_temp, sent_amb_temp, DEADBAND_AMB) or \
+       _moved(last_ext1, sent_ext1, DEADBAND_EXT) or \
+       _moved(last_ext2, sent_ext2, DEADBAND_EXT) or \
+       (HAS_HUMIDITY_SENSOR and _moved(last_amb_humid, sent_amb_humid, DEADBAND_HUMID)) or \
+       _limit_state() != sent_limits:
+        report_cntr = current_interval + 1  # Send a update on change
+
+
+def _moved(now, sent, deadband):
+    delta = now - sent
+    return delta > deadband or delta < -deadband
+
+
+def _limit(value, low, high):
+    if value < low:
+        return LIMITS_LOW
+    elif value > high:
+        return LIMITS_HIGH
+    return LIMITS_OK
+
+
+def _limit_state():
+    """Which side of its alarm limits each channel is on, 2 bits per channel"""
+    return _limit(last_amb_temp, AMB_TEMP_LOW, AMB_TEMP_HIGH) | \
+           (_limit(last_ext1, EXT_1_LOW, EXT_1_HIGH) << 2) | \
+           (_limit(last_ext2, EXT_2_LOW, EXT_2_HIGH) << 4)
+
+
+def _packed_sample():
+    doors = 0
+    if door_1_open:
+        doors |= 1
+    if door_2_open:
+        doors |= 2
+    if rpt_flags & RPT_F_RAW:
+        return rpt_raw_sample(rpt_flags, temp_cj_raw(ADS1118_CS1), last_hih61_raw, last_ext1_raw,
+                              temp_cj_raw(ADS1118_CS2), last_ext2_raw, doors)
+    return rpt_sample(rpt_flags, last_amb_temp, last_amb_humid, last_ext1, last_ext2, doors)
+
+
+def _batch_sample():
+    """
+    Append the latest sample to the batch, prefixed with dt: the time since the
+    previous sample in units of 1 << BATCH_DT_SHIFT symbol ticks.
+    """
+    global batch_buf, batch_count, batch_last_tick, batch_skip
+
+    batch_skip = 0
+    now = sym_ticks_4ms()
+    dt = sym_elapsed(batch_last_tick, now) >> BATCH_DT_SHIFT
+    if dt > 255:
+        dt = 255
+    batch_last_tick = now
+
+    batch_buf += chr(dt) + _packed_sample()
+    batch_count += 1
 
 
 @setHook(HOOK_RPC_SENT)
@@ -189,11 +545,199 @@ def on_rpc_sent(ref):
     global report_rpc_ref, current_state, report_cntr
     if ref == report_rpc_ref:
         report_rpc_ref = None
-        report_cntr = 0
+        duty_stop(DUTY_RADIO_TX)
+        if rpt_tries == 0:
+            report_cntr = 0
+        else:
+            # Retries keep the radio busy; a single report is too short to show on the battery
+            batmon_invalidate()
+        _start_listen()
+    elif sample_log_rpc_sent(ref):
+        sched_at(TASK_LISTEN_END, GW_LISTEN_MS)  # keep listening while the backlog goes out
+
+
+def _start_listen():
+    """Leave the receiver on briefly after a report so the gateway can reach us"""
+    global current_state, gw_waiting
+
+    if GW_LISTEN_MS > 0:
+        rx(True)
+        duty_start(DUTY_RADIO_RX)
+        current_state = STATE_LISTEN
+        gw_waiting = True
+        sched_at(TASK_LISTEN_END, GW_LISTEN_MS)
+    else:
         current_state = STATE_NORMAL
 
 
+def _listen_end_task():
+    global current_state, gw_waiting, report_ttl, ttl_ok_count, gw_addr, gw_fails, rpt_tries
+
+    if sample_log_draining():
+        sched_at(TASK_LISTEN_END, GW_LISTEN_MS)
+    else:
+        rx(False)
+        duty_stop(DUTY_RADIO_RX)
+        current_state = STATE_NORMAL
+        if gw_waiting:
+            # No answer: the gateway may be further away now, flood the next report
+            gw_waiting = False
+            if lq_seen:
+                _lq_sample(LQ_NO_LINK)
+            report_ttl = GW_COMM_MCAST_TTL
+            ttl_ok_count = 0
+            if gw_addr != None:
+                gw_fails += 1
+                if gw_fails >= GW_FAIL_MAX:
+                    gw_addr = None
+            if REPORT_ACKED and rpt_tries < RPT_RETRY_MAX:
+                rpt_tries += 1
+                sched_at(TASK_RESEND, _retry_delay(rpt_tries))
+
+
+def _retry_delay(tries):
+    delay = RPT_RETRY_BASE_MS
+    while tries > 1 and delay < SCHED_MAX_MS / 2:
+        delay *= 2
+        tries -= 1
+    return delay + (random() & RPT_RETRY_JITTER)
+
+
+def gw_resp(hops, seq):
+    """RPC: gateway heard report seq. hops is how many it took to get there, 0 if it can't tell"""
+    global gw_waiting, report_ttl, ttl_ok_count, gw_addr, gw_fails, gw_age, rpt_restart
+
+    _lq_sample(getLq())
+    if not gw_waiting or (REPORT_ACKED and seq != rpt_seq):
+        return  # not an answer to the report just sent
+    gw_waiting = False
+    rpt_restart = False
+    gw_fails = 0
+
+    if GW_TTL_ADAPT:
+        if hops > 0:
+            report_ttl = hops + GW_TTL_MARGIN
+            ttl_ok_count = 0
+        elif gw_addr == None:
+            # Only a multicast report says anything about its TTL
+            ttl_ok_count += 1
+            if ttl_ok_count >= GW_TTL_PROBE and report_ttl > 1:
+                report_ttl -= 1
+                ttl_ok_count = 0
+        if report_ttl > GW_COMM_MCAST_TTL:
+            report_ttl = GW_COMM_MCAST_TTL
+
+    if GW_UNICAST and gw_addr == None:
+        gw_addr = rpcSourceAddr()
+        gw_age = 0
+
+
+def _lq_sample(lq):
+    """Fold one link quality reading (-dBm) into the average shown on the display"""
+    global lq_avg16, link_quality, lq_seen
+
+    if lq_seen:
+        lq_avg16 += (lq * 16 - lq_avg16) / LQ_EWMA_DIV
+    else:
+        lq_seen = True
+        lq_avg16 = lq * 16
+    link_quality = lq_avg16 / 16
+
+
+def duty_query():
+    """RPC: gateway asks for the busy time per subsystem, sent back as rm150_duty(totals)"""
+    rpc(rpcSourceAddr(), "rm150_duty", duty_pack())
+
+
+def hist_query():
+    """RPC: gateway asks for the read_temps() stage histograms, sent back as
+       rm150_hist(histograms, ADC timeouts)
+    """
+    rpc(rpcSourceAddr(), "rm150_hist", hist_pack(), ads_timeouts)
+
+
+def hist_clear():
+    """RPC: zero the stage histograms and the ADC timeout count"""
+    global ads_timeouts
+    hist_reset()
+    ads_timeouts = 0
+
+
+def log_drain():
+    """RPC: gateway asks for the samples stored since the last drain"""
+    _lq_sample(getLq())
+    sched_at(TASK_LISTEN_END, GW_LISTEN_MS)
+    sample_log_drain(rpcSourceAddr())
+
+
+@setHook(HOOK_STDOUT)
+def on_stdout():
+    CTLCD_tx_done()
+    if not CTLCD_tx_busy():
+        duty_stop(DUTY_UART)
+
+
 @setHook(HOOK_GPIN)
+def on_gpin(pin, is_set):
+    # Only runs while the node stays awake between hooks; _door_sleep() covers the rest
+    if pin == DOOR_IN1 or pin == DOOR_IN2:
+        sched_at(TASK_DOOR, DOOR_DEBOUNCE_MS)  # restarted by every bounce
+    else:
+        button_event(is_set)
+
+
+def _door_sleep():
+    """sched_sleep(), woken early by a door input leaving the state last shown. The scheduler
+       loop holds the CPU, so HOOK_GPIN can't run and edges while awake go unseen: the pins
+       are compared with door_1_open/door_2_open instead, and any difference starts the debounce.
+    """
+    moved = False
+    if EXT_1_MONITORED_ITEM == 2 and (readPin(DOOR_IN1) == DOOR_OPEN_LEVEL) != door_1_open:
+        moved = True
+    if EXT_2_MONITORED_ITEM == 2 and (readPin(DOOR_IN2) == DOOR_OPEN_LEVEL) != door_2_open:
+        moved = True
+    if moved:
+        if not sched_pending(TASK_DOOR):
+            sched_at(TASK_DOOR, DOOR_DEBOUNCE_MS)
+        sched_sleep()  # no longer than the debounce, which reads the pins again
+        return
+
+    # Wake on the level for the opposite of what is shown
+    if EXT_1_MONITORED_ITEM == 2:
+        wakeupOn(DOOR_IN1, True, DOOR_OPEN_LEVEL != door_1_open)
+    if EXT_2_MONITORED_ITEM == 2:
+        wakeupOn(DOOR_IN2, True, DOOR_OPEN_LEVEL != door_2_open)
+    sched_sleep()
+    wakeupOn(DOOR_IN1, False, False)
+    wakeupOn(DOOR_IN2, False, False)
+
+
+def _door_task():
+    """The door inputs have been still for DOOR_DEBOUNCE_MS: show them, and report a change now"""
+    global door_1_open, door_2_open, last_ext1, last_ext2
+
+    changed = False
+    if EXT_1_MONITORED_ITEM == 2:
+        is_open = readPin(DOOR_IN1) == DOOR_OPEN_LEVEL
+        changed = is_open != door_1_open
+        door_1_open = is_open
+        last_ext1 = 1 if is_open else 0
+        CTLCD_set_T_ext1(DOOR_OPEN if is_open else DOOR_CLOSED)
+    if EXT_2_MONITORED_ITEM == 2:
+        is_open = readPin(DOOR_IN2) == DOOR_OPEN_LEVEL
+        if is_open != door_2_open:
+            changed = True
+        door_2_open = is_open
+        last_ext2 = 1 if is_open else 0
+        CTLCD_set_T_ext2(DOOR_OPEN if is_open else DOOR_CLOSED)
+    sched_at(TASK_LCD, 0)
+
+    if changed:
+        if REPORT_BATCH_SIZE > 0:
+            _batch_sample()  # the batch goes out now, ending with the new state
+        sched_at(TASK_REPORT, 0)
+
+
 def button_event(is_set):
     global silenced, remote_test
 
@@ -201,11 +745,56 @@ def button_event(is_set):
         if not silenced:
             CTLCD_set_Alert(ICON_STATE_ON)
             silenced = True
+            if buzz_playing():
+                buzz_stop()
+                sched_cancel(TASK_AUDIO)
+                _audio_next(0)
 
 
 def _load_config():
-    global IN_FAHRENHEIT
-    
+    global IN_FAHRENHEIT, REPORT_BATCH_SIZE, current_interval, report_cntr, rpt_flags, rpt_seq, batch_stride
+    global EXT_1_MONITORED_ITEM, EXT_2_MONITORED_ITEM, door_pins, ext1_adc, ext2_adc
+
+    # Fields carried by packed reports
+    rpt_flags = RPT_F_AMB
+    if HAS_HUMIDITY_SENSOR:
+        rpt_flags |= RPT_F_HUMID
+    if EXT_1_ENABLED:
+        rpt_flags |= RPT_F_DOOR1 if EXT_1_MONITORED_ITEM != 0 else RPT_F_EXT1
+    if EXT_2_ENABLED:
+        rpt_flags |= RPT_F_DOOR2 if EXT_2_MONITORED_ITEM != 0 else RPT_F_EXT2
+    if REPORT_RAW:
+        rpt_flags |= RPT_F_RAW
+    if REPORT_ACKED:
+        rpt_flags |= RPT_F_SEQ
+        rpt_seq = 0xFF  # the first report is 0
+
+    # A batch must fit one radio packet
+    if REPORT_BATCH_SIZE > REPORT_BATCH_MAX:
+        REPORT_BATCH_SIZE = REPORT_BATCH_MAX
+    if REPORT_RAW and REPORT_BATCH_SIZE > REPORT_BATCH_MAX_RAW:
+        REPORT_BATCH_SIZE = REPORT_BATCH_MAX_RAW
+    if DUTY_TELEMETRY_INTV > 0:
+        if REPORT_BATCH_SIZE > REPORT_BATCH_MAX_DUTY:
+            REPORT_BATCH_SIZE = REPORT_BATCH_MAX_DUTY
+        if REPORT_RAW and REPORT_BATCH_SIZE > REPORT_BATCH_MAX_RAW_DUTY:
+            REPORT_BATCH_SIZE = REPORT_BATCH_MAX_RAW_DUTY
+    if REPORT_BATCH_SIZE > 0:
+        # A batch covers at least REPORT_INTV, so batching never reports more often
+        samples = REPORT_INTV / INTERVAL_DELAY
+        batch_stride = (samples + REPORT_BATCH_SIZE - 1) / REPORT_BATCH_SIZE
+        REPORT_BATCH_SIZE = (samples + batch_stride - 1) / batch_stride
+        current_interval = REPORT_BATCH_SIZE * batch_stride
+    elif REPORT_BY_EXCEPTION:
+        current_interval = HEARTBEAT_INTV / INTERVAL_DELAY
+    report_cntr = current_interval + 1  # Send status at startup
+
+    temp_set_profile(ADC_PROFILE)
+    duty_enable(DUTY_ACCOUNTING)
+    hist_enable(LATENCY_HIST)
+    batmon_set_refresh(BATT_REFRESH_INTV / (BATT_CHECK_INT / 1000))
+    temp_cj_set_refresh(CJ_REFRESH_INTV / INTERVAL_DELAY)
+
     # Display Configurations
     if IN_FAHRENHEIT:
         CTLCD_set_Units(UNITS_F)
@@ -215,22 +804,70 @@ def _load_config():
     set_ext_probe(1, EXT_1_ENABLED)
     set_ext_probe(2, EXT_2_ENABLED)
 
+    # Doors on their DOOR_IN pins skip the ADC
+    if not EXT_1_ENABLED and EXT_1_MONITORED_ITEM == 2:
+        EXT_1_MONITORED_ITEM = 0
+    if not EXT_2_ENABLED and EXT_2_MONITORED_ITEM == 2:
+        EXT_2_MONITORED_ITEM = 0
+    ext1_adc = EXT_1_ENABLED and EXT_1_MONITORED_ITEM != 2
+    ext2_adc = EXT_2_ENABLED and EXT_2_MONITORED_ITEM != 2
+    door_pins = False
+    if EXT_1_MONITORED_ITEM == 2:
+        _door_pin_init(DOOR_IN1)
+    if EXT_2_MONITORED_ITEM == 2:
+        _door_pin_init(DOOR_IN2)
+
+
+def _door_pin_init(pin):
+    global door_pins
+    setPinDir(pin, False)
+    setPinPullup(pin, True)
+    monitorPin(pin, True)
+    door_pins = True
+
 
 def read_temps():
     """
     Read the temps/humidity from enabled sensors and update displays
     """
     global report_cntr, current_interval, last_amb_temp, last_ext1, last_ext2, silenced, last_amb_humid, found_alert, door_1_open, door_2_open
-    
+    global last_ext1_raw, last_ext2_raw, last_hih61_raw
+
+    # Each stage is timed into its histogram (drivers/latency_hist.py)
+    t_start = t = sym_ticks_16us()
     if HAS_HUMIDITY_SENSOR:
         HIH61_start_conversion()
-
-    selectADC_CS(ADS1118_CS1)
-    temp_read_step1()  # ext probe 1
-
-    sleep(2, -TEMP_ADC_SAMP_MS)
-
-    tempr = temp_read_step2(OFFSET_AMBIENT_1)  # ext probe 1
+        t = hist_add(HIST_HIH61_START, t)
+
+    # Both ADCs convert side by side: cold junctions in one window, thermocouples in the next.
+    # Each window waits on the chip that was started last.
+    # The cold junction of probe 1 is also the ambient temp, so that refreshes with it.
+    duty_start(DUTY_ADC)
+    if temp_cj_due():
+        selectADC_CS(ADS1118_CS1)
+        temp_read_step1()  # ext probe 1
+        if ext2_adc:
+            selectADC_CS(ADS1118_CS2)
+            temp_read_step1()  # ext probe 2
+        t = hist_add(HIST_ADC_START, t)
+
+        temp_wait()
+        t = hist_add(HIST_CJ_WAIT, t)
+
+        if ext2_adc:
+            temp_read_step2(OFFSET_AMBIENT_2)  # ext probe 2
+            selectADC_CS(ADS1118_CS1)
+        tempr = temp_read_step2(OFFSET_AMBIENT_1)  # ext probe 1
+        hist_add(HIST_CJ_READ, t)
+    else:
+        selectADC_CS(ADS1118_CS1)
+        if ext1_adc:
+            temp_start_therm()  # ext probe 1
+        if ext2_adc:
+            selectADC_CS(ADS1118_CS2)
+            temp_start_therm()  # ext probe 2
+        hist_add(HIST_ADC_START, t)
+        tempr = last_amb_temp
 
     if True: #tempr != HTU32_ERR_VAL:
         last_amb_temp = tempr
@@ -246,10 +883,17 @@ def read_temps():
             tempr = c_to_f(tempr)
         CTLCD_set_T_amb(tempr)
 
-    if EXT_1_ENABLED:
-        sleep(2, -TEMP_ADC_SAMP_MS)
+    if ext1_adc or ext2_adc:
+        t = sym_ticks_16us()
+        temp_wait()
+        hist_add(HIST_TC_WAIT, t)
 
+    if ext1_adc:
+        t = sym_ticks_16us()
+        selectADC_CS(ADS1118_CS1)
         tempr = last_ext1 = temp_read_step3(OFFSET_EXTERNAL_1)  # ext probe 1
+        last_ext1_raw = therm_raw
+        hist_add(HIST_TC_READ, t)
 
         if EXT_1_MONITORED_ITEM == 1:
             # Attached to a door sensor
@@ -280,15 +924,19 @@ def read_temps():
                 tempr = c_to_f(tempr)
             CTLCD_set_T_ext1(tempr)
 
-    if EXT_2_ENABLED:
-        selectADC_CS(ADS1118_CS2)
-        temp_read_step1()  # ext probe 2
-
-    sleep(2, -TEMP_ADC_SAMP_MS)
-
     if HAS_HUMIDITY_SENSOR:
-        tempr = HIH61_get_humid(OFFSET_HUMIDITY)
-        last_amb_humid = tempr
+        t = sym_ticks_16us()
+        if REPORT_RAW:
+            # Reported as read, the gateway converts it
+            last_hih61_raw = HIH61_get_raw()
+            if last_hih61_raw != '':
+                temp_cj_ambient(HIH61_get_temp() * 10)
+        else:
+            tempr = HIH61_get_humid(OFFSET_HUMIDITY)
+            last_amb_humid = tempr
+            if tempr != HIH61_ERR_VAL:
+                temp_cj_ambient(HIH61_get_temp() * 10)
+        hist_add(HIST_HUMID_READ, t)
         # currently not displaying Humidity, only reporting it
         if False:
             if last_amb_humid < AMB_HUMID_LOW:
@@ -301,12 +949,12 @@ def read_temps():
                 CTLCD_set_RH_limits(LIMITS_OK)
             CTLCD_set_RH(last_amb_humid)
 
-    if EXT_2_ENABLED:
-        temp_read_step2(OFFSET_AMBIENT_2)  # ext probe 2
-
-        sleep(2, -TEMP_ADC_SAMP_MS)
-
+    if ext2_adc:
+        t = sym_ticks_16us()
+        selectADC_CS(ADS1118_CS2)
         tempr = last_ext2 = temp_read_step3(OFFSET_EXTERNAL_2)  # ext probe 2
+        last_ext2_raw = therm_raw
+        hist_add(HIST_TC_READ, t)
 
         if EXT_2_MONITORED_ITEM == 1:
             # Attached to a door sensor
@@ -336,6 +984,11 @@ def read_temps():
             elif IN_FAHRENHEIT:
                 tempr = c_to_f(tempr)
             CTLCD_set_T_ext2(tempr)
+    duty_stop(DUTY_ADC)
+    hist_add(HIST_READING, t_start)
+
+    if REPORT_BY_EXCEPTION:
+        _check_exception()
 
 
 @setHook(HOOK_1S)
@@ -354,15 +1007,21 @@ def on_1s(ms):
             CTLCD_set_T_amb(last_amb_temp)
             CTLCD_set_T_ext1(last_ext1)
             CTLCD_set_T_ext2(last_ext2)
+            CTLCD_updateDisplay()
+            _sched_start()
+            _run_scheduler()
         else:
             pulsePin(DBG_LED_RED, 250, False)
             CTLCD_set_RH(STARTUP_WAIT-startup_cntr)
-        CTLCD_updateDisplay()
+            CTLCD_updateDisplay()
 
 
-@setHook(HOOK_1MS)
-def on_1ms(ms):
-    run_fsm()
+@setHook(HOOK_10MS)
+def on_10ms(ms):
+    # Only gets here while awake. Past startup the scheduler otherwise sleeps between
+    # deadlines, so this just picks it back up after a stay-awake wait.
+    if current_state != STATE_STARTUP:
+        _run_scheduler()
 
 
 def set_ext_probe(which, enable):
@@ -383,5 +1042,4 @@ def _update_lcd_signal(lq):
 
 
 def selectADC_CS(cs_pin):
-    global ADS1118_CS
-    ADS1118_CS = cs_pin
+    temp_select(cs_pin)
@@ -0,0 +1,5 @@
+# Copyright (C) 2014 Synapse Wireless, Inc.
+"""Host (gateway) side support for RM150 nodes.
+   Runs under CPython 2.7 alongside SNAP Connect, from the root of this tree so the
+   node's drivers package can be imported for shared constants.
+"""
@@ -0,0 +1,185 @@
+# Copyright (C) 2014 Synapse Wireless, Inc.
+"""Run the scripts' native AVR machine code on the host, instruction by instruction.
+   Only the instructions the scripts' native functions use are decoded; anything else raises
+   ValueError. This is a reference for checking Python equivalents (rm150host.snappy's
+   NATIVE_NAMES, rm150host.convert) against the bytes that actually run on the node, and is far
+   too slow to stand in for them.
+
+   Ex.
+     ns = snappy.new_namespace()
+     snappy.load('temp_meas', ns)
+     call(ns['conv_func'], 1000)   # 1799
+"""
+
+FRAME = 0x100  # where call() puts the SNAPpy argument frame in data memory
+
+C, Z, N, V, S, H, T = 1, 2, 4, 8, 16, 32, 64  # SREG bits
+
+_cores = {}  # machine code -> its Core, so each string is decoded once
+
+
+class Core(object):
+    """32 registers, SREG and 64K of data memory, running one string of machine code"""
+
+    def __init__(self, code):
+        if len(code) % 2:
+            raise ValueError("machine code is an odd number of bytes")
+        self.words = [ord(code[i]) | ord(code[i + 1]) << 8 for i in range(0, len(code), 2)]
+        self.r = [0] * 32
+        self.sreg = 0
+        self.mem = bytearray(0x10000)
+
+    def flag(self, bit):
+        return 1 if self.sreg & bit else 0
+
+    def _set(self, bit, on):
+        if on:
+            self.sreg |= bit
+        else:
+            self.sreg &= ~bit
+
+    def _nzs(self, result, v):
+        """Set N, Z, V and S for an 8-bit result"""
+        self._set(N, result & 0x80)
+        self._set(Z, result == 0)
+        self._set(V, v)
+        self._set(S, bool(result & 0x80) != bool(v))
+
+    def _add(self, d, k, carry):
+        a = self.r[d]
+        full = a + k + carry
+        result = full & 0xFF
+        self._set(C, full > 0xFF)
+        self._nzs(result, (a ^ result) & (k ^ result) & 0x80)
+        self.r[d] = result
+
+    def _sub(self, d, k, carry, keep_z):
+        a = self.r[d]
+        result = (a - k - carry) & 0xFF
+        was_z = self.flag(Z)
+        self._set(C, k + carry > a)
+        self._nzs(result, (a ^ k) & (a ^ result) & 0x80)
+        if keep_z:
+            self._set(Z, result == 0 and was_z)
+        self.r[d] = result
+
+    def _shift_right(self, d, top):
+        a = self.r[d]
+        result = (a >> 1) | top
+        self._set(C, a & 1)
+        self._nzs(result, bool(result & 0x80) != bool(a & 1))
+        self.r[d] = result
+
+    def run(self, max_steps=10000):
+        """Run from the first word until RET"""
+        r = self.r
+        pc = 0
+        for _ in range(max_steps):
+            x = self.words[pc]
+            pc += 1
+            d = (x >> 4) & 0x1F
+            rr = (x & 0xF) | ((x >> 5) & 0x10)
+            di = 16 + ((x >> 4) & 0xF)
+            k = ((x >> 4) & 0xF0) | (x & 0xF)
+            top6 = x >> 10
+
+            if x == 0x9508:                                   # RET
+                return
+            elif top6 == 0x03:                                # ADD
+                self._add(d, r[rr], 0)
+            elif top6 == 0x07:                                # ADC
+                self._add(d, r[rr], self.flag(C))
+            elif top6 == 0x02:                                # SBC
+                self._sub(d, r[rr], self.flag(C), True)
+            elif top6 == 0x06:                                # SUB
+                self._sub(d, r[rr], 0, False)
+            elif top6 in (0x08, 0x09, 0x0A):                  # AND, EOR, OR
+                if top6 == 0x08:
+                    r[d] &= r[rr]
+                elif top6 == 0x09:
+                    r[d] ^= r[rr]
+                else:
+                    r[d] |= r[rr]
+                self._nzs(r[d], 0)
+            elif top6 == 0x0B:                                # MOV
+                r[d] = r[rr]
+            elif top6 == 0x27:                                # MUL
+                product = r[d] * r[rr]
+                r[0], r[1] = product & 0xFF, product >> 8
+                self._set(C, product & 0x8000)
+                self._set(Z, product == 0)
+            elif x >> 8 == 0x01:                              # MOVW
+                dd, rs = ((x >> 4) & 0xF) * 2, (x & 0xF) * 2
+                r[dd], r[dd + 1] = r[rs], r[rs + 1]
+            elif x >> 12 == 0xE:                              # LDI
+                r[di] = k
+            elif x >> 12 == 0x4:                              # SBCI
+                self._sub(di, k, self.flag(C), True)
+            elif x >> 12 == 0x5:                              # SUBI
+                self._sub(di, k, 0, False)
+            elif x >> 9 == 0x4B:                              # ADIW, SBIW
+                dw = 24 + 2 * ((x >> 4) & 3)
+                kw = ((x >> 2) & 0x30) | (x & 0xF)
+                a = r[dw] | r[dw + 1] << 8
+                full = a - kw if x & 0x100 else a + kw
+                result = full & 0xFFFF
+                self._set(C, full < 0 or full > 0xFFFF)
+                self._set(Z, result == 0)
+                self._set(N, result & 0x8000)
+                self._set(V, (a ^ result) & (a if x & 0x100 else result) & 0x8000)
+                self._set(S, self.flag(N) != self.flag(V))
+                r[dw], r[dw + 1] = result & 0xFF, result >> 8
+            elif x & 0xD000 == 0x8000:                        # LDD, STD (Y or Z + q)
+                q = ((x >> 8) & 0x20) | ((x >> 7) & 0x18) | (x & 7)
+                base = 28 if x & 8 else 30
+                addr = (r[base] | r[base + 1] << 8) + q
+                if x & 0x200:
+                    self.mem[addr] = r[d]
+                else:
+                    r[d] = self.mem[addr]
+            elif x & 0xFE0F == 0x9400:                        # COM
+                r[d] ^= 0xFF
+                self._nzs(r[d], 0)
+                self._set(C, True)
+            elif x & 0xFE0F == 0x9401:                        # NEG
+                a = r[d]
+                r[d] = (-a) & 0xFF
+                self._set(C, r[d] != 0)
+                self._nzs(r[d], r[d] == 0x80)
+            elif x & 0xFE0F == 0x9406:                        # LSR
+                self._shift_right(d, 0)
+            elif x & 0xFE0F == 0x9407:                        # ROR
+                self._shift_right(d, 0x80 if self.flag(C) else 0)
+            elif x & 0xFE0F == 0x9405:                        # ASR
+                self._shift_right(d, r[d] & 0x80)
+            elif x & 0xFE08 == 0xFA00:                        # BST
+                self._set(T, r[d] & (1 << (x & 7)))
+            elif x & 0xF800 in (0xF000, 0xF400):              # BRBS, BRBC
+                offset = (x >> 3) & 0x7F
+                if offset & 0x40:
+                    offset -= 0x80
+                if bool(self.sreg & (1 << (x & 7))) == (x & 0x400 == 0):
+                    pc += offset
+            else:
+                raise ValueError("unsupported AVR instruction %04x at word %d" % (x, pc - 1))
+        raise ValueError("no RET within %d instructions" % max_steps)
+
+
+def call(code, arg):
+    """SNAPpy call(code, arg) with one int argument, returning the int result.
+       The frame is laid out as conv_func reads it: r19:r18 points just past the argument
+       (low byte first), and the result goes 9 bytes below that as type 1, low, high.
+    """
+    core = _cores.get(code)
+    if core is None:
+        core = _cores[code] = Core(code)
+    core.r = [0] * 32
+    core.sreg = 0
+    arg &= 0xFFFF
+    core.mem[FRAME - 2], core.mem[FRAME - 1] = arg & 0xFF, arg >> 8
+    core.r[18], core.r[19] = FRAME & 0xFF, FRAME >> 8
+    core.run()
+    if core.mem[FRAME - 9] != 1:
+        raise ValueError("native code returned type %d, not an int" % core.mem[FRAME - 9])
+    value = core.mem[FRAME - 8] | core.mem[FRAME - 7] << 8
+    return value - 0x10000 if value & 0x8000 else value
@@ -0,0 +1,108 @@
+# Copyright (C) 2014 Synapse Wireless, Inc.
+"""Check rm150host/convert.py against the node's own code, then time it.
+   The references are the drivers run by rm150host.snappy (16-bit SNAPpy semantics), and for
+   c_to_f the conv_func machine code itself, run by rm150host.avr; snappy's Python copy of
+   that code is checked against it too. Every 16-bit input is checked for the
+   single-argument conversions.
+
+   Usage (from the root of this tree):
+     python -m rm150host.bench_convert [samples]
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from rm150host import avr, convert, snappy
+
+ALL_I16 = np.arange(-32768, 32768, dtype=np.int32)
+
+
+def reference():
+    ns = snappy.new_namespace()
+    snappy.load('temp_meas', ns)
+    snappy.load('HIH61_Humidity', ns)
+    return ns
+
+
+def _compare(name, got, inputs, ref):
+    want = np.array([ref(*args) for args in inputs], dtype=np.int32)
+    bad = np.flatnonzero(np.asarray(got) != want)
+    print "%-26s %8d inputs, %d differ" % (name, len(want), len(bad))
+    for i in bad[:5]:
+        print "    %r: numpy %d, node %d" % (inputs[i], got[i], want[i])
+    return len(bad)
+
+
+def _hih61(ns, func, *args):
+    def ref(response):
+        ns['HIH61_response'] = response
+        ns['HIH61_new_data_avail'] = False
+        return ns[func](*args)
+    return ref
+
+
+def check(ns):
+    """Returns the number of mismatches"""
+    singles = [(c,) for c in ALL_I16.tolist()]
+    bad = 0
+    bad += _compare('adc_to_C', convert.adc_to_C(ALL_I16), singles, ns['adc_to_C'])
+    bad += _compare('C_to_adc', convert.C_to_adc(ALL_I16), singles, ns['C_to_adc'])
+    bad += _compare('ads_conv_internal_temp_C', convert.ads_conv_internal_temp_C(ALL_I16), singles,
+                    ns['ads_conv_internal_temp_C'])
+    conv = dict((c, avr.call(ns['conv_func'], c)) for c in ALL_I16.tolist())
+    bad += _compare('native_c_to_f', [snappy.native_c_to_f(c) for c in ALL_I16.tolist()], singles, conv.get)
+    bad += _compare('c_to_f', convert.c_to_f(ALL_I16), singles, lambda c: snappy.i16(conv[c] + 320))
+
+    therm = np.repeat(ALL_I16[::13], 26)
+    cold = np.tile(convert.C_to_adc(np.arange(-1000, 11601, 500)), len(therm) // 26)
+    bad += _compare('adc_cj_to_C', convert.adc_cj_to_C(therm, cold),
+                    zip(therm.tolist(), cold.tolist()), ns['adc_cj_to_C'])
+
+    pairs = np.arange(65536, dtype=np.int32)
+    raw = np.zeros((65536, 4), dtype=np.uint8)
+    raw[:, 0], raw[:, 1] = pairs >> 8, pairs & 0xFF
+    responses = [(r.tostring(),) for r in raw]
+    bad += _compare('HIH61_humid', convert.HIH61_humid(raw, 3), responses, _hih61(ns, 'HIH61_get_humid', 3))
+    raw[:, 0], raw[:, 1], raw[:, 2], raw[:, 3] = 0, 0, pairs >> 8, pairs & 0xFF
+    responses = [(r.tostring(),) for r in raw]
+    bad += _compare('HIH61_temp', convert.HIH61_temp(raw), responses, _hih61(ns, 'HIH61_get_temp'))
+    return bad
+
+
+def bench(n):
+    rng = np.random.RandomState(1)
+    counts = rng.randint(convert.MIN_ADC - 100, convert.MAX_ADC + 100, n).astype(np.int32)
+    temps = rng.randint(-1100, 11700, n).astype(np.int32)
+    cj = rng.randint(0, 1600, n).astype(np.int32) << 2
+
+    def pipeline():
+        cold = convert.C_to_adc(convert.ads_conv_internal_temp_C(cj))
+        return convert.c_to_f(convert.adc_cj_to_C(counts, cold))
+
+    for name, func in (('adc_to_C', lambda: convert.adc_to_C(counts)),
+                       ('C_to_adc', lambda: convert.C_to_adc(temps)),
+                       ('c_to_f', lambda: convert.c_to_f(temps)),
+                       ('cold junction + probe, F', pipeline)):
+        best = None
+        for _ in range(3):
+            t0 = time.time()
+            func()
+            t = time.time() - t0
+            if best is None or t < best:
+                best = t
+        print "%-26s %7.1f M samples/s" % (name, n / best / 1e6)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    n = int(argv[0]) if argv else 10000000
+
+    bad = check(reference())
+    bench(n)
+    return 1 if bad else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,124 @@
+# Copyright (C) 2014 Synapse Wireless, Inc.
+"""Check and time drivers/thermocouple.py against the original linear-walk adc_to_C.
+   Both run through rm150host.snappy, so they see the node's 16-bit integer semantics.
+   "lines" counts script lines executed per conversion, a rough stand-in for SNAPpy VM work.
+
+   Usage (from the root of this tree):
+     python -m rm150host.bench_thermocouple
+"""
+
+import sys
+import time
+
+from rm150host import snappy
+
+# adc_to_C as it was before the reverse index
+ORIGINAL_ADC_TO_C = '''
+def orig_adc_to_C(adc_count):
+    if adc_count >= MAX_ADC:
+        return MAX_TEMP*10
+    elif adc_count <= MIN_ADC:
+        return MIN_TEMP*10
+
+    start = ((adc_count - MIN_ADC) * 5) / 262
+    i = start
+    val = ktable(i)
+
+    if val == adc_count:
+        temp = ((i * 10) + MIN_TEMP)*10
+        return temp
+
+    while (i < start + 4 and val <= adc_count):
+        i += 1
+        prev = val
+        val = ktable(i)
+
+    low = (((i-1) * 10) + MIN_TEMP) * 10
+    inc = ((adc_count - prev) * 100) / (val - prev)
+    temp = low + inc
+    return temp
+'''
+
+
+def load():
+    ns = snappy.new_namespace()
+    snappy.load('thermocouple', ns)
+    exec snappy.compile_snappy(ORIGINAL_ADC_TO_C, '<original adc_to_C>') in ns
+    return ns
+
+
+def check(ns):
+    """Return the counts from MIN_ADC-1 to MAX_ADC+1 where the two disagree"""
+    new, orig = ns['adc_to_C'], ns['orig_adc_to_C']
+    return [(c, orig(c), new(c)) for c in range(ns['MIN_ADC'] - 1, ns['MAX_ADC'] + 2)
+            if new(c) != orig(c)]
+
+
+def check_cj(ns):
+    """Return (therm, cold) pairs where adc_cj_to_C disagrees with adc_to_C of the 16-bit sum"""
+    adc_to_C, adc_cj_to_C = ns['adc_to_C'], ns['adc_cj_to_C']
+    colds = [ns['C_to_adc'](t) for t in range(-1000, 11601, 250)]
+    bad = []
+    for cold in colds:
+        for therm in range(-32768, 32768, 7):
+            total = snappy.i16(therm + cold)
+            if total - (therm + cold):
+                continue  # the old sum overflowed; adc_cj_to_C goes to the rail instead
+            if adc_cj_to_C(therm, cold) != adc_to_C(total):
+                bad.append((therm, cold))
+    return bad
+
+
+def _lines(ns, func, counts):
+    executed = [0]
+
+    def tracer(frame, event, arg):
+        if frame.f_globals is not ns:
+            return None  # the 16-bit arithmetic helpers
+        if event == 'line':
+            executed[0] += 1
+        return tracer
+
+    sys.settrace(tracer)
+    try:
+        for c in counts:
+            func(c)
+    finally:
+        sys.settrace(None)
+    return float(executed[0]) / len(counts)
+
+
+def _secs(func, counts, repeat=5):
+    best = None
+    for _ in range(repeat):
+        t0 = time.time()
+        for c in counts:
+            func(c)
+        t = time.time() - t0
+        if best is None or t < best:
+            best = t
+    return best / len(counts)
+
+
+def main():
+    ns = load()
+    counts = range(ns['MIN_ADC'] + 1, ns['MAX_ADC'])
+
+    bad = check(ns)
+    print "adc_to_C: %d counts checked, %d differ" % (len(counts) + 4, len(bad))
+    for c, orig, new in bad[:20]:
+        print "  count %d: original %d, new %d" % (c, orig, new)
+
+    bad_cj = check_cj(ns)
+    print "adc_cj_to_C: %d mismatches against adc_to_C" % len(bad_cj)
+
+    for name in ('orig_adc_to_C', 'adc_to_C'):
+        func = ns[name]
+        print "%-14s %5.1f lines/call  %6.2f us/call (host)" % (
+            name, _lines(ns, func, counts), _secs(func, counts) * 1e6)
+
+    return 1 if bad or bad_cj else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
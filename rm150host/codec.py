@@ -0,0 +1,215 @@
+# Copyright (C) 2014 Synapse Wireless, Inc.
+"""Decoder for "rm150_rpt" reports, and the "rm150_duty" and "rm150_hist" answers to
+   duty_query() and hist_query().
+   Handles both the original six-argument form (seven with a sequence number, when the node
+   sets REPORT_ACKED) and the packed single-string form built on the node by
+   drivers/report_fmt.py.
+
+   Ex.
+     tracker = SeqTracker()  # rm150host/delivery.py
+
+     def rm150_rpt(*args):
+         report = decode_rpt(args, rpcSourceAddr())
+         # Acks the report, and lets the node tune its report TTL and signal icon
+         rpc(rpcSourceAddr(), 'gw_resp', 0, report.get('seq', 0))
+         if tracker.accept(report):
+             ...  # first copy of this report
+"""
+
+import struct
+
+from drivers.report_fmt import (RPT_VERSION, RPT_F_AMB, RPT_F_HUMID, RPT_F_EXT1, RPT_F_EXT2,
+                                RPT_F_DOOR1, RPT_F_DOOR2, RPT_F_BATCH, RPT_F_RAW, RPT_F_SEQ,
+                                RPT_F_DUTY, RPT_F_RESTART, RPT_HUMID_ERR)
+
+# Seconds per unit of a batch sample's dt (64 sym_ticks_4ms() ticks of 4.096ms)
+BATCH_DT_SECS = 64 * 4.096e-3
+
+# drivers/duty_acct.py slots, in order
+DUTY_NAMES = ('awake', 'asleep', 'adc', 'uart', 'radio_tx', 'radio_rx', 'buzzer')
+
+# drivers/latency_hist.py stages, in order, and the upper edge of each bucket in ms
+HIST_NAMES = ('hih61_start', 'adc_start', 'cj_wait', 'cj_read', 'tc_wait', 'tc_read',
+              'humid_read', 'reading')
+HIST_EDGES_MS = tuple(64 * 0.016 * 2 ** b for b in range(7)) + (None,)
+
+_I16 = struct.Struct('>h')
+_HDR = struct.Struct('>BHH')
+_DUTY = struct.Struct('>HHH')
+DUTY_HI_SECS = 16384 * 16e-6  # one unit of a duty slot's hi word
+DUTY_WRAP_SECS = 65536 * DUTY_HI_SECS
+
+
+class DecodeError(ValueError):
+    pass
+
+
+def decode_rpt(args, src_addr=None):
+    """Decode the argument tuple of an rm150_rpt call.
+       Returns a dict with 'addr', 'interval', 'seq' if the node numbers its reports, and
+       'samples', a list of dicts holding whichever of amb_temp, humid, ext1, ext2, door1,
+       door2 (and dt) were reported.
+       Raw reports (RPT_F_RAW in 'flags') hold cj1_raw, hih61_raw, ext1_raw, cj2_raw and
+       ext2_raw instead; see rm150host/raw.py to convert them.
+       With RPT_F_DUTY there is also 'duty', as decode_duty() returns it.
+    """
+    if len(args) == 1:
+        report = decode_packed(args[0])
+        report['addr'] = src_addr
+        return report
+
+    if len(args) not in (6, 7):
+        raise DecodeError("rm150_rpt takes 1, 6 or 7 arguments, got %d" % len(args))
+
+    addr, interval, amb_temp, humid, ext1, ext2 = args[:6]
+    sample = {'amb_temp': amb_temp, 'humid': humid, 'ext1': ext1, 'ext2': ext2}
+    report = {'addr': addr, 'version': 0, 'interval': interval, 'samples': [sample]}
+    if len(args) == 7:
+        report['seq'] = args[6] & 0xFF
+        report['restart'] = bool(args[6] & 0x100)
+    return report
+
+
+def decode_packed(payload):
+    """Decode a packed report string (see drivers/report_fmt.py)"""
+    data = bytearray(payload)
+    if len(data) < _HDR.size:
+        raise DecodeError("short report header")
+
+    version, flags, interval = _HDR.unpack_from(bytes(data), 0)
+    if version != RPT_VERSION:
+        raise DecodeError("unsupported report version %d" % version)
+
+    report = {'version': version, 'flags': flags, 'interval': interval}
+    pos = _HDR.size
+    if flags & RPT_F_SEQ:
+        report['seq'] = _byte(data, pos)
+        report['restart'] = bool(flags & RPT_F_RESTART)
+        pos += 1
+    count = 1
+    if flags & RPT_F_BATCH:
+        count = _byte(data, pos)
+        pos += 1
+
+    samples = []
+    for _ in range(count):
+        sample, pos = _decode_sample(data, pos, flags)
+        samples.append(sample)
+
+    if flags & RPT_F_DUTY:
+        report['duty'], pos = _decode_duty(data, pos)
+
+    if pos != len(data):
+        raise DecodeError("%d trailing bytes in report" % (len(data) - pos))
+
+    report['samples'] = samples
+    return report
+
+
+def decode_duty(totals):
+    """Decode the duty cycle totals string of an rm150_duty call (drivers/duty_acct.py).
+       Returns {slot name: (busy seconds, spans)}. Both wrap, seconds at DUTY_WRAP_SECS and
+       spans at 65536, so compare readings as differences modulo those.
+    """
+    duty, pos = _decode_duty(bytearray(totals), 0)
+    if pos != len(totals):
+        raise DecodeError("%d trailing bytes in duty totals" % (len(totals) - pos))
+    return duty
+
+
+def decode_hist(histograms):
+    """Decode the histograms string of an rm150_hist call (drivers/latency_hist.py).
+       Returns {stage name: [count per bucket]}; bucket i holds stages shorter than
+       HIST_EDGES_MS[i] (the last has no upper edge). Counts stop at 255.
+    """
+    data = bytearray(histograms)
+    if len(data) < 2:
+        raise DecodeError("short histograms")
+    stages, buckets = data[0], data[1]
+    if len(data) != 2 + stages * buckets:
+        raise DecodeError("histograms hold %d bytes, expected %d" % (len(data), 2 + stages * buckets))
+    hist = {}
+    for stage in range(stages):
+        name = HIST_NAMES[stage] if stage < len(HIST_NAMES) else 'stage%d' % stage
+        pos = 2 + stage * buckets
+        hist[name] = list(data[pos:pos + buckets])
+    return hist
+
+
+def _decode_duty(data, pos):
+    slots = _byte(data, pos)
+    pos += 1
+    if pos + slots * _DUTY.size > len(data):
+        raise DecodeError("duty totals truncated")
+    duty = {}
+    for slot in range(slots):
+        hi, lo, count = _DUTY.unpack_from(bytes(data), pos)
+        name = DUTY_NAMES[slot] if slot < len(DUTY_NAMES) else 'slot%d' % slot
+        duty[name] = (hi * DUTY_HI_SECS + lo * 16e-6, count)
+        pos += _DUTY.size
+    return duty, pos
+
+
+def _decode_sample(data, pos, flags):
+    sample = {}
+    if flags & RPT_F_BATCH:
+        sample['dt'] = _byte(data, pos) * BATCH_DT_SECS
+        pos += 1
+    if flags & RPT_F_RAW:
+        return _decode_raw_sample(data, pos, flags, sample)
+    if flags & RPT_F_AMB:
+        sample['amb_temp'] = _i16(data, pos)
+        pos += 2
+    if flags & RPT_F_HUMID:
+        humid = _byte(data, pos)
+        sample['humid'] = None if humid == RPT_HUMID_ERR else humid
+        pos += 1
+    if flags & RPT_F_EXT1:
+        sample['ext1'] = _i16(data, pos)
+        pos += 2
+    if flags & RPT_F_EXT2:
+        sample['ext2'] = _i16(data, pos)
+        pos += 2
+    return _decode_doors(data, pos, flags, sample)
+
+
+def _decode_raw_sample(data, pos, flags, sample):
+    if flags & RPT_F_AMB:
+        sample['cj1_raw'] = _i16(data, pos)
+        pos += 2
+    if flags & RPT_F_HUMID:
+        if pos + 4 > len(data):
+            raise DecodeError("report truncated")
+        sample['hih61_raw'] = bytes(data[pos:pos + 4])
+        pos += 4
+    if flags & RPT_F_EXT1:
+        sample['ext1_raw'] = _i16(data, pos)
+        pos += 2
+    if flags & RPT_F_EXT2:
+        sample['cj2_raw'] = _i16(data, pos)
+        sample['ext2_raw'] = _i16(data, pos + 2)
+        pos += 4
+    return _decode_doors(data, pos, flags, sample)
+
+
+def _decode_doors(data, pos, flags, sample):
+    if flags & (RPT_F_DOOR1 | RPT_F_DOOR2):
+        doors = _byte(data, pos)
+        if flags & RPT_F_DOOR1:
+            sample['door1'] = bool(doors & 1)
+        if flags & RPT_F_DOOR2:
+            sample['door2'] = bool(doors & 2)
+        pos += 1
+    return sample, pos
+
+
+def _byte(data, pos):
+    if pos >= len(data):
+        raise DecodeError("report truncated")
+    return data[pos]
+
+
+def _i16(data, pos):
+    if pos + 2 > len(data):
+        raise DecodeError("report truncated")
+    return _I16.unpack_from(bytes(data[pos:pos + 2]))[0]
@@ -0,0 +1,102 @@
+# Copyright (C) 2014 Synapse Wireless, Inc.
+"""NumPy versions of the node's conversions, for converting many readings at once.
+   Each function takes and returns integer arrays (anything np.asarray accepts) and gives the
+   same result, element by element, as the SNAPpy function it is named after: the node's
+   16-bit ints, and division truncating toward zero.
+
+   rm150host/bench_convert.py checks them against the drivers run by rm150host.snappy.
+
+   Ex.
+     temps = adc_cj_to_C(therm_counts, C_to_adc(ads_conv_internal_temp_C(cj_counts)))
+"""
+
+import numpy as np
+
+from drivers.thermocouple import k_table, k_index, K_INDEX_SHIFT, MIN_TEMP, MAX_TEMP
+
+# k_table as signed counts; the drivers' MIN_ADC/MAX_ADC are only right under SNAPpy
+K_TABLE = np.frombuffer(k_table, dtype='>i2').astype(np.int32)
+K_INDEX = np.frombuffer(k_index, dtype=np.uint8).astype(np.intp)
+MIN_ADC = int(K_TABLE[0])
+MAX_ADC = int(K_TABLE[-1])
+
+
+def i16(a):
+    """Wrap to 16-bit signed, as SNAPpy arithmetic does"""
+    return ((np.asarray(a, dtype=np.int32) + 0x8000) & 0xFFFF) - 0x8000
+
+
+def tdiv(a, b):
+    """Integer division truncating toward zero"""
+    q = np.abs(a) // np.abs(b)
+    return np.where((np.asarray(a) < 0) != (np.asarray(b) < 0), -q, q)
+
+
+def ads_conv_internal_temp_C(a2d_value):
+    """ADS1118 internal temp sensor reading to tenths C"""
+    a2d_value = np.asarray(a2d_value, dtype=np.int32)
+    return tdiv(i16((a2d_value >> 2) * 10), 32)
+
+
+def C_to_adc(temp):
+    """Tenths C to K-type ADC count"""
+    temp = np.asarray(temp, dtype=np.int32)
+    inside = np.clip(temp, MIN_TEMP * 10, MAX_TEMP * 10 - 1)
+    i = (inside - MIN_TEMP * 10) // 100
+    low = K_TABLE[i]
+    high = K_TABLE[i + 1]
+    # SNAPpy's % truncates; the node corrects negative results, which is what // and % do here
+    adc = low + ((high - low) * (inside % 100)) // 100
+    return np.where(temp >= MAX_TEMP * 10, MAX_ADC, np.where(temp <= MIN_TEMP * 10, MIN_ADC, adc))
+
+
+def adc_to_C(adc_count):
+    """K-type ADC count to tenths C"""
+    adc_count = np.asarray(adc_count, dtype=np.int32)
+    inside = np.clip(adc_count, MIN_ADC + 1, MAX_ADC - 1)
+    i = K_INDEX[(inside - MIN_ADC) >> K_INDEX_SHIFT]
+    i += inside >= K_TABLE[i + 1]
+    low = K_TABLE[i]
+    high = K_TABLE[i + 1]
+    temp = i * 100 + MIN_TEMP * 10 + ((inside - low) * 100) // (high - low)
+    return np.where(adc_count >= MAX_ADC, MAX_TEMP * 10,
+                    np.where(adc_count <= MIN_ADC, MIN_TEMP * 10, temp))
+
+
+def adc_cj_to_C(therm_count, cold_count):
+    """Thermocouple count plus its cold junction count to tenths C"""
+    therm_count = np.asarray(therm_count, dtype=np.int32)
+    temp = adc_to_C(therm_count + np.asarray(cold_count, dtype=np.int32))
+    return np.where(therm_count >= MAX_ADC - MIN_ADC, MAX_TEMP * 10,
+                    np.where(therm_count <= MIN_ADC - MAX_ADC, MIN_TEMP * 10, temp))
+
+
+def c_to_f(temp):
+    """Tenths C to tenths F, as temp_meas.c_to_f(): its native code scales the magnitude by
+       9/5 with shifts and adds, truncating, then 32F is added
+    """
+    temp = np.asarray(temp, dtype=np.int32)
+    y = np.abs(temp) * 9
+    z = (y + (y >> 1)) >> 1
+    u = z + (z >> 4)
+    v = u + (u >> 8)
+    r = (v >> 2) & 0xFFFF
+    return i16(i16(np.where(temp < 0, -r, r)) + 320)
+
+
+def HIH61_humid(raw, offset=0):
+    """%RH from an (n, 4) array of HIH61 bytes, as HIH61_get_humid()"""
+    raw = np.asarray(raw, dtype=np.int32).reshape(-1, 4)
+    return tdiv(i16((raw[:, 0] << 8) + raw[:, 1]), 164) + offset
+
+
+def HIH61_temp(raw):
+    """Whole C from an (n, 4) array of HIH61 bytes, as HIH61_get_temp()"""
+    raw = np.asarray(raw, dtype=np.int32).reshape(-1, 4)
+    return tdiv(i16((raw[:, 2] << 6) + (raw[:, 3] >> 2)), 99) - 40
+
+
+def HIH61_valid(raw):
+    """Which rows of an (n, 4) array of HIH61 bytes are good readings (status bits 0)"""
+    raw = np.asarray(raw, dtype=np.int32).reshape(-1, 4)
+    return (raw[:, 0] >> 6) == 0
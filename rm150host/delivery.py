@@ -0,0 +1,95 @@
+# Copyright (C) 2014 Synapse Wireless, Inc.
+"""Duplicate suppression and delivery accounting for numbered reports (RPT_F_SEQ).
+   A node with REPORT_ACKED retransmits a report until the gateway's gw_resp() ack gets
+   through, so the gateway can see the same report more than once; SeqTracker passes only
+   the first copy.
+   Sequence numbers also show the reports that never arrived, which gives the delivery rate.
+   A node counts from 0 at boot and marks its reports 'restart' until one is acked; the first
+   marked report starts the count for that node afresh, so a reboot isn't counted as losses.
+
+   Ex.
+     tracker = SeqTracker()
+     if tracker.accept(report):
+         store(report)
+     tracker.stats(report['addr'])['delivery_rate']
+"""
+
+SEQ_MOD = 256
+
+
+class SeqTracker(object):
+    def __init__(self, window=32):
+        """window: how far back (in reports) a late or repeated report is still recognized.
+           Anything older is taken as the node having restarted its count without saying so.
+        """
+        self.window = window
+        self._nodes = {}
+
+    def accept(self, report):
+        """True for the first copy of a report (or one without a 'seq'), False for a repeat"""
+        seq = report.get('seq')
+        if seq is None:
+            return True
+        return self.accept_seq(report['addr'], seq, report.get('restart', False))
+
+    def accept_seq(self, addr, seq, restart=False):
+        node = self._nodes.get(addr)
+        if node is None:
+            self._nodes[addr] = _Node(seq)
+            node = self._nodes[addr]
+        elif restart and not node.restarted:
+            # First report heard since the node booted; retransmissions of it, and the marked
+            # reports after it, are then handled as usual
+            node.restart(seq)
+        elif not self._accept(node, seq):
+            return False
+        node.restarted = restart
+        return True
+
+    def _accept(self, node, seq):
+        ahead = (seq - node.last) % SEQ_MOD
+        if 0 < ahead < SEQ_MOD // 2:
+            node.lost += ahead - 1
+            node.missing.update((node.last + i) % SEQ_MOD for i in range(1, ahead))
+            node.last = seq
+            node.received += 1
+            node.trim(self.window)
+            return True
+
+        if seq in node.missing:
+            # Late, not lost after all
+            node.missing.discard(seq)
+            node.lost -= 1
+            node.received += 1
+            return True
+        if (node.last - seq) % SEQ_MOD < self.window:
+            node.duplicates += 1
+            return False
+
+        node.restart(seq)
+        return True
+
+    def stats(self, addr):
+        """received, duplicates, lost and delivery_rate (None before the first report)"""
+        node = self._nodes.get(addr)
+        if node is None:
+            return {'received': 0, 'duplicates': 0, 'lost': 0, 'delivery_rate': None}
+        return {'received': node.received, 'duplicates': node.duplicates, 'lost': node.lost,
+                'delivery_rate': float(node.received) / (node.received + node.lost)}
+
+
+class _Node(object):
+    def __init__(self, seq):
+        self.received = 0
+        self.duplicates = 0
+        self.lost = 0
+        self.restarted = False  # last report accepted was marked restart
+        self.restart(seq)
+
+    def restart(self, seq):
+        self.last = seq
+        self.missing = set()
+        self.received += 1
+
+    def trim(self, window):
+        self.missing = set(s for s in self.missing if (self.last - s) % SEQ_MOD < window)
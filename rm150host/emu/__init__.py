@@ -0,0 +1,18 @@
+# Copyright (C) 2014 Synapse Wireless, Inc.
+"""Host-side emulator for the RM150: runs the unmodified rm150.py and drivers/ under CPython
+   on modelled hardware (UART0, ADS1118s, AT45DB, HIH61, BATMON, symbol counter, buzzer) and
+   radio, with a virtual clock, so hours of node time take seconds. Counts awake time, bytes
+   on the air and on UART0, and charge drawn per part, for comparing firmware changes before
+   they go out to nodes.
+
+   Ex.
+     node = Node(overrides={'REPORT_PACKED': True}, gateway=Gateway(hops=2))
+     node.run(3600)
+     node.summary()['uc_per_report']
+
+   Or from the root of this tree:
+     python -m rm150host.emu --hours 24 --set REPORT_PACKED=True
+"""
+
+from rm150host.emu.node import Node
+from rm150host.emu.radio import Gateway
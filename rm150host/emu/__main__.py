@@ -0,0 +1,90 @@
+# Copyright (C) 2014 Synapse Wireless, Inc.
+"""Run rm150.py on the emulator and print what it cost.
+
+   Usage (from the root of this tree):
+     python -m rm150host.emu --hours 24
+     python -m rm150host.emu --hours 24 --set REPORT_PACKED=True --set REPORT_BATCH_SIZE=6
+     python -m rm150host.emu --hours 1 --hops 3 --loss 0.2 --set GW_LISTEN_MS=100
+"""
+
+import ast
+import optparse
+import sys
+import time
+
+from rm150host.emu import Gateway, Node
+
+
+def _override(option, opt, value, parser):
+    name, sep, text = value.partition('=')
+    if not sep:
+        raise optparse.OptionValueError("%s takes NAME=VALUE" % opt)
+    try:
+        parser.values.overrides[name] = ast.literal_eval(text)
+    except (ValueError, SyntaxError):
+        parser.values.overrides[name] = text
+
+
+def report(node, wall):
+    s = node.summary()
+    secs = s['seconds']
+    print "%.1f h of node time in %.1f s" % (secs / 3600, wall)
+    print "awake        %9.1f s  %6.3f%%" % (s['awake_s'], 100 * s['awake_s'] / secs)
+    print "receiver on  %9.1f s  %6.3f%%" % (s['rx_s'], 100 * s['rx_s'] / secs)
+    print "reports      %9d" % s['reports']
+    print "radio tx     %9d packets, %d bytes (%.1f per report), multicast TTL total %d" % (
+        s['tx_packets'], s['tx_bytes'], float(s['tx_bytes']) / max(1, s['reports']), s['mcast_ttl'])
+    print "radio rx     %9d packets, %d lost while not listening" % (s['rx_packets'], s['rx_lost'])
+    print "UART0        %9d bytes" % s['uart0_bytes']
+    print "ADC          %9d conversions, %d flash page programs" % (
+        s['adc_conversions'], s['flash_programs'])
+    print "charge       %9.1f mC, %.1f uA average" % (s['charge_uc'] / 1000, s['avg_ua'])
+    if s['uc_per_report']:
+        print "per report   %9.1f uC" % s['uc_per_report']
+    for part, uc in sorted(s['charge_by_part_uc'].items(), key=lambda item: -item[1]):
+        print "  %-11s %9.1f mC  %5.1f%%" % (part, uc / 1000, 100 * uc / s['charge_uc'])
+    if 'gateway' in s:
+        g = s['gateway']
+        rate = g['delivery_rate']
+        print "gateway      %9d received, %d duplicates, %s lost, delivery %s" % (
+            g['received'], g['duplicates'], '-' if g['lost'] is None else g['lost'],
+            '-' if rate is None else '%.1f%%' % (100 * rate))
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage="python -m rm150host.emu [options]")
+    parser.add_option('--hours', type='float', default=1.0)
+    parser.add_option('--set', action='callback', callback=_override, type='string',
+                      metavar='NAME=VALUE', help="change a setting in rm150.py or drivers/")
+    parser.add_option('--hops', type='int', default=1, help="gateway distance")
+    parser.add_option('--loss', type='float', default=0.0, help="packet loss each way")
+    parser.add_option('--tell-hops', action='store_true', help="gateway passes hops to gw_resp")
+    parser.add_option('--no-gateway', action='store_true')
+    parser.add_option('--ambient', type='float', default=25.0, help="cold junction C")
+    parser.add_option('--probe1', type='float', default=20.0, help="probe 1 C")
+    parser.add_option('--probe2', type='float', default=20.0, help="probe 2 C")
+    parser.add_option('--battery', type='int', default=3000, help="mV")
+    parser.add_option('--seed', type='int', default=1)
+    parser.set_defaults(overrides={})
+    opts, args = parser.parse_args(argv)
+
+    gateway = None
+    if not opts.no_gateway:
+        gateway = Gateway(hops=opts.hops, loss=opts.loss, tell_hops=opts.tell_hops, seed=opts.seed)
+    node = Node(overrides=opts.overrides, gateway=gateway, seed=opts.seed)
+    for ads in (node.ads1, node.ads2):
+        ads.internal_c = opts.ambient
+    node.ads1.probe_c = opts.probe1
+    node.ads2.probe_c = opts.probe2
+    node.batmon.mv = opts.battery
+
+    t0 = time.time()
+    node.run(opts.hours * 3600)
+    wall = time.time() - t0
+    node.close()
+    report(node, wall)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
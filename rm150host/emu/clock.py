@@ -0,0 +1,65 @@
+# Copyright (C) 2014 Synapse Wireless, Inc.
+"""Virtual time for the emulator: a microsecond clock and a queue of timed events.
+   Nothing here looks at the host's clock, so a run gives the same result every time.
+"""
+
+import heapq
+
+
+class StopRun(Exception):
+    """Raised out of the script when a run is abandoned part way (Node.close())"""
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0  # us
+        self._events = []
+        self._seq = 0
+        self.limit = None  # advance() calls on_limit() on reaching this
+        self.on_limit = None
+        self.wake = False  # set during on_limit() to end the advance() there (a sleep woken early)
+
+    def advance(self, us):
+        """Move time forward by us, stopping at the limit (if one is set) on the way"""
+        end = self.now + int(us)
+        while self.limit is not None and end >= self.limit > self.now:
+            self.now = self.limit
+            self.on_limit()
+            if self.wake:
+                return
+        if end > self.now:
+            self.now = end
+
+    def advance_to(self, t):
+        if t > self.now:
+            self.advance(t - self.now)
+
+    def at(self, t, kind, func, *args):
+        """Queue func(*args) for time t (us). kind lets a caller find or drop events by type."""
+        self._seq += 1
+        heapq.heappush(self._events, (int(t), self._seq, kind, func, args))
+
+    def after(self, us, kind, func, *args):
+        self.at(self.now + us, kind, func, *args)
+
+    def next_time(self):
+        """Time of the first queued event, or None"""
+        if self._events:
+            return self._events[0][0]
+        return None
+
+    def pop_due(self):
+        """Remove and return (kind, func, args) of the first event due by now, or None"""
+        if self._events and self._events[0][0] <= self.now:
+            t, seq, kind, func, args = heapq.heappop(self._events)
+            return kind, func, args
+        return None
+
+    def drop(self, kind, start, end):
+        """Remove the events of one kind queued for start <= t < end; returns how many"""
+        kept = [e for e in self._events if not (e[2] == kind and start <= e[0] < end)]
+        dropped = len(self._events) - len(kept)
+        if dropped:
+            heapq.heapify(kept)
+            self._events = kept
+        return dropped
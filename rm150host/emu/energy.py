@@ -0,0 +1,76 @@
+# Copyright (C) 2014 Synapse Wireless, Inc.
+"""Energy accounting for the emulator.
+   Each part of the node draws a current that depends on its state, looked up by the kind of
+   part it is (two ADS1118s are two parts of one kind). A part is either tracked
+   by state (set_state(), for things that stay on or off for a while, like the radio
+   receiver) or charged per event (pulse(), for things with a known duration, like an ADC
+   conversion). Charge is kept in nA*us per part, so summing parts is exact.
+
+   The currents are typical datasheet figures at 3V, a starting point only: replace them
+   with measurements from a real board to get numbers worth planning a battery around.
+"""
+
+# mA by kind of part and state
+CURRENT_MA = {
+    'mcu': {'active': 4.1, 'sleep': 0.0007},  # ATmega128RFA1 at 16MHz; sleep with the 32kHz RTC
+    'radio': {'off': 0.0, 'rx': 12.5, 'tx': 14.5},  # ATmega128RFA1 transceiver, 3dBm
+    'ads1118': {'idle': 0.0005, 'converting': 0.15},  # per chip; single shot, power-down between
+    'at45db': {'udeep': 0.0004, 'standby': 0.025, 'program': 12.0},
+    'hih61': {'idle': 0.001, 'measuring': 0.65},
+    'uart0': {'idle': 0.0, 'tx': 0.2},  # line driver and XMEGA receive, over the MCU
+    'buzzer': {'off': 0.0, 'on': 15.0},
+}
+
+
+class EnergyMeter(object):
+    def __init__(self, clock, currents=None):
+        self.clock = clock
+        self.currents = currents or CURRENT_MA
+        self.kinds = {}
+        self.charge = {}  # nA*us
+        self.state = {}
+        self._since = {}
+        self.time_in = {}  # (part, state) -> us
+
+    def add_part(self, part, kind, state):
+        """Start tracking part, a kind from currents, in state"""
+        self.kinds[part] = kind
+        self.charge[part] = 0
+        self.set_state(part, state)
+
+    def set_state(self, part, state):
+        """part is in state from now on"""
+        self._settle(part)
+        self.state[part] = state
+
+    def pulse(self, part, state, us):
+        """part is in state for us, on top of whatever it is tracked as"""
+        self.charge[part] += self._na(part, state) * int(us)
+        key = (part, state)
+        self.time_in[key] = self.time_in.get(key, 0) + int(us)
+
+    def _na(self, part, state):
+        return int(round(self.currents[self.kinds[part]][state] * 1e6))
+
+    def _settle(self, part):
+        now = self.clock.now
+        if part in self.state:
+            us = now - self._since[part]
+            self.charge[part] += self._na(part, self.state[part]) * us
+            key = (part, self.state[part])
+            self.time_in[key] = self.time_in.get(key, 0) + us
+        self._since[part] = now
+
+    def settle(self):
+        """Bring every tracked part up to now; call before reading charge or time_in"""
+        for part in list(self.state):
+            self._settle(part)
+
+    def total_uc(self):
+        """Charge drawn so far by the whole node, in uC (uA*s)"""
+        self.settle()
+        return sum(self.charge.values()) / 1e9
+
+    def by_part_uc(self):
+        self.settle()
+        return dict((part, c / 1e9) for part, c in self.charge.items())
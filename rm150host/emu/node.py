@@ -0,0 +1,477 @@
+# Copyright (C) 2014 Synapse Wireless, Inc.
+"""One emulated RM150: the scripts (rm150.py and drivers/, through rm150host.snappy) on the
+   SNAPpy built-ins, hooks and hardware modelled in this package, in virtual time.
+
+   Like the SNAPpy VM, the node runs one hook at a time. Between hooks it is awake and idle,
+   with HOOK_10MS (or HOOK_1MS) and HOOK_1S firing on the awake time; inside a hook, time
+   only moves on through what the script does (sleep(), waiting on the hardware) and its own
+   execution, charged per script function call and per built-in call (each script function
+   is wrapped to count its calls). Hooks that are due
+   while one is running (HOOK_STDOUT, HOOK_RPC_SENT, incoming RPCs) wait for it to return.
+   While asleep the radio is off, so packets sent to the node then are lost.
+
+   The scripts run on a thread of their own so that run() can stop anywhere, even inside a
+   hook that never returns (rm150.py's scheduler sleeps inside one), and carry on from there
+   next time. Only one of the two threads runs at a time.
+"""
+
+import atexit
+import os
+import random
+import sys
+import threading
+import types
+
+from rm150host import snappy
+from rm150host.emu import peripherals, radio
+from rm150host.emu.clock import Clock, StopRun
+from rm150host.emu.energy import EnergyMeter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+HOOKS = ('HOOK_STARTUP', 'HOOK_GPIN', 'HOOK_1MS', 'HOOK_10MS', 'HOOK_100MS', 'HOOK_1S',
+         'HOOK_STDIN', 'HOOK_STDOUT', 'HOOK_RPC_SENT')
+DATA_SOURCES = ('DS_NULL', 'DS_UART0', 'DS_UART1', 'DS_UART2', 'DS_USB', 'DS_STDIO',
+                'DS_ERROR', 'DS_PACKET_SERIAL', 'DS_TRANSPARENT')
+
+# Rough SNAPpy VM costs on the ATmega128RFA1; tune against a scope trace of a real node
+CALL_US = 150  # one script function call, with the lines it runs
+BUILTIN_US = 40  # one built-in call
+HOOK_US = 300  # dispatching a hook
+
+
+class _Stdout(object):
+    """sys.stdout while the scripts run: print goes to UART0"""
+
+    def __init__(self, node):
+        self.node = node
+
+    softspace = property(lambda self: 0, lambda self, value: None)  # no spaces between prints
+
+    def write(self, data):
+        self.node._stdout(data)
+
+
+class Node(object):
+    def __init__(self, script=None, overrides=None, gateway=None, currents=None, addr='\x5e\x00\x01',
+                 seed=1, record_uart=False):
+        """script: the main script, rm150.py by default. overrides: script settings to change
+           (see rm150host.snappy.compile_snappy()), e.g. {'REPORT_PACKED': True}.
+           gateway: a radio.Gateway, or None for no one to hear the node.
+        """
+        self.script = script or os.path.join(ROOT, 'rm150.py')
+        self.gateway = gateway
+        self.addr = addr
+        self.rng = random.Random(seed)
+
+        self.clock = Clock()
+        self.clock.on_limit = self._pause
+        self.meter = EnergyMeter(self.clock, currents)
+        self.meter.add_part('mcu', 'mcu', 'active')
+        self.meter.add_part('radio', 'radio', 'rx')
+        self.meter.add_part('uart0', 'uart0', 'idle')
+        self.meter.add_part('buzzer', 'buzzer', 'off')
+        self.meter.add_part('ads1118_1', 'ads1118', 'idle')
+        self.meter.add_part('ads1118_2', 'ads1118', 'idle')
+        self.meter.add_part('at45db', 'at45db', 'standby')
+        self.meter.add_part('hih61', 'hih61', 'idle')
+
+        self.symctr = peripherals.SymbolCounter(self.clock)
+        self.batmon = peripherals.Batmon()
+        self.uart0 = peripherals.Uart0(self, record_uart)
+        self.buzzer = peripherals.Buzzer(self)
+        self.ads1 = peripherals.Ads1118(self, 'ads1118_1', probe_c=20.0)
+        self.ads2 = peripherals.Ads1118(self, 'ads1118_2', probe_c=20.0)
+        self.flash = peripherals.At45db(self, 'at45db')
+        self.hih61 = peripherals.Hih61(self, 'hih61')
+        self._regs = {}
+        for dev in (self.symctr, self.uart0, self.buzzer):
+            for reg in dev.REGS:
+                self._regs[reg] = dev
+        self._regs[peripherals.Batmon.REG] = self.batmon
+
+        self.pins = {}
+        self.inputs = {}  # levels readPin() sees on inputs, see set_input()
+        self.monitored = set()
+        self.wake_pins = {}
+        self.rx_on = True
+        self.asleep = False
+        self.hooks = {}
+        self.rpc_source = None
+        self.lq = 127
+        self.last_ref = 0
+
+        self.cpu_us = 0
+        self.ticks = 0
+        self.next_tick = 0
+        self.stats = {'hooks': 0, 'sleeps': 0, 'tx_packets': 0, 'tx_bytes': 0, 'mcast_ttl': 0,
+                      'rx_packets': 0, 'rx_lost': 0, 'rpcs': {}}
+
+        self.ns = snappy.new_namespace(self._builtins(), overrides)
+        snappy.load('rm150', self.ns, self.script)
+        for name, value in self.ns.items():
+            if isinstance(value, types.FunctionType) and value.func_globals is self.ns:
+                self.ns[name] = self._timed(value)
+
+        self._thread = None
+        self._resume = threading.Semaphore(0)
+        self._paused = threading.Semaphore(0)
+        self._closing = False
+        self._error = None
+        self._host_stdout = None
+        atexit.register(self.close)
+
+    # Running
+
+    def run(self, seconds):
+        """Run the node for seconds of virtual time"""
+        if self._error:
+            raise self._error[0], self._error[1], self._error[2]
+        self.clock.limit = self.clock.now + int(seconds * 1e6)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._vm, name='snappy-vm')
+            self._thread.daemon = True
+            self._thread.start()
+        else:
+            self._resume.release()
+        self._paused.acquire()
+        if self._error:
+            raise self._error[0], self._error[1], self._error[2]
+
+    def close(self):
+        """Abandon the scripts wherever they are"""
+        if self._thread is not None and self._thread.is_alive():
+            self._closing = True
+            self._resume.release()
+            self._thread.join()
+
+    def _vm(self):
+        self._enter()
+        try:
+            self._main_loop()
+        except StopRun:
+            pass
+        except Exception:
+            self._error = sys.exc_info()
+        finally:
+            self._leave()
+            self._paused.release()
+
+    def _enter(self):
+        self._host_stdout = sys.stdout
+        sys.stdout = _Stdout(self)
+
+    def _leave(self):
+        sys.stdout = self._host_stdout
+
+    def _pause(self):
+        """Clock limit reached: hand back to run()'s caller until the next run()"""
+        self._leave()
+        self._paused.release()
+        self._resume.acquire()
+        if self._closing:
+            raise StopRun()
+        self._enter()
+
+    def _timed(self, func):
+        def script_function(*args):
+            self.cpu_us += CALL_US
+            return func(*args)
+        script_function.__name__ = func.__name__
+        return script_function
+
+    def _sync(self, extra_us=0):
+        """Let the time the scripts have spent executing pass"""
+        us = self.cpu_us + extra_us
+        self.cpu_us = 0
+        if us:
+            self.clock.advance(us)
+
+    def _main_loop(self):
+        self._hook('HOOK_STARTUP')
+        while True:
+            event = self.clock.pop_due()
+            if event is not None:
+                kind, func, args = event
+                func(*args)
+                continue
+
+            tick_us = 1000 if 'HOOK_1MS' in self.hooks else 10000
+            if self.next_tick <= self.clock.now:
+                self.next_tick = self.clock.now + tick_us
+            t = self.next_tick
+            next_event = self.clock.next_time()
+            if next_event is not None and next_event < t:
+                t = next_event
+            self.clock.advance_to(t)
+
+            if self.clock.now >= self.next_tick:
+                self.next_tick += tick_us
+                self.ticks += 1
+                if tick_us == 1000:
+                    self._hook('HOOK_1MS', self.ticks)
+                if self.ticks % (10000 // tick_us) == 0:
+                    self._hook('HOOK_10MS', self.ticks)
+                if self.ticks % (1000000 // tick_us) == 0:
+                    self._hook('HOOK_1S', self.ticks)
+
+    def _hook(self, name, *args):
+        func = self.hooks.get(name)
+        if func is None:
+            return
+        self.stats['hooks'] += 1
+        self.cpu_us += HOOK_US
+        func(*args)
+        self._sync()
+
+    # Outside world
+
+    def receive(self, delay_us, src, lq, name, *args):
+        """A packet for the node arrives delay_us from now: an RPC of name(*args) from src"""
+        self.clock.after(delay_us, 'packet', self._deliver, src, lq, name, args)
+
+    def _deliver(self, src, lq, name, args):
+        if not self.rx_on:
+            self.stats['rx_lost'] += 1
+            return
+        self.stats['rx_packets'] += 1
+        func = self.ns.get(name)
+        if func is None:
+            return
+        self.lq = lq
+        self.rpc_source = src
+        self.cpu_us += HOOK_US
+        try:
+            func(*args)
+        finally:
+            self.rpc_source = None
+        self._sync()
+
+    def set_input(self, pin, level):
+        """Drive an input pin; HOOK_GPIN fires if the script monitors it, and a sleep ends
+           if wakeupOn() is waiting for this level
+        """
+        if self.inputs.get(pin, False) != level:
+            self.inputs[pin] = level
+            if self.asleep and self.wake_pins.get(pin) == level:
+                self.clock.wake = True
+            if pin in self.monitored:
+                self.clock.after(0, 'gpin', self._hook, 'HOOK_GPIN', pin, level)
+
+    # Built-ins
+
+    def _builtins(self):
+        b = {}
+        for name in HOOKS + DATA_SOURCES:
+            b[name] = name
+        for name in ('setHook', 'peek', 'poke', 'sleep', 'wakeupOn', 'readPin', 'writePin',
+                     'setPinDir', 'pulsePin', 'monitorPin', 'spiXfer', 'i2cWrite', 'i2cRead',
+                     'getI2cResult', 'mcastRpc', 'rpc', 'rx', 'getInfo', 'getLq', 'localAddr',
+                     'rpcSourceAddr', 'random', 'dumpHex'):
+            b[name] = self._counted(getattr(self, '_b_' + name))
+        for name in ('crossConnect', 'uniConnect', 'initUart', 'flowControl', 'stdinMode',
+                     'i2cInit', 'spiInit', 'saveNvParam', 'setPinPullup'):
+            b[name] = self._counted(lambda *args: None)
+        b['loadNvParam'] = lambda id: None
+        return b
+
+    def _counted(self, func):
+        def builtin(*args):
+            self.cpu_us += BUILTIN_US
+            return func(*args)
+        return builtin
+
+    def _b_setHook(self, name):
+        def register(func):
+            self.hooks[name] = func
+            return func
+        return register
+
+    def _b_peek(self, addr):
+        dev = self._regs.get(addr)
+        if dev is not None:
+            self._sync()
+            return dev.peek(addr)
+        return 0
+
+    def _b_poke(self, addr, value):
+        dev = self._regs.get(addr)
+        if dev is not None:
+            self._sync()
+            dev.poke(addr, value)
+
+    def _b_sleep(self, mode, duration):
+        """duration: seconds, or ms if negative. Ends early on a wakeupOn() pin."""
+        self._sync()
+        us = -duration * 1000 if duration < 0 else duration * 1000000
+        start = self.clock.now
+        end = start + us
+        if self.ns.get('SPI_MISO') in self.wake_pins:
+            for ads in self._selected_ads():
+                done = ads.conversion_end()
+                if done is not None and done < end:
+                    end = done
+
+        self.stats['sleeps'] += 1
+        self.asleep = True
+        self.meter.set_state('mcu', 'sleep')
+        self.meter.set_state('radio', 'off')
+        self.clock.advance_to(end)
+        self.clock.wake = False
+        end = self.clock.now
+        self.meter.set_state('mcu', 'active')
+        self.meter.set_state('radio', 'rx' if self.rx_on else 'off')
+        self.asleep = False
+        self.stats['rx_lost'] += self.clock.drop('packet', start, end)
+
+    def _b_wakeupOn(self, pin, enable, polarity):
+        if enable:
+            self.wake_pins[pin] = polarity
+        else:
+            self.wake_pins.pop(pin, None)
+
+    def _selected_ads(self):
+        chips = []
+        if self.pins.get(self.ns.get('ADS1118_CS1')) is False:
+            chips.append(self.ads1)
+        if self.pins.get(self.ns.get('ADS1118_CS2')) is False:
+            chips.append(self.ads2)
+        return chips
+
+    def _b_readPin(self, pin):
+        if pin == self.ns.get('SPI_MISO'):
+            self._sync()
+            for ads in self._selected_ads():
+                if ads.drdy_low():
+                    return False
+            return True
+        return self.inputs.get(pin, False)
+
+    def _b_writePin(self, pin, level):
+        self.pins[pin] = bool(level)
+
+    def _b_setPinDir(self, pin, output):
+        pass
+
+    def _b_pulsePin(self, pin, width, polarity):
+        pass
+
+    def _b_monitorPin(self, pin, enable):
+        if enable:
+            self.monitored.add(pin)
+        else:
+            self.monitored.discard(pin)
+
+    def _b_spiXfer(self, data):
+        self._sync(len(data) * peripherals.SPI_BYTE_US)
+        if self.pins.get(self.ns.get('FLASH_CS')) is False:
+            return self.flash.xfer(data)
+        chips = self._selected_ads()
+        if chips:
+            return chips[0].xfer(data)
+        return '\xff' * len(data)
+
+    def _b_i2cWrite(self, data, retries, ignore_first_ack):
+        self._sync(len(data) * 90)  # 100kHz
+        self.hih61.write(data)
+        return len(data) if self.hih61.result == 1 else 0
+
+    def _b_i2cRead(self, data, count, retries, ignore_first_ack):
+        self._sync((len(data) + count) * 90)
+        return self.hih61.read(data, count)
+
+    def _b_getI2cResult(self):
+        return self.hih61.result
+
+    def _send(self, name, args, ttl, dst):
+        self._sync()
+        nbytes = radio.packet_bytes(name, args)
+        us = radio.tx_us(nbytes, dst is not None, self.rng)
+        self.stats['tx_packets'] += 1
+        self.stats['tx_bytes'] += nbytes
+        self.stats['rpcs'][name] = self.stats['rpcs'].get(name, 0) + 1
+        if ttl is not None:
+            self.stats['mcast_ttl'] += ttl
+        self.meter.pulse('radio', 'tx', nbytes * radio.BYTE_US)
+
+        self.last_ref = (self.last_ref + 1) & 0x7FFF
+        ref = self.last_ref
+        self.clock.after(us, 'sent', self._sent, ref, name, args, ttl, dst)
+        return True
+
+    def _sent(self, ref, name, args, ttl, dst):
+        if self.gateway is not None and (dst is None or dst == self.gateway.addr):
+            self.gateway.receive(self, name, args, ttl)
+        self._hook('HOOK_RPC_SENT', ref)
+
+    def _b_mcastRpc(self, group, ttl, name, *args):
+        return self._send(name, args, ttl, None)
+
+    def _b_rpc(self, addr, name, *args):
+        return self._send(name, args, None, addr)
+
+    def _b_rx(self, on):
+        self.rx_on = bool(on)
+        self.meter.set_state('radio', 'rx' if self.rx_on else 'off')
+
+    def _b_getInfo(self, which):
+        if which == 9:
+            return self.last_ref
+        return 0
+
+    def _b_getLq(self):
+        return self.lq
+
+    def _b_localAddr(self):
+        return self.addr
+
+    def _b_rpcSourceAddr(self):
+        return self.rpc_source
+
+    def _b_random(self):
+        return self.rng.randint(0, 4095)
+
+    def _b_dumpHex(self, data):
+        self._stdout(' '.join('%02x' % ord(c) for c in data) + '\r\n')
+
+    def _stdout(self, data):
+        done = self.uart0.write(data)
+        self.clock.at(done, 'stdout', self._hook, 'HOOK_STDOUT')
+
+    # Results
+
+    def summary(self):
+        """Totals so far, in plain units"""
+        self.meter.settle()
+        secs = self.clock.now / 1e6
+        awake = self.meter.time_in.get(('mcu', 'active'), 0) / 1e6
+        rx = self.meter.time_in.get(('radio', 'rx'), 0) / 1e6
+        charge = self.meter.total_uc()
+        reports = self.stats['rpcs'].get('rm150_rpt', 0)
+        s = {
+            'seconds': secs,
+            'awake_s': awake,
+            'rx_s': rx,
+            'hooks': self.stats['hooks'],
+            'sleeps': self.stats['sleeps'],
+            'tx_packets': self.stats['tx_packets'],
+            'tx_bytes': self.stats['tx_bytes'],
+            'mcast_ttl': self.stats['mcast_ttl'],
+            'rx_packets': self.stats['rx_packets'],
+            'rx_lost': self.stats['rx_lost'],
+            'reports': reports,
+            'uart0_bytes': self.uart0.tx_bytes,
+            'adc_conversions': self.ads1.conversions + self.ads2.conversions,
+            'flash_programs': self.flash.programs,
+            'charge_uc': charge,
+            'charge_by_part_uc': self.meter.by_part_uc(),
+            'avg_ua': charge / secs if secs else 0.0,
+            'uc_per_report': charge / reports if reports else None,
+        }
+        if self.gateway is not None:
+            g = self.gateway.tracker.stats(self.addr)
+            if g['delivery_rate'] is None and self.gateway.reports:
+                # Unnumbered reports (REPORT_ACKED off): only the count arriving is known
+                g.update(received=len(self.gateway.reports), lost=None)
+            s['gateway'] = g
+        return s
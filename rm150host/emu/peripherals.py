@@ -0,0 +1,299 @@
+# Copyright (C) 2014 Synapse Wireless, Inc.
+"""The hardware the node's scripts talk to, as the emulator models it.
+   Register models answer peek()/poke() at their addresses; SPI and I2C devices answer
+   spiXfer() / i2cRead() / i2cWrite() while selected. Each has the settings a test would
+   want to change (temperatures, battery voltage) as plain attributes.
+"""
+
+from rm150host import tc_tables
+
+SYM_TICK_US = 16  # MAC symbol counter, 62.5kHz
+
+UART_BYTE_US = 87  # 10 bits at 115.2k
+SPI_BYTE_US = 8  # 1MHz SPI clock
+
+
+class SymbolCounter(object):
+    """SCCNT (0xE1-0xE4, LSB first). Reading the LSB latches all four bytes; writing it
+       strobes in the three written before it. Runs from the RTC, so it counts through sleep.
+    """
+    REGS = (0xE1, 0xE2, 0xE3, 0xE4)
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.offset = 0
+        self._latched = 0
+        self._staged = [0, 0, 0, 0]
+
+    def count(self):
+        return (self.clock.now // SYM_TICK_US + self.offset) & 0xFFFFFFFF
+
+    def peek(self, addr):
+        i = addr - 0xE1
+        if i == 0:
+            self._latched = self.count()
+        return (self._latched >> (8 * i)) & 0xFF
+
+    def poke(self, addr, value):
+        i = addr - 0xE1
+        self._staged[i] = value & 0xFF
+        if i == 0:
+            value = sum(b << (8 * n) for n, b in enumerate(self._staged))
+            self.offset = value - self.clock.now // SYM_TICK_US
+
+
+class Batmon(object):
+    """BATMON (0x151): write a threshold, read back whether the battery is above it"""
+    REG = 0x151
+    HR = 0x10
+    OK = 0x20
+
+    def __init__(self, mv=3000):
+        self.mv = mv
+        self.value = 0
+
+    def threshold(self):
+        vth = self.value & 0x0F
+        if self.value & self.HR:
+            return 2550 + 75 * vth
+        return 1700 + 50 * vth
+
+    def peek(self, addr):
+        ok = self.OK if self.mv > self.threshold() else 0
+        return (self.value & 0x1F) | ok
+
+    def poke(self, addr, value):
+        self.value = value & 0x1F
+
+
+class Uart0(object):
+    """UART0 to the display's XMEGA. STDOUT (print) goes out in the background through
+       SNAP's driver, with HOOK_STDOUT once it has; the registers serve tx_uart0()'s polled path.
+    """
+    UCSR0A = 0xC0
+    UCSR0B = 0xC1
+    UDR0 = 0xC6
+    UDRE = 0x20
+    TXC = 0x40
+    REGS = (UCSR0A, UCSR0B, UDR0)
+
+    def __init__(self, node, record=False):
+        self.node = node
+        self.tx_bytes = 0
+        self.busy_until = 0
+        self.sent = bytearray() if record else None
+        self._regs = {self.UCSR0A: self.UDRE | self.TXC, self.UCSR0B: 0}
+
+    def _send(self, data):
+        self.tx_bytes += len(data)
+        if self.sent is not None:
+            self.sent += data
+        self.node.meter.pulse('uart0', 'tx', len(data) * UART_BYTE_US)
+
+    def write(self, data):
+        """STDOUT: returns the time the last byte is out"""
+        start = max(self.busy_until, self.node.clock.now)
+        self.busy_until = start + len(data) * UART_BYTE_US
+        self._send(data)
+        return self.busy_until
+
+    def peek(self, addr):
+        return self._regs.get(addr, 0)
+
+    def poke(self, addr, value):
+        if addr == self.UDR0:
+            self._send(chr(value & 0xFF))
+            self.node.clock.advance(UART_BYTE_US)  # UDRE polling waits out each byte
+        else:
+            self._regs[addr] = value
+
+
+class Buzzer(object):
+    """Timer 3 driving the buzzer from OC3B: on while COM3B is set in TCCR3A"""
+    TCCR3A = 0x90
+    REGS = tuple(range(0x90, 0x9E))
+
+    def __init__(self, node):
+        self.node = node
+        self.on = False
+        self.notes = 0
+        self._regs = {}
+
+    def peek(self, addr):
+        return self._regs.get(addr, 0)
+
+    def poke(self, addr, value):
+        self._regs[addr] = value & 0xFF
+        if addr == self.TCCR3A:
+            on = (value >> 4) & 0x03 != 0
+            if on and not self.on:
+                self.notes += 1
+            if on != self.on:
+                self.on = on
+                self.node.meter.set_state('buzzer', 'on' if on else 'off')
+
+
+class Ads1118(object):
+    """ADS1118 in single-shot mode: writing a config with SS set starts a conversion, whose
+       result comes back on the next transfer. DOUT/DRDY (MISO) is low while selected and a
+       new result is waiting.
+       internal_c is the die (cold junction) temperature; probe_c the thermocouple tip, None
+       for no probe (the input floats to full scale).
+    """
+    RATES = (8, 16, 32, 64, 128, 250, 475, 860)
+    FSR_MV = (6144, 4096, 2048, 1024, 512, 256, 256, 256)
+
+    def __init__(self, node, part, internal_c=25.0, probe_c=None, tc='K'):
+        self.node = node
+        self.part = part
+        self.internal_c = internal_c
+        self.probe_c = probe_c
+        self.tc = tc
+        self.config = 0x058B  # power-on default
+        self.result = 0
+        self.done_at = None  # conversion in progress until then
+        self.ready = False
+        self.conversions = 0
+
+    def _update(self):
+        if self.done_at is not None and self.node.clock.now >= self.done_at:
+            self.done_at = None
+            self.ready = True
+
+    def drdy_low(self):
+        self._update()
+        return self.ready
+
+    def conversion_end(self):
+        """Time the conversion in progress finishes, or None"""
+        self._update()
+        return self.done_at
+
+    def xfer(self, data):
+        self._update()
+        out = chr((self.result >> 8) & 0xFF) + chr(self.result & 0xFF)
+        out = (out * 2)[:len(data)]
+        self.ready = False
+        if len(data) >= 2:
+            config = ord(data[0]) << 8 | ord(data[1])
+            if config & 0x0006 == 0x0002:  # NOP field says valid data
+                self.config = config
+                if config & 0x8100 == 0x8100 and self.done_at is None:
+                    self._start()
+        return out
+
+    def _start(self):
+        sps = self.RATES[(self.config >> 5) & 0x07]
+        us = 1000000 // sps
+        self.done_at = self.node.clock.now + us
+        self.result = self._convert()
+        self.conversions += 1
+        self.node.meter.pulse(self.part, 'converting', us)
+
+    def _convert(self):
+        if self.config & 0x0010:
+            # Internal temp: 14 bits left justified, 0.03125C per count
+            return (int(round(self.internal_c / 0.03125)) << 2) & 0xFFFF
+        if self.probe_c is None:
+            return 0x7FFF
+        mv = tc_tables.emf_mv(self.tc, self.probe_c) - tc_tables.emf_mv(self.tc, self.internal_c)
+        fsr = self.FSR_MV[(self.config >> 9) & 0x07]
+        count = int(round(mv * 32768.0 / fsr))
+        return max(-32768, min(32767, count)) & 0xFFFF
+
+
+class At45db(object):
+    """AT45DB serial flash: ultra-deep power-down, buffer 1 write, buffer-to-page program,
+       status and low power continuous read. Page contents persist for the life of the node.
+    """
+    PAGE_SIZE = 264
+    PROGRAM_US = 17000  # typical page erase and program
+
+    def __init__(self, node, part):
+        self.node = node
+        self.part = part
+        self.udeep = False
+        self.buffer = bytearray(self.PAGE_SIZE)
+        self.pages = {}
+        self.busy_until = 0
+        self.programs = 0
+
+    def _page_offset(self, a0, a1, a2):
+        return (a0 << 7) | (a1 >> 1), ((a1 & 0x01) << 8) | a2
+
+    def xfer(self, data):
+        out = bytearray(len(data))
+        if self.udeep:
+            # Any command just wakes it
+            self.udeep = False
+            self.node.meter.set_state(self.part, 'standby')
+            return str(out)
+
+        cmd = ord(data[0])
+        if cmd == 0x79:
+            self.udeep = True
+            self.node.meter.set_state(self.part, 'udeep')
+        elif cmd == 0x84 and len(data) > 4:
+            page, offset = self._page_offset(*bytearray(data[1:4]))
+            for i, b in enumerate(bytearray(data[4:])):
+                self.buffer[(offset + i) % self.PAGE_SIZE] = b
+        elif cmd == 0x83 and len(data) >= 4:
+            page, offset = self._page_offset(*bytearray(data[1:4]))
+            self.pages[page] = bytearray(self.buffer)
+            self.busy_until = self.node.clock.now + self.PROGRAM_US
+            self.programs += 1
+            self.node.meter.pulse(self.part, 'program', self.PROGRAM_US)
+        elif cmd == 0xD7 and len(data) > 1:
+            ready = 0x80 if self.node.clock.now >= self.busy_until else 0
+            out[1:] = chr(ready | 0x2C) * (len(data) - 1)
+        elif cmd == 0x01 and len(data) > 4:
+            page, offset = self._page_offset(*bytearray(data[1:4]))
+            for i in range(4, len(data)):
+                stored = self.pages.get(page)
+                out[i] = stored[offset] if stored is not None else 0xFF
+                offset += 1
+                if offset >= self.PAGE_SIZE:
+                    page, offset = page + 1, 0
+        return str(out)
+
+
+class Hih61(object):
+    """HIH61xx humidity/temperature on I2C. A write starts a measurement; a read returns the
+       4 data bytes, marked stale until the measurement is done and after they have been read.
+    """
+    WRITE = 0x4E
+    READ = 0x4F
+    MEASURE_US = 36650
+
+    def __init__(self, node, part, rh=45.0, temp_c=22.0, present=True):
+        self.node = node
+        self.part = part
+        self.rh = rh
+        self.temp_c = temp_c
+        self.present = present
+        self.done_at = None
+        self.fresh = False
+        self.result = 0  # of the last transaction, as getI2cResult()
+
+    def write(self, data):
+        if not self.present or ord(data[0]) != self.WRITE:
+            self.result = 4  # no ack
+            return
+        self.result = 1
+        self.done_at = self.node.clock.now + self.MEASURE_US
+        self.fresh = True
+        self.node.meter.pulse(self.part, 'measuring', self.MEASURE_US)
+
+    def read(self, data, count):
+        if not self.present or ord(data[0]) != self.READ:
+            self.result = 4
+            return ''
+        self.result = 1
+        stale = not self.fresh or self.done_at is None or self.node.clock.now < self.done_at
+        if not stale:
+            self.fresh = False
+        humid = int(round(self.rh / 100.0 * 16382)) & 0x3FFF
+        temp = int(round((self.temp_c + 40) / 165.0 * 16382)) & 0x3FFF
+        out = chr((0x40 if stale else 0) | humid >> 8) + chr(humid & 0xFF) + \
+            chr(temp >> 6) + chr((temp << 2) & 0xFF)
+        return out[:count]
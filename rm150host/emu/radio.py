@@ -0,0 +1,86 @@
+# Copyright (C) 2014 Synapse Wireless, Inc.
+"""Radio side of the emulator: what an RPC costs on the air, and a gateway that answers.
+   Packet sizes are estimates of a SNAP RPC over 802.15.4: PHY and MAC framing, the SNAP
+   mesh header, then the function name and each argument with a type byte.
+"""
+
+import random
+
+from rm150host import codec, delivery
+
+PHY_BYTES = 6  # preamble, SFD, length
+MAC_BYTES = 11  # frame control, sequence, PAN, addresses, FCS
+SNAP_BYTES = 10  # mesh header: addresses, TTL, command, sequence
+ACK_BYTES = PHY_BYTES + 5
+BYTE_US = 32  # 250kbps
+TURNAROUND_US = 192
+BACKOFF_US = 320  # CSMA unit backoff period
+
+
+def arg_bytes(arg):
+    if arg is None or isinstance(arg, bool):
+        return 1
+    if isinstance(arg, int):
+        return 3
+    return 2 + len(arg)
+
+
+def packet_bytes(name, args):
+    """Bytes on the air for one RPC packet"""
+    return PHY_BYTES + MAC_BYTES + SNAP_BYTES + 1 + len(name) + sum(arg_bytes(a) for a in args)
+
+
+def tx_us(nbytes, unicast, rng):
+    """Time from handing the packet to the radio until it has gone (and been acked)"""
+    us = rng.randint(0, 7) * BACKOFF_US + TURNAROUND_US + nbytes * BYTE_US
+    if unicast:
+        us += TURNAROUND_US + ACK_BYTES * BYTE_US
+    return us
+
+
+class Gateway(object):
+    """A gateway hops away from the node. It decodes every rm150_rpt it hears and, if answer
+       is set, calls gw_resp(hops, seq) back reply_ms later, as rm150host.codec's example
+       does; with tell_hops it passes the real hop count rather than 0. A multicast report
+       reaches it only if its TTL covers the hops. Each packet either way is lost with
+       probability loss.
+    """
+
+    def __init__(self, addr='\x00\x00\x01', hops=1, loss=0.0, answer=True, reply_ms=15,
+                 lq=45, tell_hops=False, seed=1):
+        self.addr = addr
+        self.hops = hops
+        self.tell_hops = tell_hops
+        self.loss = loss
+        self.answer = answer
+        self.reply_ms = reply_ms
+        self.lq = lq  # what the node's getLq() reads for our packets (-dBm)
+        self.rng = random.Random(seed)
+        self.tracker = delivery.SeqTracker()
+        self.reports = []  # decoded first copies
+        self.heard = 0
+        self.log_pages = 0
+
+    def _lost(self):
+        return self.loss and self.rng.random() < self.loss
+
+    def receive(self, node, name, args, ttl):
+        """The node sent name(*args), multicast with ttl or unicast (ttl None) to us"""
+        if ttl is not None and ttl < self.hops:
+            return
+        if self._lost():
+            return
+        self.heard += 1
+
+        if name == 'rm150_log':
+            self.log_pages += 1
+            return
+        if name != 'rm150_rpt':
+            return
+
+        report = codec.decode_rpt(args, node.addr)
+        if self.tracker.accept(report):
+            self.reports.append(report)
+        if self.answer and not self._lost():
+            hops = self.hops if self.tell_hops else 0
+            node.receive(self.reply_ms * 1000, self.addr, self.lq, 'gw_resp', hops, report.get('seq', 0))
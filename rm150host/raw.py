@@ -0,0 +1,86 @@
+# Copyright (C) 2014 Synapse Wireless, Inc.
+"""Convert raw reports (RPT_F_RAW, see drivers/report_fmt.py) at the gateway.
+   Does what the node does in temp_meas.py and HIH61_Humidity.py, with rm150host.convert,
+   over every sample of every report at once. The node applies no offsets in raw mode, so
+   they are given here, named as in rm150.py's configuration.
+
+   Ex.
+     reports = [decode_rpt(args, addr) for args, addr in received]
+     convert_reports(reports, {'OFFSET_EXTERNAL_1': -5})
+     reports[0]['samples'][0]['ext1']
+"""
+
+import numpy as np
+
+from drivers.HIH61_Humidity import HIH61_ERR_VAL
+from drivers.report_fmt import RPT_F_RAW
+from drivers.thermocouple import MIN_TEMP, MAX_TEMP
+from rm150host import convert
+
+OFFSETS = ('OFFSET_AMBIENT_1', 'OFFSET_AMBIENT_2', 'OFFSET_EXTERNAL_1', 'OFFSET_EXTERNAL_2',
+           'OFFSET_HUMIDITY')
+
+
+def cold_junction(cj_raw, offset=0):
+    """temp_read_step2(): returns (cold junction tenths C, cold junction count)"""
+    cold_tmp = convert.ads_conv_internal_temp_C(cj_raw) + offset
+    return cold_tmp, convert.C_to_adc(cold_tmp)
+
+
+def thermocouple(therm_raw, cold_count, offset=0):
+    """temp_read_step3(): tenths C, offset applied unless at a rail"""
+    tmp = convert.adc_cj_to_C(therm_raw, cold_count)
+    return np.where((tmp < MAX_TEMP * 10) & (tmp > MIN_TEMP * 10), tmp + offset, tmp)
+
+
+def convert_raw(cj1, hih61, therm1, cj2, therm2, offsets=None):
+    """Arrays in (hih61 as an (n, 4) byte array), dict of arrays out: amb_temp, humid, ext1, ext2.
+       humid is HIH61_ERR_VAL where the reading failed. Leave out (None) what wasn't reported.
+    """
+    offs = dict.fromkeys(OFFSETS, 0)
+    offs.update(offsets or {})
+
+    out = {}
+    if cj1 is not None:
+        amb, cold1 = cold_junction(cj1, offs['OFFSET_AMBIENT_1'])
+        out['amb_temp'] = amb
+        if therm1 is not None:
+            out['ext1'] = thermocouple(therm1, cold1, offs['OFFSET_EXTERNAL_1'])
+    if cj2 is not None and therm2 is not None:
+        cold2 = cold_junction(cj2, offs['OFFSET_AMBIENT_2'])[1]
+        out['ext2'] = thermocouple(therm2, cold2, offs['OFFSET_EXTERNAL_2'])
+    if hih61 is not None:
+        humid = convert.HIH61_humid(hih61, offs['OFFSET_HUMIDITY'])
+        out['humid'] = np.where(convert.HIH61_valid(hih61), humid, HIH61_ERR_VAL)
+    return out
+
+
+def convert_reports(reports, offsets=None):
+    """Add amb_temp, humid (None if the read failed), ext1 and ext2, as reported, to every
+       sample of the raw reports in a list of decoded reports (rm150host.codec.decode_rpt()).
+       Returns reports.
+    """
+    # Samples with the same flags carry the same fields, so convert them together
+    groups = {}
+    for report in reports:
+        if report.get('flags', 0) & RPT_F_RAW:
+            groups.setdefault(report['flags'], []).extend(report['samples'])
+
+    for samples in groups.values():
+        def column(key):
+            if key not in samples[0]:
+                return None
+            return np.array([s[key] for s in samples], dtype=np.int32)
+
+        hih61 = None
+        if 'hih61_raw' in samples[0]:
+            hih61 = np.frombuffer(b''.join(s['hih61_raw'] for s in samples), dtype=np.uint8).reshape(-1, 4)
+
+        out = convert_raw(column('cj1_raw'), hih61, column('ext1_raw'), column('cj2_raw'),
+                          column('ext2_raw'), offsets)
+        for key, values in out.items():
+            for sample, value in zip(samples, values.tolist()):
+                if key == 'humid' and value == HIH61_ERR_VAL:
+                    value = None
+                sample[key] = value
+    return reports
@@ -0,0 +1,237 @@
+# Copyright (C) 2014 Synapse Wireless, Inc.
+"""Run SNAPpy scripts under CPython, for host-side tests and benchmarks.
+   Scripts are compiled with the node's integer semantics: ints are 16-bit signed and wrap
+   (literals included, so 0x8000 is -32768), and / and % truncate toward zero. Every module
+   loaded into a namespace shares its globals, as all scripts in one image do on the node.
+   call() runs the scripts' native (AVR machine code) functions through Python equivalents,
+   found by the name of the global holding the code (NATIVE_NAMES). rm150host.bench_convert
+   checks them against the machine code, run by rm150host.avr.
+
+   Ex.
+     ns = new_namespace()
+     load('thermocouple', ns)
+     ns['adc_to_C'](1000)
+"""
+
+import ast
+import os
+
+DRIVERS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'drivers')
+
+
+def i16(value):
+    """Wrap an int to 16-bit signed"""
+    value &= 0xFFFF
+    if value & 0x8000:
+        return value - 0x10000
+    return value
+
+
+def _div(a, b):
+    q = abs(a) // abs(b)
+    if (a < 0) != (b < 0):
+        q = -q
+    return q
+
+
+def _int_op(int_op, py_op):
+    def wrapped(a, b):
+        if type(a) in (int, bool) and type(b) in (int, bool):
+            return i16(int_op(a, b))
+        return py_op(a, b)
+    return wrapped
+
+
+def _mod(a, b):
+    return a - b * _div(a, b)
+
+
+def _format(fmt, args):
+    try:
+        return fmt % args
+    except OverflowError:
+        # "%c" of a negative value; SNAPpy just takes the low byte
+        if not isinstance(args, tuple):
+            args = (args,)
+        return fmt % tuple(a & 0xFF if type(a) is int else a for a in args)
+
+
+_OPS = {}
+for _node, _py, _int in (
+        (ast.Add, lambda a, b: a + b, None),
+        (ast.Sub, lambda a, b: a - b, None),
+        (ast.Mult, lambda a, b: a * b, None),
+        (ast.Div, lambda a, b: a / b, _div),
+        (ast.FloorDiv, lambda a, b: a // b, _div),
+        (ast.Mod, _format, _mod),
+        (ast.LShift, lambda a, b: a << b, None),
+        (ast.RShift, lambda a, b: a >> b, None),
+        (ast.BitAnd, lambda a, b: a & b, None),
+        (ast.BitOr, lambda a, b: a | b, None),
+        (ast.BitXor, lambda a, b: a ^ b, None)):
+    _OPS[_node] = ('_snappy_' + _node.__name__.lower(), _int_op(_int or _py, _py))
+
+
+def _neg(a):
+    if type(a) in (int, bool):
+        return i16(-a)
+    return -a
+
+
+def _invert(a):
+    if type(a) in (int, bool):
+        return i16(~a)
+    return ~a
+
+
+class _Int16(ast.NodeTransformer):
+    """Route arithmetic through the 16-bit helpers, and wrap int literals"""
+
+    def visit_Num(self, node):
+        if isinstance(node.n, (int, long)):
+            return ast.copy_location(ast.Num(n=i16(node.n)), node)
+        return node
+
+    def visit_BinOp(self, node):
+        self.generic_visit(node)
+        return ast.copy_location(self._call(_OPS[type(node.op)][0], [node.left, node.right]), node)
+
+    def visit_AugAssign(self, node):
+        self.generic_visit(node)
+        target = node.target
+        load = ast.copy_location(self._load(target), target)
+        value = self._call(_OPS[type(node.op)][0], [load, node.value])
+        return ast.copy_location(ast.Assign(targets=[target], value=value), node)
+
+    def visit_UnaryOp(self, node):
+        self.generic_visit(node)
+        if isinstance(node.op, ast.USub):
+            if isinstance(node.operand, ast.Num):
+                return ast.copy_location(ast.Num(n=i16(-node.operand.n)), node)
+            return ast.copy_location(self._call('_snappy_neg', [node.operand]), node)
+        if isinstance(node.op, ast.Invert):
+            return ast.copy_location(self._call('_snappy_invert', [node.operand]), node)
+        return node
+
+    @staticmethod
+    def _call(name, args):
+        return ast.Call(func=ast.Name(id=name, ctx=ast.Load()), args=args, keywords=[],
+                        starargs=None, kwargs=None)
+
+    @staticmethod
+    def _load(target):
+        if isinstance(target, ast.Name):
+            return ast.Name(id=target.id, ctx=ast.Load())
+        if isinstance(target, ast.Subscript):
+            return ast.Subscript(value=target.value, slice=target.slice, ctx=ast.Load())
+        return ast.Attribute(value=target.value, attr=target.attr, ctx=ast.Load())
+
+
+class _Override(ast.NodeTransformer):
+    """Replace the value of module-level NAME = ... assignments, as if the script said otherwise"""
+
+    def __init__(self, overrides):
+        self.overrides = overrides
+
+    def visit_Module(self, node):
+        for stmt in node.body:
+            if isinstance(stmt, ast.Assign) and len(stmt.targets) == 1 and \
+               isinstance(stmt.targets[0], ast.Name) and stmt.targets[0].id in self.overrides:
+                value = ast.parse(repr(self.overrides[stmt.targets[0].id]), mode='eval').body
+                stmt.value = ast.copy_location(value, stmt.value)
+        return node
+
+
+def compile_snappy(source, filename, overrides=None):
+    """Compile SNAPpy source to a code object with the node's integer semantics.
+       overrides maps global names to the values (ints, strings, bools, None) their
+       module-level assignments should have instead.
+    """
+    tree = ast.parse(source, filename)
+    if overrides:
+        tree = _Override(overrides).visit(tree)
+    tree = _Int16().visit(tree)
+    ast.fix_missing_locations(tree)
+    return compile(tree, filename, 'exec')
+
+
+def native_c_to_f(arg):
+    """temp_meas.conv_func: tenths C * 9/5 by shifts and adds on the magnitude, truncating"""
+    x = abs(arg)
+    y = x * 9
+    z = (y + (y >> 1)) >> 1
+    u = z + (z >> 4)
+    v = u + (u >> 8)
+    r = (v >> 2) & 0xFFFF
+    return i16(-r if arg < 0 else r)
+
+
+# Python equivalents of native functions, by the name of the global holding the machine code
+NATIVE_NAMES = {'conv_func': native_c_to_f}
+
+
+def _call(namespace, func, *args):
+    for name, impl in NATIVE_NAMES.items():
+        if namespace.get(name) == func:
+            return impl(*args)
+    raise ValueError("call() of unknown native code")
+
+
+class _FlatModule(object):
+    """What an import statement in a script gets: a view onto the shared namespace"""
+
+    def __init__(self, namespace):
+        self.__dict__['_ns'] = namespace
+
+    def __getattr__(self, name):
+        try:
+            return self._ns[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+def new_namespace(builtins=None, overrides=None):
+    """Return a namespace for loading scripts into. builtins maps names to the SNAPpy
+       built-in functions the scripts call (peek, spiXfer, ...), e.g. from an emulator.
+       overrides changes script settings as they load (see compile_snappy()).
+    """
+    import __builtin__
+
+    ns = {}
+    host_builtins = dict(vars(__builtin__))
+    host_builtins['__import__'] = lambda name, globs=None, locs=None, fromlist=(), level=-1: \
+        _import(ns, name, fromlist)
+    ns['__builtins__'] = host_builtins
+    ns['_snappy_loaded'] = set()
+    ns['_snappy_overrides'] = dict(overrides or {})
+    for name, func in _OPS.values():
+        ns[name] = func
+    ns['_snappy_neg'] = _neg
+    ns['_snappy_invert'] = _invert
+    ns['chr'] = lambda c: chr(c & 0xFF)
+    ns['call'] = lambda func, *args: _call(ns, func, *args)
+    if builtins:
+        ns.update(builtins)
+    return ns
+
+
+def load(name, namespace, path=None):
+    """Load the script 'name' (from drivers/ unless path is given) into namespace, once"""
+    if name in namespace['_snappy_loaded']:
+        return
+    namespace['_snappy_loaded'].add(name)
+    if path is None:
+        path = os.path.join(DRIVERS_DIR, name + '.py')
+    with open(path) as f:
+        source = f.read().replace('\r\n', '\n')
+    exec compile_snappy(source, path, namespace.get('_snappy_overrides')) in namespace
+
+
+def _import(namespace, name, fromlist):
+    """Scripts import each other by module name, optionally as drivers.name. Anything that is
+       not a script (the synapse.* modules, sys, ...) is provided by the namespace's builtins.
+    """
+    base = name.split('.')[-1]
+    if os.path.exists(os.path.join(DRIVERS_DIR, base + '.py')):
+        load(base, namespace)
+    return _FlatModule(namespace)
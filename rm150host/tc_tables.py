@@ -0,0 +1,428 @@
+# Copyright (C) 2014 Synapse Wireless, Inc.
+"""Thermocouple table generator for the node's SNAPpy conversion code.
+   Computes tables from the NIST ITS-90 reference polynomials (types J, K, T, E) for the
+   ADS1118 at +-256mV full scale, and emits a SNAPpy module with the tables and matching
+   <type>_adc_to_C() / <type>_C_to_adc() functions (tenths C). The emitted code is then run
+   through rm150host.snappy against the NIST curve and its worst errors reported.
+
+   Two layouts:
+     uniform     - one 16-bit count per fixed temperature step, as drivers/thermocouple.py;
+                   2 bytes per point
+     non-uniform - breakpoints placed where the curve needs them, as pairs of 16-bit count and
+                   16-bit tenths C; 4 bytes per point, but usually far fewer points for the
+                   same error. Breakpoints are chosen for the smallest max error that fits the
+                   byte budget (--budget, at most two strings), or the fewest points within
+                   --max-err.
+   Either way a reverse index (one byte per bucket of counts) takes adc_to_C straight to its
+   segment; it is not counted in the budget. Segments are also kept small enough that the
+   interpolation cannot overflow 16 bits.
+
+   Usage (from the root of this tree):
+     python -m rm150host.tc_tables K --uniform 10 --min -100 --max 1160   # drivers/thermocouple.py
+     python -m rm150host.tc_tables J --budget 300 -o j_type.py
+     python -m rm150host.tc_tables T --max-err 0.2
+"""
+
+import math
+import optparse
+import sys
+
+from rm150host import snappy
+
+COUNTS_PER_MV = 128  # ADS1118, 16 bits over +-256mV
+MAX_STRING = 254  # bytes in one SNAPpy string literal (127 16-bit ints)
+I16_MAX = 32767
+
+# NIST ITS-90 reference functions, E(mV) = sum(c[i] * t**i) [+ a0 * exp(a1 * (t - a2)**2)],
+# as (t_low, t_high, coefficients, exponential term or None) per range, t in C
+NIST = {
+    'J': (
+        (-210.0, 760.0, (
+            0.000000000000E+00, 0.503811878150E-01, 0.304758369300E-04, -0.856810657200E-07,
+            0.132281952950E-09, -0.170529583370E-12, 0.209480906970E-15, -0.125383953360E-18,
+            0.156317256970E-22), None),
+        (760.0, 1200.0, (
+            0.296456256810E+03, -0.149761277860E+01, 0.317871039240E-02, -0.318476867010E-05,
+            0.157208190040E-08, -0.306913690560E-12), None),
+    ),
+    'K': (
+        (-270.0, 0.0, (
+            0.000000000000E+00, 0.394501280250E-01, 0.236223735980E-04, -0.328589067840E-06,
+            -0.499048287770E-08, -0.675090591730E-10, -0.574103274280E-12, -0.310888728940E-14,
+            -0.104516093650E-16, -0.198892668780E-19, -0.163226974860E-22), None),
+        (0.0, 1372.0, (
+            -0.176004136860E-01, 0.389212049750E-01, 0.185587700320E-04, -0.994575928740E-07,
+            0.318409457190E-09, -0.560728448890E-12, 0.560750590590E-15, -0.320207200030E-18,
+            0.971511471520E-22, -0.121047212750E-25),
+         (0.118597600000E+00, -0.118343200000E-03, 0.126968600000E+03)),
+    ),
+    'T': (
+        (-270.0, 0.0, (
+            0.000000000000E+00, 0.387481063640E-01, 0.441944343470E-04, 0.118443231050E-06,
+            0.200329735540E-07, 0.901380195590E-09, 0.226511565930E-10, 0.360711542050E-12,
+            0.384939398830E-14, 0.282135219250E-16, 0.142515947790E-18, 0.487686622860E-21,
+            0.107955392700E-23, 0.139450270620E-26, 0.797951539270E-30), None),
+        (0.0, 400.0, (
+            0.000000000000E+00, 0.387481063640E-01, 0.332922278800E-04, 0.206182434040E-06,
+            -0.218822568460E-08, 0.109968809280E-10, -0.308157587720E-13, 0.454791352900E-16,
+            -0.275129016730E-19), None),
+    ),
+    'E': (
+        (-270.0, 0.0, (
+            0.000000000000E+00, 0.586655087080E-01, 0.454109771240E-04, -0.779980486860E-06,
+            -0.258001608430E-07, -0.594525830570E-09, -0.932140586670E-11, -0.102876055340E-12,
+            -0.803701236210E-15, -0.439794973910E-17, -0.164147763550E-19, -0.396736195160E-22,
+            -0.558273287210E-25, -0.346578420130E-28), None),
+        (0.0, 1000.0, (
+            0.000000000000E+00, 0.586655087100E-01, 0.450322755820E-04, 0.289084072120E-07,
+            -0.330568966520E-09, 0.650244032700E-12, -0.191974955040E-15, -0.125366004970E-17,
+            0.214892175690E-20, -0.143880417820E-23, 0.359608994810E-27), None),
+    ),
+}
+
+# Default temperature span (C) per type: the useful part of the NIST range that fits a table
+DEFAULT_SPAN = {'J': (-200, 1200), 'K': (-100, 1160), 'T': (-200, 400), 'E': (-200, 1000)}
+
+
+class TableError(ValueError):
+    pass
+
+
+def emf_mv(tc, t):
+    """NIST reference EMF (mV) of thermocouple type tc at t C (cold junction at 0C)"""
+    for t_low, t_high, coeffs, exp_term in NIST[tc]:
+        if t <= t_high:
+            break
+    emf = 0.0
+    for c in reversed(coeffs):
+        emf = emf * t + c
+    if exp_term:
+        a0, a1, a2 = exp_term
+        emf += a0 * math.exp(a1 * (t - a2) ** 2)
+    return emf
+
+
+def temp_c(tc, mv):
+    """Invert emf_mv() by bisection"""
+    lo, hi = NIST[tc][0][0], NIST[tc][-1][1]
+    for _ in range(60):
+        mid = (lo + hi) / 2.0
+        if emf_mv(tc, mid) < mv:
+            lo = mid
+        else:
+            hi = mid
+    return (lo + hi) / 2.0
+
+
+def count_at(tc, t):
+    """ADC count at t C, from the EMF rounded to 1uV as in the published NIST tables"""
+    return int(round(round(emf_mv(tc, t), 3) * COUNTS_PER_MV))
+
+
+class Curve(object):
+    """The NIST curve sampled at every ADC count over a span"""
+
+    def __init__(self, tc, t_min, t_max):
+        for t in (t_min, t_max):
+            if not NIST[tc][0][0] <= t <= NIST[tc][-1][1]:
+                raise TableError("%gC is outside the NIST range for type %s" % (t, tc))
+        self.tc = tc
+        self.t_min, self.t_max = t_min, t_max
+        self.min_adc, self.max_adc = count_at(tc, t_min), count_at(tc, t_max)
+        # exact tenths C at each count
+        self.tenths = [temp_c(tc, float(c) / COUNTS_PER_MV) * 10
+                       for c in range(self.min_adc, self.max_adc + 1)]
+
+    def at(self, count):
+        return self.tenths[count - self.min_adc]
+
+
+def _interp(x, x0, x1, y0, y1):
+    """The node's interpolation: 16-bit ints, division truncating toward zero"""
+    num = (x - x0) * (y1 - y0)
+    q = abs(num) // (x1 - x0)
+    return y0 + (q if num >= 0 else -q)
+
+
+def _segment_error(curve, a, b, ta, tb):
+    worst = 0.0
+    for c in range(a, b + 1):
+        err = abs(_interp(c, a, b, ta, tb) - curve.at(c))
+        if err > worst:
+            worst = err
+    return worst
+
+
+def _fits(a, b, ta, tb):
+    return (b - a) * abs(tb - ta) <= I16_MAX
+
+
+def uniform_points(curve, step):
+    """Breakpoints every step C, counts rounded from the NIST curve"""
+    span = curve.t_max - curve.t_min
+    if span % step:
+        raise TableError("span %g-%gC is not a whole number of %gC steps" % (curve.t_min, curve.t_max, step))
+    n = int(span // step) + 1
+    if n * 2 > MAX_STRING:
+        raise TableError("%d points do not fit one string" % n)
+    points = [(count_at(curve.tc, curve.t_min + i * step), int(round((curve.t_min + i * step) * 10)))
+              for i in range(n)]
+    for (a, ta), (b, tb) in zip(points, points[1:]):
+        if not _fits(a, b, ta, tb) or b <= a:
+            raise TableError("a %gC step overflows the 16-bit interpolation" % step)
+    return points
+
+
+def nonuniform_points(curve, max_err):
+    """Fewest breakpoints (at whole counts, tenths C rounded from NIST) keeping the node's
+       interpolation within max_err tenths C of the curve. Greedy: each segment reaches as far
+       as it can.
+    """
+    def tenths(c):
+        return int(round(curve.at(c)))
+
+    def ok(a, b):
+        ta, tb = tenths(a), tenths(b)
+        return _fits(a, b, ta, tb) and _segment_error(curve, a, b, ta, tb) <= max_err
+
+    end = curve.max_adc
+    a = curve.min_adc
+    points = [(a, tenths(a))]
+    while a < end:
+        # gallop, then bisect for the furthest end the segment can reach
+        step = 1
+        while a + step < end and ok(a, a + step):
+            step *= 2
+        lo, hi = max(step // 2, 1), min(step, end - a)
+        if ok(a, a + hi):
+            lo = hi
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if ok(a, a + mid):
+                lo = mid
+            else:
+                hi = mid
+        a += lo
+        points.append((a, tenths(a)))
+    return points
+
+
+def fit_budget(curve, budget, max_err=None):
+    """Non-uniform breakpoints within budget bytes, for the smallest max error (tenths C) that
+       fits; or, given max_err, the fewest points that meet it (TableError if over budget).
+    """
+    limit = min(budget, 2 * MAX_STRING) // 4
+    if max_err is not None:
+        points = nonuniform_points(curve, max_err)
+        if len(points) > limit:
+            raise TableError("%.2fC needs %d points, %d bytes" % (max_err / 10.0, len(points), len(points) * 4))
+        return points
+
+    best = nonuniform_points(curve, float('inf'))
+    if len(best) > limit:
+        raise TableError("type %s needs at least %d points (%d bytes) to keep the 16-bit "
+                         "interpolation from overflowing" % (curve.tc, len(best), len(best) * 4))
+    lo, hi = 0.0, 50.0
+    for _ in range(16):
+        mid = (lo + hi) / 2
+        points = nonuniform_points(curve, mid)
+        if len(points) <= limit:
+            best, hi = points, mid
+        else:
+            lo = mid
+    return best
+
+
+def _pack(values):
+    s = ''
+    for v in values:
+        s += chr((v >> 8) & 0xFF) + chr(v & 0xFF)
+    return s
+
+
+def _index(points):
+    """Reverse index over counts: shift, index string, and whether a bucket can hold more
+       than one segment boundary
+    """
+    counts = [c for c, _ in points]
+    span = counts[-1] - counts[0]
+    shift = 0
+    while (span >> shift) + 1 > MAX_STRING:
+        shift += 1
+    index = ''
+    i = 0
+    for n in range((span >> shift) + 1):
+        c = counts[0] + (n << shift)
+        while counts[i + 1] <= c:
+            i += 1
+        index += chr(i)
+    narrowest = min(b - a for a, b in zip(counts, counts[1:]))
+    return shift, index, (1 << shift) > narrowest
+
+
+_UNIFORM_CODE = '''
+def %(p)s_C_to_adc(temp):
+    """Convert temperature in tenths of degree C to ADC count"""
+    if temp >= %(P)s_MAX_TEMP:
+        return %(P)s_MAX_ADC
+    elif temp <= %(P)s_MIN_TEMP:
+        return %(P)s_MIN_ADC
+
+    i = ((temp - %(P)s_MIN_TEMP) / %(P)s_STEP) * 2
+    low = ord(%(p)s_table[i]) << 8 | ord(%(p)s_table[i+1])
+    high = ord(%(p)s_table[i+2]) << 8 | ord(%(p)s_table[i+3])
+    mod = (temp - %(P)s_MIN_TEMP) %% %(P)s_STEP
+    return low + ((high - low) * mod) / %(P)s_STEP
+
+def %(p)s_adc_to_C(adc_count):
+    """Convert adc_count to temperature (tenths C)"""
+    if adc_count >= %(P)s_MAX_ADC:
+        return %(P)s_MAX_TEMP
+    elif adc_count <= %(P)s_MIN_ADC:
+        return %(P)s_MIN_TEMP
+
+    i = ord(%(p)s_index[(adc_count - %(P)s_MIN_ADC) >> %(P)s_INDEX_SHIFT])
+    j = i * 2
+    low = ord(%(p)s_table[j]) << 8 | ord(%(p)s_table[j+1])
+    high = ord(%(p)s_table[j+2]) << 8 | ord(%(p)s_table[j+3])
+    %(loop)s adc_count >= high:
+        i += 1
+        j += 2
+        low = high
+        high = ord(%(p)s_table[j+2]) << 8 | ord(%(p)s_table[j+3])
+    return i * %(P)s_STEP + %(P)s_MIN_TEMP + ((adc_count - low) * %(P)s_STEP) / (high - low)
+'''
+
+_NONUNIFORM_CODE = '''
+def %(p)s_C_to_adc(temp):
+    """Convert temperature in tenths of degree C to ADC count"""
+    if temp >= %(P)s_MAX_TEMP:
+        return %(P)s_MAX_ADC
+    elif temp <= %(P)s_MIN_TEMP:
+        return %(P)s_MIN_ADC
+
+    # Binary search for the segment
+    lo = 0
+    hi = %(P)s_POINTS - 1
+    while hi - lo > 1:
+        mid = (lo + hi) >> 1
+        i = mid * 2
+        if (ord(%(p)s_temp[i]) << 8 | ord(%(p)s_temp[i+1])) <= temp:
+            lo = mid
+        else:
+            hi = mid
+    i = lo * 2
+    t_low = ord(%(p)s_temp[i]) << 8 | ord(%(p)s_temp[i+1])
+    t_high = ord(%(p)s_temp[i+2]) << 8 | ord(%(p)s_temp[i+3])
+    low = ord(%(p)s_adc[i]) << 8 | ord(%(p)s_adc[i+1])
+    high = ord(%(p)s_adc[i+2]) << 8 | ord(%(p)s_adc[i+3])
+    return low + ((temp - t_low) * (high - low)) / (t_high - t_low)
+
+def %(p)s_adc_to_C(adc_count):
+    """Convert adc_count to temperature (tenths C)"""
+    if adc_count >= %(P)s_MAX_ADC:
+        return %(P)s_MAX_TEMP
+    elif adc_count <= %(P)s_MIN_ADC:
+        return %(P)s_MIN_TEMP
+
+    i = ord(%(p)s_index[(adc_count - %(P)s_MIN_ADC) >> %(P)s_INDEX_SHIFT]) * 2
+    high = ord(%(p)s_adc[i+2]) << 8 | ord(%(p)s_adc[i+3])
+    %(loop)s adc_count >= high:
+        i += 2
+        high = ord(%(p)s_adc[i+2]) << 8 | ord(%(p)s_adc[i+3])
+    low = ord(%(p)s_adc[i]) << 8 | ord(%(p)s_adc[i+1])
+    t_low = ord(%(p)s_temp[i]) << 8 | ord(%(p)s_temp[i+1])
+    t_high = ord(%(p)s_temp[i+2]) << 8 | ord(%(p)s_temp[i+3])
+    return t_low + ((adc_count - low) * (t_high - t_low)) / (high - low)
+'''
+
+
+def emit(tc, points, step=None):
+    """SNAPpy source for a table (uniform if step, in C, is given) and its conversions"""
+    p, P = tc.lower(), tc.upper()
+    shift, index, multi = _index(points)
+    fields = {'p': p, 'P': P, 'loop': 'while' if multi else 'if'}
+    lines = ['# Type %s thermocouple table, generated by rm150host/tc_tables.py - do not edit' % P,
+             '# %d points, %gC to %gC' % (len(points), points[0][1] / 10.0, points[-1][1] / 10.0),
+             '']
+    if step is not None:
+        lines += ['%s_STEP = %d  # tenths C between points' % (P, int(round(step * 10))),
+                  '%s_table = %r' % (p, _pack(c for c, _ in points))]
+    else:
+        lines += ['%s_POINTS = %d' % (P, len(points)),
+                  '%s_adc = %r  # counts' % (p, _pack(c for c, _ in points)),
+                  '%s_temp = %r  # tenths C' % (p, _pack(t for _, t in points))]
+    lines += ['%s_INDEX_SHIFT = %d' % (P, shift),
+              '%s_index = %r' % (p, index),
+              '%s_MIN_ADC = %d' % (P, points[0][0]),
+              '%s_MAX_ADC = %d' % (P, points[-1][0]),
+              '%s_MIN_TEMP = %d  # tenths C' % (P, points[0][1]),
+              '%s_MAX_TEMP = %d' % (P, points[-1][1]),
+              '']
+    code = _UNIFORM_CODE if step is not None else _NONUNIFORM_CODE
+    return '\n'.join(lines) + code % fields
+
+
+def check(curve, source):
+    """Run emitted source through rm150host.snappy. Returns the worst adc_to_C error (tenths C)
+       over every count in range, and the worst C_to_adc error (counts) over every tenth C.
+    """
+    ns = snappy.new_namespace()
+    exec snappy.compile_snappy(source, '<%s table>' % curve.tc) in ns
+    p = curve.tc.lower()
+    adc_to_C, C_to_adc = ns[p + '_adc_to_C'], ns[p + '_C_to_adc']
+
+    temp_err = max(abs(adc_to_C(c) - curve.at(c)) for c in range(curve.min_adc, curve.max_adc + 1))
+    count_err = max(abs(C_to_adc(t) - emf_mv(curve.tc, t / 10.0) * COUNTS_PER_MV)
+                    for t in range(int(curve.t_min * 10), int(curve.t_max * 10) + 1))
+    return temp_err, count_err
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage="%prog {J|K|T|E} [options]")
+    parser.add_option('--min', type='float', help="lowest temperature, C")
+    parser.add_option('--max', type='float', help="highest temperature, C")
+    parser.add_option('--uniform', type='float', metavar='STEP', help="uniform table every STEP C")
+    parser.add_option('--budget', type='int', default=2 * MAX_STRING,
+                      help="bytes for a non-uniform table (default %default)")
+    parser.add_option('--max-err', type='float', help="non-uniform: max adc_to_C error, C")
+    parser.add_option('-o', '--output', help="write the SNAPpy module here (default stdout)")
+    opts, args = parser.parse_args(argv)
+    if len(args) != 1 or args[0].upper() not in NIST:
+        parser.error("give one thermocouple type: J, K, T or E")
+    tc = args[0].upper()
+
+    t_min, t_max = DEFAULT_SPAN[tc]
+    if opts.min is not None:
+        t_min = opts.min
+    if opts.max is not None:
+        t_max = opts.max
+
+    try:
+        curve = Curve(tc, t_min, t_max)
+        if opts.uniform:
+            points = uniform_points(curve, opts.uniform)
+            nbytes = len(points) * 2
+        else:
+            max_err = opts.max_err * 10 if opts.max_err is not None else None
+            points = fit_budget(curve, opts.budget, max_err)
+            nbytes = len(points) * 4
+    except TableError as e:
+        sys.stderr.write("tc_tables: %s\n" % e)
+        return 1
+
+    source = emit(tc, points, opts.uniform)
+    temp_err, count_err = check(curve, source)
+    sys.stderr.write("type %s, %gC to %gC: %d points, %d table bytes\n" % (tc, t_min, t_max, len(points), nbytes))
+    sys.stderr.write("max error: adc_to_C %.2fC, C_to_adc %.2f counts\n" % (temp_err / 10.0, count_err))
+
+    if opts.output:
+        with open(opts.output, 'w') as f:
+            f.write(source)
+    else:
+        sys.stdout.write(source)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())